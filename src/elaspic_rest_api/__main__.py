@@ -1,4 +1,6 @@
+import asyncio
 import logging
+import os
 
 import fire
 
@@ -20,6 +22,41 @@ class CLI:
     def copy_scripts(self):
         return copy_scripts()
 
+    def benchmark_precalculated(
+        self, num_entries=1_000_000, num_lookups=100_000, bloom_bits_per_key=0
+    ):
+        from elaspic_rest_api.jobsubmitter.precalculated_index import benchmark
+
+        return benchmark(num_entries, num_lookups, bloom_bits_per_key)
+
+    def submit_campaign(
+        self,
+        tsv_file,
+        job_id,
+        api_url="http://localhost:8000/",
+        api_token=None,
+        job_type="database",
+        job_email=None,
+        max_mutations=100,
+    ):
+        """Stream mutations from `tsv_file` (one `<protein_id>.<mutation>` per line) to the API.
+
+        `api_token` defaults to the `API_TOKEN` environment variable.
+        """
+        from elaspic_rest_api.campaign import submit_campaign
+
+        return asyncio.run(
+            submit_campaign(
+                tsv_file,
+                str(job_id),
+                api_url,
+                api_token or os.environ["API_TOKEN"],
+                job_type=job_type,
+                job_email=job_email,
+                max_mutations=max_mutations,
+            )
+        )
+
 
 if __name__ == "__main__":
     fire.Fire(CLI)
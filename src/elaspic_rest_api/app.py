@@ -1,15 +1,17 @@
 import asyncio
 import logging
-from typing import Any, Dict
+from enum import Enum
+from typing import Any, Dict, Optional
 
 import sentry_sdk
-from fastapi import BackgroundTasks, FastAPI
+from fastapi import BackgroundTasks, FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse
 from sentry_sdk.integrations.asgi import SentryAsgiMiddleware
 
 import elaspic_rest_api
 from elaspic_rest_api import config
 from elaspic_rest_api import jobsubmitter as js
-from elaspic_rest_api.types import DataIn
+from elaspic_rest_api.types import DataIn, JobsIn
 
 logger = logging.getLogger(__name__)
 
@@ -31,35 +33,129 @@ app = FastAPI(
 js_data: Dict[str, Any] = {}
 
 
+class QueueName(str, Enum):
+    pre_qsub = "pre_qsub"
+    qsub = "qsub"
+    validation = "validation"
+    el2_pending = "el2_pending"
+    el2_running = "el2_running"
+
+
 @app.post("/", status_code=200)
 async def submit_job(data_in: DataIn, background_tasks: BackgroundTasks):
     if data_in.api_token == config.API_TOKEN:
-        background_tasks.add_task(js.submit_job, data_in, js_data["ds"])
+        ds: js.DataStructures = js_data["ds"]
+        try:
+            num_items = js.admission.controller.admit(data_in.api_token, data_in, ds)
+        except js.AdmissionRejected as e:
+            return get_rejected_response(e)
+        background_tasks.add_task(js.submit_admitted_job, data_in, ds, data_in.api_token, num_items)
         return {"status": "submitted"}
     else:
         return {"status": "restricted"}
 
 
+def get_rejected_response(error: js.AdmissionRejected, **content: Any) -> JSONResponse:
+    content = {
+        "status": "rejected",
+        "reason": error.reason,
+        "retry_after": error.retry_after,
+        **content,
+    }
+    if error.retry_after <= 0:
+        # The submission exceeds the limit on its own, so there is no point in retrying
+        return JSONResponse(content, status_code=413)
+    return JSONResponse(content, status_code=429, headers={"Retry-After": str(error.retry_after)})
+
+
+@app.post("/stream", status_code=200)
+async def submit_job_stream(
+    request: Request,
+    api_token: str,
+    job_id: str,
+    job_type: str,
+    job_email: Optional[str] = None,
+):
+    """Submit mutations from an NDJSON request body, with one `Mutations` object per line.
+
+    Mutations are queued while the body is being received. The returned `job_id` can be
+    passed to `/jobs/{job_id}` to follow the progress of the job.
+
+    Mutations are admitted in batches. If a batch exceeds the admission limits, the stream
+    is stopped and the response includes the `resume_line` from which to submit the rest
+    of the mutations once `retry_after` seconds have passed.
+    """
+    if api_token != config.API_TOKEN:
+        return {"status": "restricted"}
+    data_in = DataIn(
+        api_token=api_token, job_id=job_id, job_type=job_type, job_email=job_email, mutations=[]
+    )
+    result = await js.submit_job_stream(request.stream(), data_in, js_data["ds"])
+    if (rejected := result.pop("rejected")) is not None:
+        return get_rejected_response(rejected, **result)
+    return {"status": "submitted", **result}
+
+
 @app.get("/status", status_code=200)
-async def get_pre_qsub_queue(api_token: str):
-    queues_to_monitor = [
-        "pre_qsub_queue",
-        "qsub_queue",
-        "validation_queue",
-        "elaspic2_pending_queue",
-        "elaspic2_running_queue",
-    ]
+async def get_status(
+    api_token: str,
+    queue: Optional[QueueName] = None,
+    cursor: int = 0,
+    limit: int = Query(100, ge=1, le=config.STATUS_PAGE_MAX_SIZE),
+    if_none_match: Optional[str] = Header(None),
+):
+    """Return the size of each queue, or a page of the items in `queue` if it is specified.
+
+    Items are returned in queue order; pass the returned `next_cursor` to get the next page.
+    """
     ds: js.DataStructures = js_data["ds"]
     if api_token == config.API_TOKEN:
-        result = {
-            **{name: list(getattr(ds, name)._queue) for name in queues_to_monitor},
-            "monitored_jobs": [
-                (tuple(key), list(values)) for key, values in ds.monitored_jobs.items()
-            ],
-        }
+        if queue is None:
+            result = js.status.get_status_summary(ds)
+        else:
+            result = js.status.get_queue_page(ds, queue.value, cursor, limit)
     else:
         result = {}
-    return result
+    body, etag = js.status.dumps_with_etag(result)
+    if js.status.etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+
+@app.get("/jobs/{job_id}", status_code=200)
+async def get_job(job_id: str, api_token: str):
+    """Return the stage of each mutation in webserver job `job_id`."""
+    if api_token != config.API_TOKEN:
+        return {}
+    ds: js.DataStructures = js_data["ds"]
+    result = ds.job_index.get_job_status(job_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' is not being processed.")
+    return Response(js.status.dumps(result), media_type="application/json")
+
+
+@app.post("/jobs", status_code=200)
+async def get_jobs(jobs_in: JobsIn):
+    """Return the stage of each mutation in each of the specified jobs (`null` if not found)."""
+    if jobs_in.api_token != config.API_TOKEN:
+        return {}
+    if len(jobs_in.job_ids) > config.STATUS_PAGE_MAX_SIZE:
+        raise HTTPException(
+            status_code=422, detail=f"At most {config.STATUS_PAGE_MAX_SIZE} jobs are allowed."
+        )
+    ds: js.DataStructures = js_data["ds"]
+    result = {job_id: ds.job_index.get_job_status(job_id) for job_id in jobs_in.job_ids}
+    return Response(js.status.dumps(result), media_type="application/json")
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics(api_token: str):
+    """Return metrics in the Prometheus text format (pass `api_token` in the scrape `params`)."""
+    if api_token != config.API_TOKEN:
+        return PlainTextResponse("")
+    return PlainTextResponse(
+        js.render_metrics(js_data["ds"]), media_type="text/plain; version=0.0.4"
+    )
 
 
 @app.get("/_ah/warmup", include_in_schema=False)
@@ -69,6 +165,7 @@ def warmup():
 
 @app.on_event("startup")
 async def on_startup() -> None:
+    js.setup_tracing()
     js_data["ds"] = js.DataStructures()
     js_data["js_task"] = asyncio.create_task(
         js.start_jobsubmitter(js_data["ds"]), name="jobsubmitter"
@@ -91,10 +188,13 @@ async def on_shutdown() -> None:
         js_task.print_stack()
         logger.error("Task %s finished with an error: %s", js_task.name, error)
 
+    # Wait for the jobsubmitter to flush its buffers before dealing with the remaining items
+    await asyncio.gather(js_task, return_exceptions=True)
     await js.finalize_lingering_jobs(js_data["ds"])
-    await js_task
+    await js.close_pools()
+    js.shutdown_tracing()
 
 
 if config.SENTRY_DSN:
-    sentry_sdk.init(config.SENTRY_DSN, traces_sample_rate=1.0)
+    sentry_sdk.init(config.SENTRY_DSN, traces_sample_rate=config.TRACES_SAMPLE_RATE)
     app = SentryAsgiMiddleware(app)  # type: ignore
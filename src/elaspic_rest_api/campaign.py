@@ -0,0 +1,115 @@
+import asyncio
+import json
+import logging
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+from urllib.parse import urljoin
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+def read_campaign_mutations(tsv_file: str, max_mutations: int = 100) -> Iterator[Dict[str, str]]:
+    """Read `Mutations` records from a file listing one mutation per line.
+
+    Each line contains either `<protein_id>.<mutation>` (e.g. `A8MTB9.S184Y`) or a protein id
+    and a mutation separated by a tab. Consecutive lines for the same protein are combined into
+    records of up to `max_mutations` mutations, and duplicate mutations in a record are dropped.
+    """
+    protein_id: Optional[str] = None
+    mutations: Dict[str, None] = {}
+
+    def make_record() -> Dict[str, str]:
+        assert protein_id is not None
+        return {
+            "protein_id": protein_id,
+            "mutations": ",".join(mutations),
+            "uniprot_domain_pair_ids": "",
+        }
+
+    with open(tsv_file) as fin:
+        for line in fin:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = line.split("\t")
+            if len(fields) >= 2:
+                line_protein_id, mutation = fields[0], fields[1]
+            else:
+                line_protein_id, mutation = fields[0].rsplit(".", 1)
+            if mutations and (line_protein_id != protein_id or len(mutations) >= max_mutations):
+                yield make_record()
+                mutations = {}
+            protein_id = line_protein_id
+            mutations[mutation] = None
+    if mutations:
+        yield make_record()
+
+
+async def submit_campaign(
+    tsv_file: str,
+    job_id: str,
+    api_url: str,
+    api_token: str,
+    job_type: str = "database",
+    job_email: Optional[str] = None,
+    max_mutations: int = 100,
+) -> Dict:
+    """Stream the mutations in `tsv_file` to the `/stream` endpoint of the REST API at `api_url`.
+
+    If the submission is rejected by the admission limits of the REST API (HTTP 429), records are
+    sent again, starting from the `resume_line` of the response, once `Retry-After` seconds
+    have passed.
+
+    Returns:
+        Job handle returned by the REST API, with `num_mutations`, `num_errors` and `errors`
+        (numbered by record) combined over all requests.
+    """
+
+    async def iter_body(start_line: int) -> AsyncIterator[bytes]:
+        num_records = 0
+        for line_number, record in enumerate(read_campaign_mutations(tsv_file, max_mutations), 1):
+            if line_number < start_line:
+                continue
+            num_records += 1
+            yield (json.dumps(record) + "\n").encode()
+        logger.info("Sent %s records from '%s'.", num_records, tsv_file)
+
+    params = {"api_token": api_token, "job_id": job_id, "job_type": job_type}
+    if job_email:
+        params["job_email"] = job_email
+    start_line = 1
+    totals: Dict[str, Any] = {"num_mutations": 0, "num_errors": 0, "errors": []}
+
+    def add_results(result: Dict[str, Any]) -> None:
+        totals["num_mutations"] += result.get("num_mutations", 0)
+        totals["num_errors"] += result.get("num_errors", 0)
+        totals["errors"].extend(
+            [start_line + line_number - 1, message]
+            for line_number, message in result.get("errors", [])
+        )
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as session:
+        while True:
+            async with session.post(
+                urljoin(api_url.rstrip("/") + "/", "stream"),
+                params=params,
+                data=iter_body(start_line),
+                headers={"Content-Type": "application/x-ndjson"},
+            ) as response:
+                if response.status != 429:
+                    response.raise_for_status()
+                    result = await response.json()
+                    add_results(result)
+                    return {**result, **{key: totals[key] for key in totals if key in result}}
+                result = await response.json()
+                retry_after = int(response.headers.get("Retry-After", result["retry_after"]))
+            add_results(result)
+            start_line += (result.get("resume_line") or 1) - 1
+            logger.info(
+                "Submission was rejected (%s). Resending from record %s in %s s...",
+                result["reason"],
+                start_line,
+                retry_after,
+            )
+            await asyncio.sleep(retry_after)
@@ -1,5 +1,6 @@
 import os
 import os.path as op
+import tempfile
 
 DATA_DIR = os.environ["DATA_DIR"]
 
@@ -7,6 +8,31 @@ API_TOKEN = os.environ["API_TOKEN"]
 SLURM_MASTER_USER = os.environ["SLURM_MASTER_USER"]
 SLURM_MASTER_HOST = os.environ["SLURM_MASTER_HOST"]
 SENTRY_DSN = os.getenv("SENTRY_DSN")
+# Admission limits (disabled if <= 0): maximum number of mutations being processed, maximum
+# number of unfinished mutations submitted using each API token, and the rate (mutations per
+# second) and burst size at which each API token can submit mutations (burst defaults to 60 s
+# worth of rate)
+ADMISSION_MAX_QUEUED_ITEMS = int(os.getenv("ADMISSION_MAX_QUEUED_ITEMS", "0"))
+ADMISSION_TOKEN_MAX_ITEMS = int(os.getenv("ADMISSION_TOKEN_MAX_ITEMS", "0"))
+ADMISSION_TOKEN_RATE = float(os.getenv("ADMISSION_TOKEN_RATE", "0"))
+ADMISSION_TOKEN_BURST = float(os.getenv("ADMISSION_TOKEN_BURST", "0"))
+# Upper bound on the `Retry-After` delay returned to rejected submissions
+ADMISSION_MAX_RETRY_AFTER = int(os.getenv("ADMISSION_MAX_RETRY_AFTER", "3600"))
+# Number of lines of a streamed submission that are validated and submitted together
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "100"))
+# Longest line accepted in a streamed submission (in bytes)
+STREAM_MAX_LINE_LENGTH = int(os.getenv("STREAM_MAX_LINE_LENGTH", str(1024 * 1024)))
+# Number of invalid lines of a streamed submission that are reported back to the client
+STREAM_MAX_ERRORS = int(os.getenv("STREAM_MAX_ERRORS", "100"))
+# Maximum number of items returned by each page of `/status`
+STATUS_PAGE_MAX_SIZE = int(os.getenv("STATUS_PAGE_MAX_SIZE", "1000"))
+# Keep the status of finished jobs available from `/jobs` for this many seconds
+JOB_INDEX_RETENTION = float(os.getenv("JOB_INDEX_RETENTION", str(24 * 60 * 60)))
+# Fraction of requests (Sentry) and items (OpenTelemetry) that are traced
+TRACES_SAMPLE_RATE = float(os.getenv("TRACES_SAMPLE_RATE", "0.01"))
+# Where to export the spans of traced items ("otlp", "file" or "" to disable item tracing)
+TRACES_EXPORTER = os.getenv("TRACES_EXPORTER", "")
+TRACES_FILE = os.getenv("TRACES_FILE", op.join(DATA_DIR, "traces.jsonl"))
 
 ADMIN_EMAIL = os.getenv("ADMIN_EMAIL")
 
@@ -24,14 +50,92 @@ DB_PORT = int(os.environ["DB_PORT"])
 DB_USER = os.environ["DB_USER"]
 DB_PASSWORD = os.environ["DB_PASSWORD"]
 DB_CONNECTION_PARAMS = dict(host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASSWORD)
+# Number of connections kept open (min) and allowed (max) per database and event loop
+DB_POOL_MINSIZE = int(os.getenv("DB_POOL_MINSIZE", "1"))
+DB_POOL_MAXSIZE = int(os.getenv("DB_POOL_MAXSIZE", "10"))
+# Reconnect connections which have been open for longer than this many seconds (never if -1)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+DB_CONNECT_TIMEOUT = float(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+# Abort statements which take longer than this many seconds (disabled if 0)
+DB_STATEMENT_TIMEOUT = float(os.getenv("DB_STATEMENT_TIMEOUT", "600"))
 
 ELASPIC2_URL = os.environ["ELASPIC2_URL"]
+# Keep-alive connections and request timeouts (in seconds) for ELASPIC2
+EL2_CONNECTION_LIMIT = int(os.getenv("EL2_CONNECTION_LIMIT", "10"))
+EL2_CONNECT_TIMEOUT = float(os.getenv("EL2_CONNECT_TIMEOUT", "10"))
+EL2_REQUEST_TIMEOUT = float(os.getenv("EL2_REQUEST_TIMEOUT", "60"))
+# Retry transient ELASPIC2 errors up to `EL2_MAX_RETRIES` times, with exponential backoff
+EL2_MAX_RETRIES = int(os.getenv("EL2_MAX_RETRIES", "3"))
+EL2_RETRY_BACKOFF = float(os.getenv("EL2_RETRY_BACKOFF", "1"))
+# Collect pending items for up to `EL2_SUBMIT_WINDOW` seconds and submit mutations in the same
+# structure and chain as a single ELASPIC2 job with up to `EL2_SUBMIT_MAX_MUTATIONS` mutations
+EL2_SUBMIT_WINDOW = float(os.getenv("EL2_SUBMIT_WINDOW", "5"))
+EL2_SUBMIT_MAX_ITEMS = int(os.getenv("EL2_SUBMIT_MAX_ITEMS", "100"))
+EL2_SUBMIT_MAX_MUTATIONS = int(os.getenv("EL2_SUBMIT_MAX_MUTATIONS", "100"))
+# Items whose ELASPIC2 jobs could not be submitted because of a transient error (e.g. a lost
+# database connection) are retried up to `EL2_SUBMIT_MAX_TRIES` times
+EL2_SUBMIT_MAX_TRIES = int(os.getenv("EL2_SUBMIT_MAX_TRIES", "10"))
+# Items whose ELASPIC2 results could not be collected `EL2_COLLECT_MAX_FAILURES` times in a row
+# are finalized without ELASPIC2 scores
+EL2_COLLECT_MAX_FAILURES = int(os.getenv("EL2_COLLECT_MAX_FAILURES", "20"))
+# Maximum number of concurrent status and result requests while polling ELASPIC2 jobs
+EL2_POLL_CONCURRENCY = int(os.getenv("EL2_POLL_CONCURRENCY", "20"))
+# Write ELASPIC2 scores to the database once `EL2_SCORE_FLUSH_SIZE` scores have been collected,
+# or after `EL2_SCORE_FLUSH_INTERVAL` seconds
+EL2_SCORE_FLUSH_SIZE = int(os.getenv("EL2_SCORE_FLUSH_SIZE", "500"))
+EL2_SCORE_FLUSH_INTERVAL = float(os.getenv("EL2_SCORE_FLUSH_INTERVAL", "10"))
+# Number of concurrent DELETE requests used to clean up finished ELASPIC2 jobs
+EL2_DELETE_CONCURRENCY = int(os.getenv("EL2_DELETE_CONCURRENCY", "4"))
+# Worker processes used to parse structures for ELASPIC2. The start method can be one of
+# "fork", "spawn" or "forkserver", and workers are replaced after `EL2_PARSE_MAX_TASKS_PER_CHILD`
+# tasks if > 0 (requires Python 3.11 and a start method other than "fork")
+EL2_PARSE_WORKERS = int(os.getenv("EL2_PARSE_WORKERS", "1"))
+EL2_PARSE_START_METHOD = os.getenv("EL2_PARSE_START_METHOD")
+EL2_PARSE_MAX_TASKS_PER_CHILD = int(os.getenv("EL2_PARSE_MAX_TASKS_PER_CHILD", "0"))
+# Number of parsed structures kept in memory while preparing ELASPIC2 jobs
+EL2_STRUCTURE_CACHE_SIZE = int(os.getenv("EL2_STRUCTURE_CACHE_SIZE", "64"))
+# Delete ELASPIC2 jobs that were not picked up by any item after this many seconds
+EL2_ORPHAN_TIMEOUT = float(os.getenv("EL2_ORPHAN_TIMEOUT", "600"))
 
 # Jobsubmitter
 SCRIPTS_DIR = op.join(DATA_DIR, "scripts_el2")
 PROVEAN_LOCK_DIR = op.join(DATA_DIR, "locks", "sequence")
 MODEL_LOCK_DIR = op.join(DATA_DIR, "locks", "model")
 MUTATION_LOCK_DIR = op.join(DATA_DIR, "locks", "mutation")
+ARRAY_TASKS_DIR = op.join(DATA_DIR, "array_tasks")
+# Where to keep the leases that prevent jobs from being submitted twice ("file" or "db")
+LOCK_BACKEND = os.getenv("LOCK_BACKEND", "file")
+LOCK_LEASE_DIR = op.join(DATA_DIR, "locks", "leases")
+# Leases that are not released after this many seconds are reclaimed
+# (must be longer than the SLURM time limit of a job)
+LOCK_LEASE_TIMEOUT = float(os.getenv("LOCK_LEASE_TIMEOUT", str(48 * 60 * 60)))
+# SQLite database recording the state of each item, so that items can be resumed after a restart
+# (disabled if empty)
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", op.join(DATA_DIR, "jobsubmitter_journal.sqlite"))
+
+# Submit up to `QSUB_ARRAY_MAX_SIZE` items collected over `QSUB_ARRAY_WINDOW` seconds
+# as a single SLURM job array (disabled if <= 1)
+QSUB_ARRAY_MAX_SIZE = int(os.getenv("QSUB_ARRAY_MAX_SIZE", "0"))
+QSUB_ARRAY_WINDOW = float(os.getenv("QSUB_ARRAY_WINDOW", "5"))
+# Maximum number of simultaneously running tasks per job array (unlimited if 0)
+QSUB_ARRAY_THROTTLE = int(os.getenv("QSUB_ARRAY_THROTTLE", "0"))
+# Submit mutations together with their prereqs, using `--dependency=afterok:...`
+QSUB_USE_DEPENDENCIES = bool(os.getenv("QSUB_USE_DEPENDENCIES"))
+# Number of concurrent `qsub` consumers
+QSUB_CONCURRENCY = int(os.getenv("QSUB_CONCURRENCY", "3"))
+# Number of rows loaded from `jobsubmitter_cache` per query
+PRECALCULATED_PAGE_SIZE = int(os.getenv("PRECALCULATED_PAGE_SIZE", "10000"))
+# Add sequences and models from the local result tables to `jobsubmitter_cache` on startup
+PRECALCULATED_REBUILD = bool(os.getenv("PRECALCULATED_REBUILD"))
+# Number of recently found precalculated keys kept in the LRU cache
+PRECALCULATED_LRU_SIZE = int(os.getenv("PRECALCULATED_LRU_SIZE", "4096"))
+# Size of the Bloom filter in front of the precalculated index (disabled if 0)
+PRECALCULATED_BLOOM_BITS_PER_KEY = int(os.getenv("PRECALCULATED_BLOOM_BITS_PER_KEY", "0"))
+
+# Multiplexed SSH sessions to the SLURM master node
+SSH_POOL_SIZE = int(os.getenv("SSH_POOL_SIZE", "4"))
+SSH_CONTROL_DIR = os.getenv("SSH_CONTROL_DIR", op.join(tempfile.gettempdir(), "elaspic-ssh"))
+SSH_CONTROL_PERSIST = int(os.getenv("SSH_CONTROL_PERSIST", "600"))
 
 # Email configuration
 EMAIL_USE_TLS = bool(os.getenv("EMAIL_USE_TLS"))
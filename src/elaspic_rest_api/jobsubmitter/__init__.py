@@ -1,16 +1,51 @@
 from .types import Args, DataStructures, Item, JobKey  # isort:skip
-from . import email, perf
-from .db import EDBConnection, WDBConnection
-from .elaspic2 import elaspic2_collect_loop, elaspic2_submit_loop
-from .elaspic2db import get_mutation_info, update_mutation_scores
+from . import db, elaspic2client, email, journal, locks, metrics, perf, ssh, status, tracing
+from .admission import AdmissionRejected, submit_admitted_job
+from .db import EDBConnection, WDBConnection, close_pools
+from .elaspic2 import (
+    elaspic2_collect_loop,
+    elaspic2_flush_loop,
+    elaspic2_submit_loop,
+    flush_mutation_scores,
+)
+from .elaspic2db import get_mutation_info, get_mutation_info_batch, update_mutation_scores
 from .finalize import (
+    check_mutations_calculated,
     finalize_finished_submissions_loop,
     finalize_lingering_jobs,
     finalize_mutation,
+    finalize_mutations,
+    finalize_mutations_loop,
+    finalize_pending_mutations,
+    schedule_finalize_mutation,
     set_db_errors,
 )
-from .jobsubmitter import parse_input_data, start_jobsubmitter, submit_job
+from .jobsubmitter import parse_input_data, start_jobsubmitter, submit_job, submit_job_stream
+from .journal import compact_journal_loop, replay_journal, transition
+from .metrics import render_metrics
 from .monitor import monitor_stats, qstat, validation
-from .precalculated import check_prereqs, persist_precalculated, update_precalculated
-from .submit import pre_qsub, qsub
-from .utils import remove_from_monitored, restart_or_drop
+from .precalculated import (
+    add_precalculated_seq,
+    check_prereq_submitted,
+    check_prereqs,
+    fail_dependents,
+    lookup_precalculated,
+    persist_precalculated,
+    rebuild_precalculated,
+    refresh_precalculated,
+    release_dependents,
+    stop_waiting_for_prereqs,
+    update_precalculated,
+    update_precalculated_loop,
+    wait_for_prereqs,
+)
+from .submit import cleanup_array_task_files, pre_qsub, qsub, qsub_array
+from .tracing import setup_tracing, shutdown_tracing
+from .utils import (
+    add_in_flight,
+    attach_in_flight,
+    get_batch,
+    remove_from_monitored,
+    resolve_item,
+    restart_or_drop,
+)
@@ -0,0 +1,195 @@
+import logging
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, List, Set, Tuple
+
+from elaspic_rest_api import config
+from elaspic_rest_api import jobsubmitter as js
+from elaspic_rest_api.types import DataIn
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Submission was rejected because it would exceed one of the admission limits."""
+
+    def __init__(self, reason: str, retry_after: int) -> None:
+        super().__init__(f"{reason} (retry after {retry_after} s)")
+        #: Which limit was exceeded ("max_queued_items", "token_max_items", "token_rate", ...)
+        self.reason = reason
+        #: Number of seconds after which the submission is likely to be accepted
+        #: (0 if the submission can never be accepted)
+        self.retry_after = retry_after
+
+
+class DrainRate:
+    """Rate at which items finish, averaged over the last `window` seconds (in 1 s buckets)."""
+
+    def __init__(self, window: float = 15 * 60) -> None:
+        self.window = window
+        self._buckets: Deque[List[int]] = deque()
+        self._start_time = time.time()
+
+    def record(self, num_items: int = 1) -> None:
+        second = int(time.time())
+        if self._buckets and self._buckets[-1][0] == second:
+            self._buckets[-1][1] += num_items
+        else:
+            self._buckets.append([second, num_items])
+        self._expire()
+
+    @property
+    def rate(self) -> float:
+        """Number of items finished per second."""
+        self._expire()
+        elapsed = min(self.window, max(1.0, time.time() - self._start_time))
+        return sum(count for _, count in self._buckets) / elapsed
+
+    def _expire(self) -> None:
+        cutoff = time.time() - self.window
+        while self._buckets and self._buckets[0][0] < cutoff:
+            self._buckets.popleft()
+
+
+class AdmissionController:
+    """Limits on the number of items that can be submitted, globally and by each API token.
+
+    - `max_queued_items`: mutations being processed by the jobsubmitter, including submissions
+      which have been accepted but not queued yet.
+    - `token_max_items`: unfinished mutations of all jobs submitted using an API token.
+    - `token_rate` and `token_burst`: mutations per second submitted using an API token,
+      enforced using a token bucket holding up to `token_burst` mutations.
+
+    Limits which are <= 0 are disabled. Rejected submissions get a retry delay estimated
+    from the rate at which items have been finishing recently.
+    """
+
+    def __init__(
+        self,
+        max_queued_items: int,
+        token_max_items: int,
+        token_rate: float,
+        token_burst: float,
+        max_retry_after: int,
+    ) -> None:
+        self.max_queued_items = max_queued_items
+        self.token_max_items = token_max_items
+        self.token_rate = token_rate
+        self.token_burst = token_burst if token_burst > 0 else token_rate * 60
+        self.max_retry_after = max_retry_after
+        self.drain_rate = DrainRate()
+        #: Mutations in submissions which were accepted but have not been queued yet
+        self.pending_items = 0
+        self.token_pending_items: Dict[str, int] = {}
+        #: Jobs submitted using each API token
+        self.token_jobs: Dict[str, Set[js.JobKey]] = {}
+        #: Token buckets (available mutations and time of the last update) for each API token
+        self.token_buckets: Dict[str, Tuple[float, float]] = {}
+        #: Number of rejected submissions, by reason
+        self.num_rejected: Dict[str, int] = {}
+
+    def admit(self, api_token: str, data_in: DataIn, ds: js.DataStructures) -> int:
+        """Reserve capacity for the mutations in `data_in`, or raise `AdmissionRejected`.
+
+        Returns:
+            Number of mutations reserved, which must be passed to `release` once they have
+            been queued.
+        """
+        num_items = get_num_mutations(data_in)
+        try:
+            self._check_queued_items(num_items, ds)
+            self._check_token_items(api_token, num_items, ds)
+            self._take_token_rate(api_token, num_items)
+        except AdmissionRejected as e:
+            self.num_rejected[e.reason] = self.num_rejected.get(e.reason, 0) + 1
+            logger.info("Rejected job %s with %s mutations: %s", data_in.job_id, num_items, e)
+            raise
+        self.pending_items += num_items
+        self.token_pending_items[api_token] = self.token_pending_items.get(api_token, 0) + num_items
+        self.token_jobs.setdefault(api_token, set()).add(
+            js.JobKey(data_in.job_id, data_in.job_email)
+        )
+        return num_items
+
+    def release(self, api_token: str, num_items: int) -> None:
+        self.pending_items -= num_items
+        self.token_pending_items[api_token] -= num_items
+
+    def get_queued_items(self, ds: js.DataStructures) -> int:
+        # Pending submissions are counted in mutations, so sequence and model items are not counted
+        return ds.num_in_flight_mutations + self.pending_items
+
+    def get_token_items(self, api_token: str, ds: js.DataStructures) -> int:
+        job_keys = self.token_jobs.get(api_token, set())
+        if not self.token_pending_items.get(api_token):
+            # Jobs which are no longer monitored have finished
+            job_keys.intersection_update(ds.monitored_jobs)
+        num_items = 0
+        for job_key in job_keys:
+            unique_ids = ds.monitored_jobs.get(job_key, ())
+            # Jobs which are being streamed are marked with a placeholder
+            num_items += len(unique_ids) - (js.jobsubmitter.STREAM_PLACEHOLDER in unique_ids)
+        return num_items + self.token_pending_items.get(api_token, 0)
+
+    def _check_queued_items(self, num_items: int, ds: js.DataStructures) -> None:
+        if self.max_queued_items <= 0:
+            return
+        if num_items > self.max_queued_items:
+            raise AdmissionRejected("max_queued_items", 0)
+        excess = self.get_queued_items(ds) + num_items - self.max_queued_items
+        if excess > 0:
+            raise AdmissionRejected("max_queued_items", self._get_retry_after(excess))
+
+    def _check_token_items(self, api_token: str, num_items: int, ds: js.DataStructures) -> None:
+        if self.token_max_items <= 0:
+            return
+        if num_items > self.token_max_items:
+            raise AdmissionRejected("token_max_items", 0)
+        excess = self.get_token_items(api_token, ds) + num_items - self.token_max_items
+        if excess > 0:
+            raise AdmissionRejected("token_max_items", self._get_retry_after(excess))
+
+    def _take_token_rate(self, api_token: str, num_items: int) -> None:
+        if self.token_rate <= 0:
+            return
+        now = time.time()
+        available, last_time = self.token_buckets.get(api_token, (self.token_burst, now))
+        available = min(self.token_burst, available + (now - last_time) * self.token_rate)
+        # Submissions larger than the bucket are accepted once the bucket is full
+        needed = min(num_items, self.token_burst)
+        if available < needed:
+            self.token_buckets[api_token] = (available, now)
+            retry_after = math.ceil((needed - available) / self.token_rate)
+            raise AdmissionRejected("token_rate", min(retry_after, self.max_retry_after))
+        self.token_buckets[api_token] = (available - num_items, now)
+
+    def _get_retry_after(self, excess: int) -> int:
+        drain_rate = self.drain_rate.rate
+        if drain_rate <= 0:
+            return self.max_retry_after
+        return max(1, min(math.ceil(excess / drain_rate), self.max_retry_after))
+
+
+def get_num_mutations(data_in: DataIn) -> int:
+    return sum(len(mutations.mutations.split(",")) for mutations in data_in.mutations)
+
+
+async def submit_admitted_job(
+    data_in: DataIn, ds: js.DataStructures, api_token: str, num_items: int
+) -> None:
+    """Submit a job accepted by `controller.admit`, releasing its reservation once it is queued."""
+    try:
+        await js.submit_job(data_in, ds)
+    finally:
+        controller.release(api_token, num_items)
+
+
+#: Admission limits shared by all endpoints
+controller = AdmissionController(
+    max_queued_items=config.ADMISSION_MAX_QUEUED_ITEMS,
+    token_max_items=config.ADMISSION_TOKEN_MAX_ITEMS,
+    token_rate=config.ADMISSION_TOKEN_RATE,
+    token_burst=config.ADMISSION_TOKEN_BURST,
+    max_retry_after=config.ADMISSION_MAX_RETRY_AFTER,
+)
@@ -1,18 +1,72 @@
 import asyncio
 import logging
-from typing import Dict
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Tuple
 
 import aiomysql
 
 from elaspic_rest_api import config
+from elaspic_rest_api.jobsubmitter.ssh import CommandStats
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class PoolStats:
+    #: Number of connections acquired from the pool
+    acquire_count: int = 0
+    #: Total and maximum time spent waiting for a free connection
+    acquire_time: float = 0.0
+    max_acquire_time: float = 0.0
+    #: Number of connections currently checked out of the pool
+    in_use: int = 0
+    #: Latency and failure counts of the executed statements
+    queries: CommandStats = field(default_factory=CommandStats)
+
+    @property
+    def mean_acquire_time(self) -> float:
+        return self.acquire_time / self.acquire_count if self.acquire_count else 0.0
+
+
+#: Pool statistics for each database
+pool_stats: Dict[str, PoolStats] = {}
+
+
+class TimedCursor(aiomysql.Cursor):
+    """Cursor which records the latency of each statement and enforces `DB_STATEMENT_TIMEOUT`.
+
+    Connections on which a statement timed out are closed, so that they are discarded by the pool
+    instead of being reused in an unknown state.
+    """
+
+    async def execute(self, query, args=None):
+        stats = pool_stats.setdefault(self.connection.db, PoolStats()).queries
+        start_time = time.perf_counter()
+        success = False
+        try:
+            if config.DB_STATEMENT_TIMEOUT > 0:
+                result = await asyncio.wait_for(
+                    super().execute(query, args), config.DB_STATEMENT_TIMEOUT
+                )
+            else:
+                result = await super().execute(query, args)
+            success = True
+            return result
+        except asyncio.TimeoutError:
+            logger.error(
+                "Statement timed out after %s s: %s", config.DB_STATEMENT_TIMEOUT, query[:200]
+            )
+            self.connection.close()
+            raise
+        finally:
+            stats.record(time.perf_counter() - start_time, success)
+
+
 class _DBConnection:
     db_name: str
     db_connection_params: Dict
-    pools: Dict[str, int] = {}
+    pools: Dict[Tuple[str, asyncio.AbstractEventLoop], aiomysql.Pool] = {}
 
     def __init__(self):
         self._current_pool = None
@@ -21,20 +75,36 @@ class _DBConnection:
     async def __aenter__(self):
         # Some tests will fail if we do not have a different pool for each asyncio loop
         loop = asyncio.get_running_loop()
-        key = (self.db_name, hash(loop))
+        key = (self.db_name, loop)
 
         try:
             self._current_pool = self.pools[key]
         except KeyError:
+            _drop_stale_pools()
             self._current_pool = await aiomysql.create_pool(
-                db=self.db_name, loop=loop, maxsize=2, **self.db_connection_params
+                db=self.db_name,
+                loop=loop,
+                minsize=config.DB_POOL_MINSIZE,
+                maxsize=config.DB_POOL_MAXSIZE,
+                pool_recycle=config.DB_POOL_RECYCLE,
+                connect_timeout=config.DB_CONNECT_TIMEOUT,
+                cursorclass=TimedCursor,
+                **self.db_connection_params,
             )
             self.pools[key] = self._current_pool
 
+        stats = pool_stats.setdefault(self.db_name, PoolStats())
+        start_time = time.perf_counter()
         self._current_conn = await self._current_pool.acquire()
+        acquire_time = time.perf_counter() - start_time
+        stats.acquire_count += 1
+        stats.acquire_time += acquire_time
+        stats.max_acquire_time = max(stats.max_acquire_time, acquire_time)
+        stats.in_use += 1
         return self._current_conn
 
     async def __aexit__(self, exc_type, exc_value, traceback):
+        pool_stats[self.db_name].in_use -= 1
         self._current_pool.release(self._current_conn)
 
 
@@ -46,3 +116,24 @@ class EDBConnection(_DBConnection):
 class WDBConnection(_DBConnection):
     db_name = config.DB_NAME_WEBSERVER
     db_connection_params = config.DB_CONNECTION_PARAMS
+
+
+async def close_pools() -> None:
+    """Close all database pools created in the running event loop."""
+    loop = asyncio.get_running_loop()
+    for key, pool in list(_DBConnection.pools.items()):
+        if key[1] is loop:
+            del _DBConnection.pools[key]
+            pool.close()
+            await pool.wait_closed()
+
+
+def _drop_stale_pools() -> None:
+    # Pools of loops which have been closed can no longer be used or closed gracefully
+    for key, pool in list(_DBConnection.pools.items()):
+        if key[1].is_closed():
+            del _DBConnection.pools[key]
+            try:
+                pool.terminate()
+            except Exception as e:
+                logger.debug("Failed to terminate database pool %s: %s", key[0], e)
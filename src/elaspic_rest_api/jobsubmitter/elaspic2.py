@@ -1,9 +1,15 @@
 import asyncio
+import importlib
 import logging
+import multiprocessing
+import os
+import sys
+import time
 from concurrent.futures import ProcessPoolExecutor
 from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
 from urllib.parse import urljoin
 
 import aiohttp
@@ -12,112 +18,391 @@ from kmtools import structure_tools
 
 from elaspic_rest_api import config
 from elaspic_rest_api import jobsubmitter as js
-from elaspic_rest_api.jobsubmitter.elaspic2db import get_mutation_info, update_mutation_scores
-from elaspic_rest_api.jobsubmitter.elaspic2types import COI, EL2Error, MutationInfo
+from elaspic_rest_api.jobsubmitter.elaspic2db import get_mutation_info_batch, update_mutation_scores
+from elaspic_rest_api.jobsubmitter.elaspic2types import COI, EL2Error, MutationInfo, StructureInfo
 
 logger = logging.getLogger(__name__)
 
 
 async def elaspic2_submit_loop(ds: js.DataStructures) -> None:
-    elaspic2_jobs_api = urljoin(config.ELASPIC2_URL, "jobs/")
+    executor = create_parse_executor()
+    try:
+        await _warm_up_parse_executor(executor)
+        while True:
+            items = await js.get_batch(
+                ds.elaspic2_pending_queue, config.EL2_SUBMIT_MAX_ITEMS, config.EL2_SUBMIT_WINDOW
+            )
+
+            # Items with bad input are skipped, while transient errors are retried
+            skipped_items: Dict[js.Item, Exception] = {}
+            retried_items: Dict[js.Item, Exception] = {}
+            with js.tracing.item_span(items, "el2_submit"):
+                try:
+                    mutation_info_lists = await get_mutation_info_batch(items)
+                except Exception as e:
+                    retried_items = dict.fromkeys(items, e)
+                else:
+                    for item, mutation_info_list in zip(items, mutation_info_lists):
+                        item.el2_mutation_info_list = mutation_info_list
+
+                    mutations, skipped_items = await _el2_extract_protein_info(items, executor)
+                    for item, error in (await _el2_submit_mutations(mutations)).items():
+                        if _is_bad_request(error):
+                            skipped_items[item] = error
+                        else:
+                            retried_items[item] = error
+
+            for item in items:
+                if item in skipped_items:
+                    await _el2_skip_item(item, ds, skipped_items[item])
+                    continue
+                if item in retried_items:
+                    await _el2_retry_item(item, ds, retried_items[item])
+                    continue
+                js.elaspic2client.client.acquire(
+                    mi.el2_web_url for mi in item.el2_mutation_info_list
+                )
+                js.transition(item, js.journal.EL2_RUNNING)
+                await ds.elaspic2_running_queue.put(item)
+
+            if retried_items:
+                await asyncio.sleep(js.perf.SLEEP_FOR_EL2_RETRY)
+    finally:
+        executor.shutdown(wait=False)
+
+
+def create_parse_executor() -> ProcessPoolExecutor:
+    """Create the pool of worker processes used to parse structures."""
+    kwargs: Dict[str, Any] = {}
+    if config.EL2_PARSE_START_METHOD:
+        kwargs["mp_context"] = multiprocessing.get_context(config.EL2_PARSE_START_METHOD)
+    if config.EL2_PARSE_MAX_TASKS_PER_CHILD > 0:
+        if sys.version_info >= (3, 11):
+            kwargs["max_tasks_per_child"] = config.EL2_PARSE_MAX_TASKS_PER_CHILD
+        else:
+            logger.warning("EL2_PARSE_MAX_TASKS_PER_CHILD requires Python 3.11 or later.")
+    return ProcessPoolExecutor(config.EL2_PARSE_WORKERS, initializer=_init_parse_worker, **kwargs)
+
+
+def _init_parse_worker() -> None:
+    # Import heavy dependencies before the first structure is submitted
+    for module_name in ["pandas", "kmbio.PDB", "kmtools.structure_tools"]:
+        importlib.import_module(module_name)
+
+
+async def _warm_up_parse_executor(executor: ProcessPoolExecutor) -> None:
     loop = asyncio.get_running_loop()
-    executor = ProcessPoolExecutor(1)
+    await asyncio.gather(
+        *[loop.run_in_executor(executor, os.getpid) for _ in range(config.EL2_PARSE_WORKERS)]
+    )
 
-    while True:
-        item = await ds.elaspic2_pending_queue.get()
-        mutation_info_list = await get_mutation_info(item)
-        mutation_info_list = await loop.run_in_executor(
-            None, resolve_mutation_info, mutation_info_list
-        )
-        protein_info_list = await loop.run_in_executor(
-            executor, extract_protein_info_list, mutation_info_list
+
+async def _el2_extract_protein_info(
+    items: List[js.Item], executor: ProcessPoolExecutor
+) -> Tuple[List[Tuple[js.Item, int, Dict]], Dict[js.Item, Exception]]:
+    """Extract protein info for all mutations in `items`, in parallel.
+
+    Mutations in the same structure are sent to the same worker process, so that each structure
+    is parsed only once.
+
+    Returns:
+        Items, indices into `item.el2_mutation_info_list` and protein info for each mutation,
+        and items for which protein info could not be extracted.
+    """
+    loop = asyncio.get_running_loop()
+    failed_items: Dict[js.Item, Exception] = {}
+
+    for item in items:
+        try:
+            item.el2_mutation_info_list = await loop.run_in_executor(
+                None, resolve_mutation_info, item.el2_mutation_info_list
+            )
+        except Exception as e:
+            failed_items[item] = e
+
+    structure_groups: Dict[str, List[Tuple[js.Item, int]]] = {}
+    for item in items:
+        if item in failed_items:
+            continue
+        for idx, mutation_info in enumerate(item.el2_mutation_info_list):
+            structure_groups.setdefault(mutation_info.structure_file, []).append((item, idx))
+
+    results = await asyncio.gather(
+        *[
+            loop.run_in_executor(
+                executor,
+                extract_protein_info_list_safe,
+                [item.el2_mutation_info_list[idx] for item, idx in group],
+            )
+            for group in structure_groups.values()
+        ]
+    )
+
+    mutations: List[Tuple[js.Item, int, Dict]] = []
+    for group, protein_info_list in zip(structure_groups.values(), results):
+        for (item, idx), protein_info in zip(group, protein_info_list):
+            if isinstance(protein_info, Exception):
+                failed_items.setdefault(item, protein_info)
+            else:
+                mutations.append((item, idx, protein_info))
+    mutations = [mutation for mutation in mutations if mutation[0] not in failed_items]
+    return mutations, failed_items
+
+
+async def _el2_skip_item(item: js.Item, ds: js.DataStructures, error: Exception) -> None:
+    """Finalize `item` without ELASPIC2 scores."""
+    logger.error("Failed to submit EL2 jobs for item %s with error: %s.", item, error)
+    js.schedule_finalize_mutation(item, ds)
+
+
+async def _el2_retry_item(item: js.Item, ds: js.DataStructures, error: Exception) -> None:
+    """Return `item` to `elaspic2_pending_queue`, unless it has been retried too many times."""
+    if item.el2_tries >= config.EL2_SUBMIT_MAX_TRIES:
+        await _el2_skip_item(item, ds, error)
+        return
+    item.el2_tries += 1
+    logger.warning(
+        "Failed to submit EL2 jobs for item %s with error: %s. Retrying (attempt %s)...",
+        item,
+        error,
+        item.el2_tries,
+    )
+    await ds.elaspic2_pending_queue.put(item)
+
+
+def _is_bad_request(error: Exception) -> bool:
+    # Server errors and timeouts are raised as `EL2Error` (or, for POST requests, as 5xx
+    # `ClientResponseError`s) and are retried by `elaspic2_submit_loop`
+    return isinstance(error, aiohttp.ClientResponseError) and 400 <= error.status < 500
+
+
+async def _el2_submit_mutations(
+    mutations: List[Tuple[js.Item, int, Dict]],
+) -> Dict[js.Item, Exception]:
+    """Submit mutations as ELASPIC2 jobs, combining mutations which share a protein and ligand.
+
+    Args:
+        mutations: Items, indices into `item.el2_mutation_info_list`, and protein info
+            for each mutation.
+
+    Returns:
+        Items for which some of the ELASPIC2 jobs could not be submitted.
+    """
+    groups: Dict[Tuple[str, str, Optional[str]], List[Tuple[js.Item, int, Dict]]] = {}
+    for item, idx, protein_info in mutations:
+        key = (
+            protein_info["protein_structure_url"],
+            protein_info["protein_sequence"],
+            protein_info.get("ligand_sequence"),
         )
+        groups.setdefault(key, []).append((item, idx, protein_info))
 
-        item.el2_mutation_info_list = []
-        for mutation_info, protein_info in zip(mutation_info_list, protein_info_list):
-            async with aiohttp.ClientSession() as session:
-                async with session.post(elaspic2_jobs_api, json=protein_info) as resp:
-                    job_request = await resp.json()
-            mutation_info = mutation_info._replace(el2_web_url=job_request["web_url"])
-            item.el2_mutation_info_list.append(mutation_info)
-        await ds.elaspic2_running_queue.put(item)
+    failed_items: Dict[js.Item, Exception] = {}
+    for group in groups.values():
+        el2_mutations = list(
+            dict.fromkeys(protein_info["mutations"] for _, _, protein_info in group)
+        )
+        for start in range(0, len(el2_mutations), config.EL2_SUBMIT_MAX_MUTATIONS):
+            chunk = el2_mutations[start : start + config.EL2_SUBMIT_MAX_MUTATIONS]
+            chunk_set = set(chunk)
+            members = [member for member in group if member[2]["mutations"] in chunk_set]
+            try:
+                job_request = await js.elaspic2client.client.create_job(
+                    {**members[0][2], "mutations": ",".join(chunk)}
+                )
+            except Exception as e:
+                failed_items.update((item, e) for item, _, _ in members)
+                continue
+            for item, idx, protein_info in members:
+                item.el2_mutation_info_list[idx] = item.el2_mutation_info_list[idx]._replace(
+                    el2_web_url=job_request["web_url"], el2_mutation=protein_info["mutations"]
+                )
+    logger.debug("Submitted %s mutations in %s EL2 groups.", len(mutations), len(groups))
+    return failed_items
 
 
 async def elaspic2_collect_loop(ds: js.DataStructures) -> None:
+    semaphore = asyncio.Semaphore(config.EL2_POLL_CONCURRENCY)
     while True:
-        for _ in range(ds.elaspic2_running_queue.qsize()):
-            item = await ds.elaspic2_running_queue.get()
-            mutation_scores = await _el2_collect_mutation_scores(item)
-            if mutation_scores is None:
-                logger.debug("EL2 job is still running for item %s", item)
-                await ds.elaspic2_running_queue.put(item)
-            else:
-                logger.debug("Mutation scores for job_id %s: %s", item.job_id, mutation_scores)
-                await update_mutation_scores(item.args["job_type"], mutation_scores)
-                await js.finalize_mutation(item)
-                await js.remove_from_monitored(item, ds.monitored_jobs)
-                await _el2_delete_jobs([mi.el2_web_url for mi in item.el2_mutation_info_list])
-        await asyncio.sleep(30)
+        items = [
+            ds.elaspic2_running_queue.get_nowait() for _ in range(ds.elaspic2_running_queue.qsize())
+        ]
+        # Responses are shared between items which refer to the same EL2 job
+        requests: Dict[str, asyncio.Task] = {}
+        await asyncio.gather(*[_el2_collect_item(item, ds, semaphore, requests) for item in items])
+        await asyncio.sleep(js.perf.SLEEP_FOR_EL2_COLLECT)
+
+
+async def _el2_collect_item(
+    item: js.Item,
+    ds: js.DataStructures,
+    semaphore: asyncio.Semaphore,
+    requests: Dict[str, asyncio.Task],
+) -> None:
+    try:
+        with js.tracing.item_span([item], "el2_collect"):
+            mutation_scores = await _el2_collect_mutation_scores(item, semaphore, requests)
+        item.el2_collect_failures = 0
+        if mutation_scores is None:
+            logger.debug("EL2 job is still running for item %s", item)
+            await ds.elaspic2_running_queue.put(item)
+        else:
+            logger.debug("Mutation scores for job_id %s: %s", item.job_id, mutation_scores)
+            # Items are finalized, and their EL2 jobs deleted, once their scores have been
+            # written to the database
+            item.el2_scored = True
+            js.metrics.enter_stage(item, js.metrics.FINALIZE)
+            ds.elaspic2_score_buffer.append((item, mutation_scores, time.time()))
+    except Exception as e:
+        item.el2_collect_failures += 1
+        if item.el2_collect_failures >= config.EL2_COLLECT_MAX_FAILURES:
+            logger.error(
+                "Failed to collect EL2 results for item %s with error: %s. Giving up after %s "
+                "attempts.",
+                item,
+                e,
+                item.el2_collect_failures,
+            )
+            js.elaspic2client.client.release(mi.el2_web_url for mi in item.el2_mutation_info_list)
+            js.schedule_finalize_mutation(item, ds)
+            return
+        logger.error("Failed to collect EL2 results for item %s with error: %s.", item, e)
+        await ds.elaspic2_running_queue.put(item)
 
 
-async def _el2_collect_mutation_scores(item: js.Item) -> Optional[List[MutationInfo]]:
-    mutation_scores: List[MutationInfo] = []
-    for mutation_info in item.el2_mutation_info_list:
-        job_status = await _el2_get_status(mutation_info.el2_web_url)
-        # TODO: Throws KeyError("status")
+async def elaspic2_flush_loop(ds: js.DataStructures) -> None:
+    while True:
+        await asyncio.sleep(js.perf.SLEEP_FOR_EL2_FLUSH)
+        if not ds.elaspic2_score_buffer:
+            continue
+        num_scores = sum(len(mutation_scores) for _, mutation_scores, _ in ds.elaspic2_score_buffer)
+        oldest_time = ds.elaspic2_score_buffer[0][2]
+        if (
+            num_scores >= config.EL2_SCORE_FLUSH_SIZE
+            or time.time() - oldest_time >= config.EL2_SCORE_FLUSH_INTERVAL
+        ):
+            await flush_mutation_scores(ds)
+
+
+async def flush_mutation_scores(ds: js.DataStructures) -> None:
+    """Write buffered ELASPIC2 scores to the database and finalize the corresponding items."""
+    buffer, ds.elaspic2_score_buffer = ds.elaspic2_score_buffer, []
+
+    buffer_by_job_type: Dict[str, List[Tuple[js.Item, List[MutationInfo], float]]] = {}
+    for entry in buffer:
+        buffer_by_job_type.setdefault(entry[0].args["job_type"], []).append(entry)
+
+    for job_type, entries in buffer_by_job_type.items():
+        mutation_scores = [
+            ms for _, item_mutation_scores, _ in entries for ms in item_mutation_scores
+        ]
+        try:
+            await update_mutation_scores(job_type, mutation_scores)
+        except Exception as e:
+            logger.error(
+                "Failed to write %s EL2 scores to the database with error: %s. Retrying later...",
+                len(mutation_scores),
+                e,
+            )
+            ds.elaspic2_score_buffer[:0] = entries
+            continue
+        logger.debug("Wrote %s EL2 scores for %s items.", len(mutation_scores), len(entries))
+        for item, _, _ in entries:
+            js.elaspic2client.client.release(mi.el2_web_url for mi in item.el2_mutation_info_list)
+            js.schedule_finalize_mutation(item, ds)
+
+
+async def _el2_collect_mutation_scores(
+    item: js.Item, semaphore: asyncio.Semaphore, requests: Dict[str, asyncio.Task]
+) -> Optional[List[MutationInfo]]:
+    """Return the ELASPIC2 scores for `item`, or `None` if its EL2 jobs are still running.
+
+    Raises:
+        EL2Error: If the status or the results of an EL2 job could not be retrieved.
+    """
+    job_statuses = await asyncio.gather(
+        *[
+            _el2_get_shared(_el2_get_status, mutation_info.el2_web_url, semaphore, requests)
+            for mutation_info in item.el2_mutation_info_list
+        ]
+    )
+    for mutation_info, job_status in zip(item.el2_mutation_info_list, job_statuses):
         if job_status is None:
-            return
+            raise EL2Error(f"Failed to get the status of EL2 job {mutation_info.el2_web_url}.")
 
         if "status" not in job_status:
-            logger.error(
-                "mutation_info: %s; job_status: %s; web_url: %s",
-                mutation_info,
-                job_status,
-                mutation_info.el2_web_url,
+            raise EL2Error(
+                f"EL2 job {mutation_info.el2_web_url} has an invalid status: {job_status}."
             )
-            return
 
         if job_status["status"] not in ["failed", "success"]:
-            return
-
-        job_result = await _el2_get_result(job_status["web_url"])
+            return None
+
+    # Results are only requested once all EL2 jobs for this item have finished
+    job_results = await asyncio.gather(
+        *[
+            _el2_get_shared(_el2_get_result, job_status["web_url"], semaphore, requests)
+            for job_status in job_statuses
+        ]
+    )
+    for job_status, job_result in zip(job_statuses, job_results):
         if job_result is None:
-            return
+            raise EL2Error(f"Failed to get the results of EL2 job {job_status['web_url']}.")
 
+    mutation_scores: List[MutationInfo] = []
+    for mutation_info, job_result in zip(item.el2_mutation_info_list, job_results):
         # It is possible that EL2 fails to calculate scores for some mutations,
         # in which case we simply skip those mutations.
-        if not job_result:
+        mutation_result = _find_mutation_result(mutation_info, job_result)
+        if mutation_result is None:
             continue
 
-        mutation_score = job_result_to_mutation_scores(mutation_info, job_result[0])
+        mutation_score = job_result_to_mutation_scores(mutation_info, mutation_result)
         mutation_scores.append(mutation_score)
     return mutation_scores
 
 
-async def _el2_get_status(el2_status_web_url: str) -> Optional[Dict]:
-    async with aiohttp.ClientSession() as session:
-        async with session.get(el2_status_web_url) as resp:
-            try:
-                job_status = await resp.json()
-                return job_status
-            except Exception as e:
-                logger.error("Failed to retrieve ELASPIC2 status with error: %s.", e)
+async def _el2_get_shared(
+    get_fn: Callable[[str], Awaitable[Optional[Dict]]],
+    web_url: str,
+    semaphore: asyncio.Semaphore,
+    requests: Dict[str, asyncio.Task],
+) -> Optional[Dict]:
+    """Call `get_fn(web_url)` at most once per polling pass, with bounded concurrency."""
 
+    async def get_bounded():
+        async with semaphore:
+            return await get_fn(web_url)
 
-async def _el2_get_result(el2_result_web_url: str) -> Optional[Dict]:
-    async with aiohttp.ClientSession() as session:
-        async with session.get(el2_result_web_url) as resp:
-            try:
-                job_result = await resp.json()
-                return job_result
-            except Exception as e:
-                logger.error("Failed to retrieve ELASPIC2 result with error: %s.", e)
+    if web_url not in requests:
+        requests[web_url] = asyncio.create_task(get_bounded())
+    return await asyncio.shield(requests[web_url])
 
 
-async def _el2_delete_jobs(el2_status_web_urls: List[str]) -> None:
-    async with aiohttp.ClientSession() as session:
-        for el2_status_web_url in el2_status_web_urls:
-            await session.delete(el2_status_web_url)
+async def _el2_get_status(el2_status_web_url: str) -> Optional[Dict]:
+    return await js.elaspic2client.client.get_json(el2_status_web_url)
+
+
+async def _el2_get_result(el2_result_web_url: str) -> Optional[Dict]:
+    return await js.elaspic2client.client.get_json(el2_result_web_url)
+
+
+def _find_mutation_result(mutation_info: MutationInfo, job_result: List[Dict]) -> Optional[Dict]:
+    """Find the result for `mutation_info` among the results of a multi-mutation EL2 job."""
+    if not job_result:
+        return None
+    for mutation_result in job_result:
+        if (
+            "mutation" in mutation_result
+            and mutation_result["mutation"] == mutation_info.el2_mutation
+        ):
+            return mutation_result
+    # Single-mutation jobs
+    if len(job_result) == 1 and (
+        mutation_info.el2_mutation is None or "mutation" not in job_result[0]
+    ):
+        return job_result[0]
+    return None
 
 
 def job_result_to_mutation_scores(mutation_info: MutationInfo, job_result: Dict) -> MutationInfo:
@@ -154,6 +439,21 @@ def extract_protein_info_list(mutation_info_list: List[MutationInfo]) -> List[Di
     return protein_info_list
 
 
+def extract_protein_info_list_safe(
+    mutation_info_list: List[MutationInfo],
+) -> List[Union[Dict, EL2Error]]:
+    """Same as `extract_protein_info_list`, but returns errors instead of raising them."""
+    protein_info_list: List[Union[Dict, EL2Error]] = []
+    for mutation_info in mutation_info_list:
+        try:
+            protein_info_list.append(extract_protein_info(mutation_info))
+        except EL2Error as e:
+            protein_info_list.append(e)
+        except Exception as e:
+            protein_info_list.append(EL2Error(f"{type(e).__name__}: {e}"))
+    return protein_info_list
+
+
 def extract_protein_info(mutation_info: MutationInfo) -> Dict:
     structure_file = Path(mutation_info.structure_file)
 
@@ -162,21 +462,12 @@ def extract_protein_info(mutation_info: MutationInfo) -> Dict:
     if config.DATA_DIR not in structure_file.as_posix():
         raise EL2Error(f"Structure file is not available remotely for mutation: {mutation_info}.")
 
-    @contextmanager
-    def disable_logger(logger, level=logging.WARNING):
-        try:
-            logger.setLevel(level)
-            yield
-        finally:
-            logger.setLevel(logging.NOTSET)
-
-    with disable_logger(logging.getLogger("kmbio.PDB.core.atom")):
-        structure = PDB.load(structure_file)
+    structure_info = load_structure_info(structure_file)
 
     protein_sequence, ligand_sequence = _extract_chain_sequences(
-        structure, mutation_info.chain_id, mutation_info.coi
+        structure_info, mutation_info.chain_id, mutation_info.coi
     )
-    mutation = map_mutation_to_chain(structure, mutation_info.chain_id, mutation_info.mutation)
+    mutation = map_mutation_to_chain(structure_info, mutation_info.chain_id, mutation_info.mutation)
 
     if protein_sequence is None:
         raise EL2Error(f"Could not extract protein sequence for mutation: {mutation_info}.")
@@ -201,33 +492,64 @@ def extract_protein_info(mutation_info: MutationInfo) -> Dict:
     return result
 
 
+def load_structure_info(structure_file: Path) -> StructureInfo:
+    """Return chain sequences and residue index maps for `structure_file`.
+
+    Parsed structures are cached, so that mutations in the same structure are processed
+    without parsing the structure again. Modified files are detected using their mtime and size.
+    """
+    structure_file = structure_file.resolve()
+    stat = structure_file.stat()
+    return _load_structure_info(structure_file.as_posix(), stat.st_mtime, stat.st_size)
+
+
+@lru_cache(maxsize=config.EL2_STRUCTURE_CACHE_SIZE)
+def _load_structure_info(structure_file: str, mtime: float, size: int) -> StructureInfo:
+    with _disable_logger(logging.getLogger("kmbio.PDB.core.atom")):
+        structure = PDB.load(structure_file)
+
+    df = structure.to_dataframe()
+    chain_sequences = {}
+    residue_idx_maps = {}
+    for chain in structure.chains:
+        chain_sequences[chain.id] = structure_tools.get_chain_sequence(
+            chain, if_unknown="replace", unknown_residue_marker=""
+        )
+        residue_idx = df[df["chain_id"] == chain.id]["residue_idx"].unique()
+        if len(residue_idx):
+            residue_idx_maps[chain.id] = {
+                int(old_residue_idx): int(new_residue_idx)
+                for (old_residue_idx, new_residue_idx) in zip(
+                    residue_idx, residue_idx - residue_idx.min()
+                )
+            }
+    return StructureInfo(chain_sequences, residue_idx_maps)
+
+
+@contextmanager
+def _disable_logger(logger, level=logging.WARNING):
+    try:
+        logger.setLevel(level)
+        yield
+    finally:
+        logger.setLevel(logging.NOTSET)
+
+
 def _extract_chain_sequences(
-    structure: PDB.Structure, chain_id: str, coi: COI, remove_hetatms=True
+    structure_info: StructureInfo, chain_id: str, coi: COI
 ) -> Tuple[Optional[str], Optional[str]]:
-    unknown_residue_marker = "" if remove_hetatms else "X"
     protein_sequence = None
     ligand_sequence = None
-    for chain in structure.chains:
-        chain_sequence = structure_tools.get_chain_sequence(
-            chain, if_unknown="replace", unknown_residue_marker=unknown_residue_marker
-        )
-        if chain.id == chain_id:
+    for chain_id_, chain_sequence in structure_info.chain_sequences.items():
+        if chain_id_ == chain_id:
             protein_sequence = chain_sequence
         elif coi == COI.INTERFACE and ligand_sequence is None and chain_sequence:
             ligand_sequence = chain_sequence
     return protein_sequence, ligand_sequence
 
 
-def map_mutation_to_chain(structure: PDB.Structure, chain_id: str, mutation: str) -> str:
-    df = structure.to_dataframe()
-    chain_df = df[df["chain_id"] == chain_id]
-    residue_idx = chain_df["residue_idx"].unique()
-
-    residue_idx_map = {
-        old_residue_idx: new_residue_idx
-        for (old_residue_idx, new_residue_idx) in zip(residue_idx, residue_idx - residue_idx.min())
-    }
-
+def map_mutation_to_chain(structure_info: StructureInfo, chain_id: str, mutation: str) -> str:
+    residue_idx_map = structure_info.residue_idx_maps[chain_id]
     pos = int(mutation[1:-1])
     pos_new = residue_idx_map[pos - 1] + 1
     return f"{mutation[0]}{pos_new}{mutation[-1]}"
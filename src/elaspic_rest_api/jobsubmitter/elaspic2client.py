@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional
+from urllib.parse import urljoin
+
+import aiohttp
+
+from elaspic_rest_api import config
+from elaspic_rest_api.jobsubmitter import perf
+from elaspic_rest_api.jobsubmitter.elaspic2types import EL2Error
+from elaspic_rest_api.jobsubmitter.ssh import CommandStats
+
+logger = logging.getLogger(__name__)
+
+#: HTTP status codes which indicate a transient error that is worth retrying
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+#: HTTP status codes for which POST requests are retried (the server did not create a job)
+POST_RETRY_STATUSES = {429, 503}
+#: Errors raised before the request is sent, after which POST requests can be retried safely
+CONNECT_ERRORS = (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError)
+
+
+@dataclass
+class EL2Job:
+    created: float
+    #: Number of items which still need the results of this job
+    refcount: int = 0
+
+
+class EL2Client:
+    """Long-lived HTTP client for the ELASPIC2 REST API.
+
+    All requests share a single keep-alive connection pool. ELASPIC2 jobs are deleted
+    in the background by `cleanup_loop` once no item references them anymore, and jobs which were
+    created but never picked up by an item (e.g. because `elaspic2_submit_loop` crashed)
+    are deleted after `orphan_timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        connection_limit: int,
+        connect_timeout: float,
+        request_timeout: float,
+        max_retries: int,
+        retry_backoff: float,
+        delete_concurrency: int,
+        orphan_timeout: float,
+    ) -> None:
+        self.base_url = base_url
+        self.connection_limit = connection_limit
+        self.timeout = aiohttp.ClientTimeout(total=request_timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.delete_concurrency = delete_concurrency
+        self.orphan_timeout = orphan_timeout
+        #: ELASPIC2 jobs which have been created but not yet scheduled for deletion
+        self.jobs: Dict[str, EL2Job] = {}
+        #: Latency and failure counts for each request method
+        self.stats: Dict[str, CommandStats] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._delete_queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def create_job(self, protein_info: Dict) -> Dict:
+        """Submit a new ELASPIC2 job and return the job request."""
+        job_request = await self._request(
+            "POST", urljoin(self.base_url, "jobs/"), json=protein_info
+        )
+        self.jobs[job_request["web_url"]] = EL2Job(time.time())
+        return job_request
+
+    async def get_json(self, url: str) -> Optional[Any]:
+        """Return the JSON response for `url`, or `None` if the request failed."""
+        try:
+            return await self._request("GET", url)
+        except Exception as e:
+            logger.error("Failed to retrieve ELASPIC2 response from %s with error: %s.", url, e)
+            return None
+
+    def acquire(self, web_urls: Iterable[str]) -> None:
+        """Mark ELASPIC2 jobs as being used by an item."""
+        for web_url in set(web_urls):
+            job = self.jobs.setdefault(web_url, EL2Job(time.time()))
+            job.refcount += 1
+
+    def release(self, web_urls: Iterable[str]) -> None:
+        """Mark ELASPIC2 jobs as no longer used by an item, deleting jobs which are not needed."""
+        for web_url in set(web_urls):
+            job = self.jobs.get(web_url)
+            if job is None:
+                continue
+            job.refcount -= 1
+            if job.refcount <= 0:
+                self._schedule_delete(web_url)
+
+    def sweep_orphans(self) -> int:
+        """Schedule the deletion of jobs which were never picked up by an item."""
+        cutoff = time.time() - self.orphan_timeout
+        orphans = [
+            web_url
+            for web_url, job in self.jobs.items()
+            if job.refcount <= 0 and job.created < cutoff
+        ]
+        for web_url in orphans:
+            logger.warning("Deleting orphaned ELASPIC2 job %s.", web_url)
+            self._schedule_delete(web_url)
+        return len(orphans)
+
+    @property
+    def num_pending_deletes(self) -> int:
+        return self._delete_queue.qsize() if self._delete_queue is not None else 0
+
+    async def cleanup_loop(self) -> None:
+        """Delete finished and orphaned ELASPIC2 jobs in the background."""
+        delete_queue = self._get_delete_queue()
+        workers: List[asyncio.Task] = [
+            asyncio.create_task(self._delete_worker(delete_queue))
+            for _ in range(self.delete_concurrency)
+        ]
+        try:
+            while True:
+                await asyncio.sleep(perf.SLEEP_FOR_EL2_CLEANUP)
+                self.sweep_orphans()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _request(self, method: str, url: str, **kwargs) -> Any:
+        """Send a request, retrying transient errors.
+
+        POST requests are not idempotent (each one creates a new ELASPIC2 job), so they are only
+        retried if they could not be sent or if the server refused them. Other errors are raised
+        without retrying, since the job may have been created already.
+        """
+        session = self._get_session()
+        retry_statuses = POST_RETRY_STATUSES if method == "POST" else RETRY_STATUSES
+        error = "unk"
+        for attempt in range(self.max_retries + 1):
+            start_time = time.perf_counter()
+            try:
+                async with session.request(method, url, **kwargs) as resp:
+                    if resp.status not in retry_statuses:
+                        self._record(method, time.perf_counter() - start_time, resp.status < 400)
+                        if method == "DELETE":
+                            # The job may have been removed already
+                            if resp.status != 404:
+                                resp.raise_for_status()
+                            return None
+                        resp.raise_for_status()
+                        return await resp.json()
+                    error = f"HTTP {resp.status}"
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = f"{type(e).__name__}: {e}"
+                if method == "POST" and not isinstance(e, CONNECT_ERRORS):
+                    self._record(method, time.perf_counter() - start_time, False)
+                    raise EL2Error(
+                        f"ELASPIC2 request {method} {url} failed with error: {error}."
+                    ) from e
+            self._record(method, time.perf_counter() - start_time, False)
+            if attempt < self.max_retries:
+                delay = self.retry_backoff * 2**attempt
+                logger.warning(
+                    "ELASPIC2 request %s %s failed (attempt %s): %s. Retrying in %s s...",
+                    method,
+                    url,
+                    attempt,
+                    error,
+                    delay,
+                )
+                await asyncio.sleep(delay)
+        raise EL2Error(f"ELASPIC2 request {method} {url} failed with error: {error}.")
+
+    async def _delete_worker(self, delete_queue: asyncio.Queue) -> None:
+        while True:
+            web_url = await delete_queue.get()
+            try:
+                await self._request("DELETE", web_url)
+            except Exception as e:
+                logger.error("Failed to delete ELASPIC2 job %s with error: %s.", web_url, e)
+
+    def _schedule_delete(self, web_url: str) -> None:
+        del self.jobs[web_url]
+        self._get_delete_queue().put_nowait(web_url)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        self._check_loop()
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.connection_limit)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    def _get_delete_queue(self) -> asyncio.Queue:
+        self._check_loop()
+        if self._delete_queue is None:
+            self._delete_queue = asyncio.Queue()
+        return self._delete_queue
+
+    def _check_loop(self) -> None:
+        # Sessions and queues are bound to an event loop, so we need different ones for each loop
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._session = None
+            self._delete_queue = None
+            self._loop = loop
+
+    def _record(self, method: str, duration: float, success: bool) -> None:
+        self.stats.setdefault(method, CommandStats()).record(duration, success)
+
+
+#: Client shared by all ELASPIC2 tasks
+client = EL2Client(
+    config.ELASPIC2_URL,
+    connection_limit=config.EL2_CONNECTION_LIMIT,
+    connect_timeout=config.EL2_CONNECT_TIMEOUT,
+    request_timeout=config.EL2_REQUEST_TIMEOUT,
+    max_retries=config.EL2_MAX_RETRIES,
+    retry_backoff=config.EL2_RETRY_BACKOFF,
+    delete_concurrency=config.EL2_DELETE_CONCURRENCY,
+    orphan_timeout=config.EL2_ORPHAN_TIMEOUT,
+)
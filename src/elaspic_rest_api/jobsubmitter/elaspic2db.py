@@ -1,146 +1,221 @@
 import logging
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 
 from elaspic_rest_api import jobsubmitter as js
 from elaspic_rest_api.jobsubmitter.elaspic2types import COI, MutationInfo
 
 logger = logging.getLogger(__name__)
 
+#: Maximum number of `(protein_id, mutation)` pairs to look up in a single query
+MAX_BATCH_SIZE = 500
+
 # Local core
 get_core_mutation_local_sql = """\
-select domain_id as domain_or_interface_id,
+select protein_id,
+    mutation,
+    domain_id as domain_or_interface_id,
     model_filename_wt,
     chain_modeller,
     mutation_modeller
 from elaspic_webserver.elaspic_core_mutation_local
-where protein_id = %(protein_id)s and mutation = %(mutation)s;
+where (protein_id, mutation) in ({values});
 """
 
 update_core_mutation_local_sql = """\
 update elaspic_webserver.elaspic_core_mutation_local mut
-set mut.protbert_score = %(protbert_score)s,
-    mut.proteinsolver_score = %(proteinsolver_score)s,
-    mut.el2_score = %(el2_score)s,
-    mut.el2_version = %(el2_version)s
-where domain_id = %(domain_or_interface_id)s and protein_id = %(protein_id)s
-    and mutation_modeller = %(mutation)s;
+join ({scores}) s
+    on mut.domain_id = s.domain_or_interface_id and mut.protein_id = s.protein_id
+    and mut.mutation_modeller = s.mutation
+set mut.protbert_score = s.protbert_score,
+    mut.proteinsolver_score = s.proteinsolver_score,
+    mut.el2_score = s.el2_score,
+    mut.el2_version = s.el2_version;
+"""
+
+count_core_mutation_local_sql = """\
+select s.domain_or_interface_id, s.protein_id, s.mutation, count(mut.mutation_modeller)
+from ({scores}) s
+left join elaspic_webserver.elaspic_core_mutation_local mut
+    on mut.domain_id = s.domain_or_interface_id and mut.protein_id = s.protein_id
+    and mut.mutation_modeller = s.mutation
+group by s.domain_or_interface_id, s.protein_id, s.mutation;
 """
 
 # Local interface
 get_interface_mutation_local_sql = """\
-select interface_id as domain_or_interface_id,
+select protein_id,
+    mutation,
+    interface_id as domain_or_interface_id,
     model_filename_wt,
     chain_modeller,
     mutation_modeller
 from elaspic_webserver.elaspic_interface_mutation_local
-where protein_id = %(protein_id)s and mutation = %(mutation)s;
+where (protein_id, mutation) in ({values});
 """
 
 update_interface_mutation_local_sql = """\
 update elaspic_webserver.elaspic_interface_mutation_local mut
-set mut.protbert_score = %(protbert_score)s,
-    mut.proteinsolver_score = %(proteinsolver_score)s,
-    mut.el2_score = %(el2_score)s,
-    mut.el2_version = %(el2_version)s
-where interface_id = %(domain_or_interface_id)s and protein_id = %(protein_id)s
-    and mutation_modeller = %(mutation)s;
+join ({scores}) s
+    on mut.interface_id = s.domain_or_interface_id and mut.protein_id = s.protein_id
+    and mut.mutation_modeller = s.mutation
+set mut.protbert_score = s.protbert_score,
+    mut.proteinsolver_score = s.proteinsolver_score,
+    mut.el2_score = s.el2_score,
+    mut.el2_version = s.el2_version;
+"""
+
+count_interface_mutation_local_sql = """\
+select s.domain_or_interface_id, s.protein_id, s.mutation, count(mut.mutation_modeller)
+from ({scores}) s
+left join elaspic_webserver.elaspic_interface_mutation_local mut
+    on mut.interface_id = s.domain_or_interface_id and mut.protein_id = s.protein_id
+    and mut.mutation_modeller = s.mutation
+group by s.domain_or_interface_id, s.protein_id, s.mutation;
 """
 
 # Database core
 get_core_mutation_database_sql = """\
-SELECT d.uniprot_domain_id as domain_or_interface_id,
+SELECT mut.uniprot_id,
+    mut.mutation,
+    d.uniprot_domain_id as domain_or_interface_id,
     CONCAT(d.path_to_data, mut.model_filename_wt) as model_filename_wt,
     mut.chain_modeller,
     mut.mutation_modeller
 FROM elaspic.uniprot_domain_mutation mut
 JOIN elaspic.uniprot_domain d USING (uniprot_domain_id)
-WHERE mut.uniprot_id = %(protein_id)s AND mutation = %(mutation)s;
+WHERE (mut.uniprot_id, mut.mutation) IN ({values});
 """
 
 update_core_mutation_database_sql = """\
 update elaspic.uniprot_domain_mutation mut
-set mut.protbert_score = %(protbert_score)s,
-    mut.proteinsolver_score = %(proteinsolver_score)s,
-    mut.el2_score = %(el2_score)s,
-    mut.el2_version = %(el2_version)s
-where uniprot_domain_id = %(domain_or_interface_id)s and uniprot_id = %(protein_id)s
-    and mutation_modeller = %(mutation)s;
+join ({scores}) s
+    on mut.uniprot_domain_id = s.domain_or_interface_id and mut.uniprot_id = s.protein_id
+    and mut.mutation_modeller = s.mutation
+set mut.protbert_score = s.protbert_score,
+    mut.proteinsolver_score = s.proteinsolver_score,
+    mut.el2_score = s.el2_score,
+    mut.el2_version = s.el2_version;
+"""
+
+count_core_mutation_database_sql = """\
+select s.domain_or_interface_id, s.protein_id, s.mutation, count(mut.mutation_modeller)
+from ({scores}) s
+left join elaspic.uniprot_domain_mutation mut
+    on mut.uniprot_domain_id = s.domain_or_interface_id and mut.uniprot_id = s.protein_id
+    and mut.mutation_modeller = s.mutation
+group by s.domain_or_interface_id, s.protein_id, s.mutation;
 """
 
 # Database interface
 get_interface_mutation_database_sql = """\
-SELECT d.uniprot_domain_pair_id as domain_or_interface_id,
+SELECT mut.uniprot_id,
+    mut.mutation,
+    d.uniprot_domain_pair_id as domain_or_interface_id,
     CONCAT(d.path_to_data, mut.model_filename_wt) as model_filename_wt,
     mut.chain_modeller,
     mut.mutation_modeller
 FROM elaspic.uniprot_domain_pair_mutation mut
 JOIN elaspic.uniprot_domain_pair d USING (uniprot_domain_pair_id)
-WHERE mut.uniprot_id = %(protein_id)s AND mutation = %(mutation)s;
+WHERE (mut.uniprot_id, mut.mutation) IN ({values});
 """
 
 update_interface_mutation_database_sql = """\
 update elaspic.uniprot_domain_pair_mutation mut
-set mut.protbert_score = %(protbert_score)s,
-    mut.proteinsolver_score = %(proteinsolver_score)s,
-    mut.el2_score = %(el2_score)s,
-    mut.el2_version = %(el2_version)s
-where uniprot_domain_pair_id = %(domain_or_interface_id)s and uniprot_id = %(protein_id)s
-    and mutation_modeller = %(mutation)s;
+join ({scores}) s
+    on mut.uniprot_domain_pair_id = s.domain_or_interface_id and mut.uniprot_id = s.protein_id
+    and mut.mutation_modeller = s.mutation
+set mut.protbert_score = s.protbert_score,
+    mut.proteinsolver_score = s.proteinsolver_score,
+    mut.el2_score = s.el2_score,
+    mut.el2_version = s.el2_version;
+"""
+
+count_interface_mutation_database_sql = """\
+select s.domain_or_interface_id, s.protein_id, s.mutation, count(mut.mutation_modeller)
+from ({scores}) s
+left join elaspic.uniprot_domain_pair_mutation mut
+    on mut.uniprot_domain_pair_id = s.domain_or_interface_id and mut.uniprot_id = s.protein_id
+    and mut.mutation_modeller = s.mutation
+group by s.domain_or_interface_id, s.protein_id, s.mutation;
 """
 
 
 async def get_mutation_info(item: js.Item) -> List[MutationInfo]:
-    args = item.args
-    kwargs = {"protein_id": args["protein_id"], "mutation": _format_mutation(args["mutations"])}
+    return (await get_mutation_info_batch([item]))[0]
 
-    if args["job_type"] == "local":
-        core_mutation_sql = get_core_mutation_local_sql
-        interface_mutation_sql = get_interface_mutation_local_sql
-    else:
-        assert args["job_type"] == "database"
-        core_mutation_sql = get_core_mutation_database_sql
-        interface_mutation_sql = get_interface_mutation_database_sql
 
+async def get_mutation_info_batch(items: List[js.Item]) -> List[List[MutationInfo]]:
+    """Look up structures and chains for the mutations in `items`, using set-based queries.
+
+    Returns:
+        A list of mutation info for each item in `items`.
+    """
+    items_by_job_type: Dict[str, List[Tuple[str, str]]] = {}
+    for item in items:
+        if item.args["job_type"] not in ["local", "database"]:
+            raise ValueError(f"Unsupported job type: {item.args['job_type']}.")
+        key = (item.args["protein_id"], _format_mutation(item.args["mutations"]))
+        items_by_job_type.setdefault(item.args["job_type"], []).append(key)
+
+    mutation_values: Dict[Tuple, List[Tuple]] = {}
     async with js.WDBConnection() as conn:
         async with conn.cursor() as cur:
-            await cur.execute(core_mutation_sql, kwargs)
-            core_mutation_values: List[Tuple[int, str, str, str]] = await cur.fetchall()
-
-            await cur.execute(interface_mutation_sql, kwargs)
-            interface_mutation_values: List[Tuple[int, str, str, str]] = await cur.fetchall()
-
-    mutation_info_list = [
-        MutationInfo(
-            domain_or_interface_id=domain_id,
-            structure_file=structure_file,
-            chain_id=chain_id,
-            mutation=mutation,
-            protein_id=kwargs["protein_id"],
-            coi=COI.CORE,
-        )
-        for (domain_id, structure_file, chain_id, mutation) in core_mutation_values
-    ] + [
-        MutationInfo(
-            domain_or_interface_id=interface_id,
-            structure_file=structure_file,
-            chain_id=chain_id,
-            mutation=mutation,
-            protein_id=kwargs["protein_id"],
-            coi=COI.INTERFACE,
-        )
-        for (interface_id, structure_file, chain_id, mutation) in interface_mutation_values
-    ]
+            for job_type, keys in items_by_job_type.items():
+                if job_type == "local":
+                    core_mutation_sql = get_core_mutation_local_sql
+                    interface_mutation_sql = get_interface_mutation_local_sql
+                else:
+                    core_mutation_sql = get_core_mutation_database_sql
+                    interface_mutation_sql = get_interface_mutation_database_sql
 
-    logger.info(
-        "Obtained the following mutation data for item %s (%s): %s",
-        item,
-        kwargs,
-        mutation_info_list,
-    )
-    return mutation_info_list
+                unique_keys = list(dict.fromkeys(keys))
+                for start in range(0, len(unique_keys), MAX_BATCH_SIZE):
+                    chunk = unique_keys[start : start + MAX_BATCH_SIZE]
+                    values = ", ".join(["(%s, %s)"] * len(chunk))
+                    params = [value for key in chunk for value in key]
+                    for coi, mutation_sql in [
+                        (COI.CORE, core_mutation_sql),
+                        (COI.INTERFACE, interface_mutation_sql),
+                    ]:
+                        await cur.execute(mutation_sql.format(values=values), params)
+                        for (protein_id, mutation, *row) in await cur.fetchall():
+                            key = (job_type, coi, *_lookup_key(protein_id, mutation))
+                            mutation_values.setdefault(key, []).append(tuple(row))
+
+    mutation_info_lists = []
+    for item in items:
+        args = item.args
+        protein_id = args["protein_id"]
+        mutation = _format_mutation(args["mutations"])
+        mutation_info_list = [
+            MutationInfo(
+                domain_or_interface_id=domain_or_interface_id,
+                structure_file=structure_file,
+                chain_id=chain_id,
+                mutation=mutation_modeller,
+                protein_id=protein_id,
+                coi=coi,
+            )
+            for coi in [COI.CORE, COI.INTERFACE]
+            for (domain_or_interface_id, structure_file, chain_id, mutation_modeller) in (
+                mutation_values.get((args["job_type"], coi, *_lookup_key(protein_id, mutation)), [])
+            )
+        ]
+        logger.info(
+            "Obtained the following mutation data for item %s (%s): %s",
+            item,
+            {"protein_id": protein_id, "mutation": mutation},
+            mutation_info_list,
+        )
+        mutation_info_lists.append(mutation_info_list)
+    return mutation_info_lists
 
 
 async def update_mutation_scores(job_type: str, mutation_scores: List[MutationInfo]) -> None:
+    """Write ELASPIC2 scores to the database, using one bulk update per table.
+
+    If the same mutation is scored more than once, the last score is kept.
+    """
     if job_type not in ["local", "database"]:
         raise ValueError
 
@@ -155,35 +230,75 @@ async def update_mutation_scores(job_type: str, mutation_scores: List[MutationIn
     ]
 
     if job_type == "local":
-        core_mutation_sql = update_core_mutation_local_sql
-        interface_mutation_sql = update_interface_mutation_local_sql
+        core_mutation_sqls = (update_core_mutation_local_sql, count_core_mutation_local_sql)
+        interface_mutation_sqls = (
+            update_interface_mutation_local_sql,
+            count_interface_mutation_local_sql,
+        )
     else:
         assert job_type == "database"
-        core_mutation_sql = update_core_mutation_database_sql
-        interface_mutation_sql = update_interface_mutation_database_sql
+        core_mutation_sqls = (update_core_mutation_database_sql, count_core_mutation_database_sql)
+        interface_mutation_sqls = (
+            update_interface_mutation_database_sql,
+            count_interface_mutation_database_sql,
+        )
+
+    attributes_by_coi: Dict[COI, Dict[Tuple, Dict]] = {COI.CORE: {}, COI.INTERFACE: {}}
+    for mutation_score in mutation_scores:
+        attributes = {key: getattr(mutation_score, key) for key in required_attributes}
+        key = (
+            mutation_score.domain_or_interface_id,
+            mutation_score.protein_id,
+            mutation_score.mutation,
+        )
+        attributes_by_coi[mutation_score.coi][key] = attributes
 
     async with js.WDBConnection() as conn:
         async with conn.cursor() as cur:
-            for mutation_score in mutation_scores:
-                if mutation_score.coi == COI.CORE:
-                    update_mutation_sql = core_mutation_sql
-                else:
-                    update_mutation_sql = interface_mutation_sql
-
-                attributes = {key: getattr(mutation_score, key) for key in required_attributes}
-                await cur.execute(update_mutation_sql, attributes)
-                if cur.rowcount != 1:
-                    logger.error(
-                        "Unexpected number of rows modified when updating database: %s "
-                        "(job_type = %s, coi = %s, attributes = %s).",
-                        cur.rowcount,
-                        job_type,
-                        mutation_score.coi.value,
-                        attributes,
-                    )
+            for coi, (update_mutation_sql, count_mutation_sql) in [
+                (COI.CORE, core_mutation_sqls),
+                (COI.INTERFACE, interface_mutation_sqls),
+            ]:
+                attributes_list = list(attributes_by_coi[coi].values())
+                for start in range(0, len(attributes_list), MAX_BATCH_SIZE):
+                    chunk = attributes_list[start : start + MAX_BATCH_SIZE]
+                    scores = _format_scores_table(len(chunk))
+                    params = [
+                        attributes[key] for attributes in chunk for key in required_attributes
+                    ]
+
+                    await cur.execute(count_mutation_sql.format(scores=scores), params)
+                    row_counts = {tuple(row[:3]): row[3] for row in await cur.fetchall()}
+                    for attributes in chunk:
+                        key = tuple(attributes[k] for k in required_attributes[:3])
+                        row_count = row_counts.get(key, 0)
+                        if row_count != 1:
+                            logger.error(
+                                "Unexpected number of rows modified when updating database: %s "
+                                "(job_type = %s, coi = %s, attributes = %s).",
+                                row_count,
+                                job_type,
+                                coi.value,
+                                attributes,
+                            )
+
+                    await cur.execute(update_mutation_sql.format(scores=scores), params)
         await conn.commit()
 
 
+def _format_scores_table(num_rows: int) -> str:
+    row = (
+        "select %s as domain_or_interface_id, %s as protein_id, %s as mutation, "
+        "%s as protbert_score, %s as proteinsolver_score, %s as el2_score, %s as el2_version"
+    )
+    return " union all ".join([row] * num_rows)
+
+
+def _lookup_key(protein_id: str, mutation: str) -> Tuple[str, str]:
+    # Comparisons in MySQL are case-insensitive
+    return protein_id.lower(), mutation.lower()
+
+
 def _format_mutation(mutation: str) -> str:
     assert "," not in mutation
     if "_" in mutation:
@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import NamedTuple, Optional
+from typing import Dict, NamedTuple, Optional
 
 
 class COI(Enum):
@@ -16,11 +16,20 @@ class MutationInfo(NamedTuple):
     coi: COI
     # Results
     el2_web_url: Optional[str] = None
+    #: Mutation as submitted to ELASPIC2 (i.e. numbered relative to the start of the chain)
+    el2_mutation: Optional[str] = None
     protbert_score: Optional[float] = None
     proteinsolver_score: Optional[float] = None
     el2_score: Optional[float] = None
     el2_version: str = "0.1.13"
 
 
+class StructureInfo(NamedTuple):
+    #: Sequence of each chain, in the order in which the chains appear in the structure
+    chain_sequences: Dict[str, str]
+    #: Mapping from residue indices in the structure to residue indices within each chain
+    residue_idx_maps: Dict[str, Dict[int, int]]
+
+
 class EL2Error(Exception):
     pass
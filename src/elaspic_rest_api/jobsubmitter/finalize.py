@@ -1,10 +1,8 @@
 import asyncio
 import logging
-import shlex
 from asyncio import Queue
-from typing import Dict, Set
+from typing import Dict, List, Set, Tuple
 
-from elaspic_rest_api import config
 from elaspic_rest_api import jobsubmitter as js
 
 logger = logging.getLogger(__name__)
@@ -48,58 +46,144 @@ async def set_job_status(job_id: str) -> int:
     return num_rows_affected
 
 
+async def finalize_mutations_loop(ds: js.DataStructures) -> None:
+    """Finalize mutations scheduled using `schedule_finalize_mutation` in batches."""
+    while True:
+        await finalize_pending_mutations(ds)
+        await asyncio.sleep(js.perf.SLEEP_FOR_FINALIZE)
+
+
+def schedule_finalize_mutation(item: js.Item, ds: js.DataStructures) -> None:
+    """Mark `item` as "done" or "error" and stop monitoring it, as part of the next batch."""
+    ds.mutations_to_finalize.append(item)
+
+
+async def finalize_pending_mutations(ds: js.DataStructures) -> None:
+    if not ds.mutations_to_finalize:
+        return
+    items, ds.mutations_to_finalize = ds.mutations_to_finalize, []
+    try:
+        await js.finalize_mutations(items)
+    except Exception as e:
+        logger.error("Failed to finalize %s mutations with error: %s. Retrying...", len(items), e)
+        ds.mutations_to_finalize[:0] = items
+        return
+    for item in items:
+        js.transition(item, js.journal.DONE)
+        await js.resolve_item(item, ds)
+
+
 async def finalize_mutation(item: js.Item):
     """Mark mutations associated with a given `item` as "done" or "error"."""
-    args = item.args
+    await finalize_mutations([item])
+
+
+async def finalize_mutations(items: List[js.Item]) -> None:
+    """Mark mutations associated with `items` as "done" or "error", using set-based updates."""
+    keys = _get_mutation_keys(items)
+
     async with js.WDBConnection() as conn:
         async with conn.cursor() as cur:
-            for mutation in args["mutations"].split(","):
-                # Local pipelines may have underscore in mutation
-                if "_" in mutation:
-                    mutation = mutation.split("_")[-1]
-                await cur.execute(
-                    FINALIZE_MUTATION_SQL, {"protein_id": args["protein_id"], "mutation": mutation}
+            for start in range(0, len(keys), FINALIZE_BATCH_SIZE):
+                chunk = keys[start : start + FINALIZE_BATCH_SIZE]
+                mutations = " union all ".join(
+                    ["select %s as protein_id, %s as mutation"] * len(chunk)
                 )
+                params = [value for key in chunk for value in key]
+                for finalize_mutations_sql in FINALIZE_MUTATIONS_SQL:
+                    await cur.execute(finalize_mutations_sql.format(mutations=mutations), params)
         await conn.commit()
-    system_command = f'bash -c "rm -f "{config.DATA_DIR}/locks/*/*.lock""'
-    await asyncio.create_subprocess_exec(*shlex.split(system_command))
+    logger.debug("Finalized %s mutations for %s items.", len(keys), len(items))
 
 
-async def set_db_errors(error_queue):
-    async def helper(cur, item: js.Item):
-        job_id = item.args["job_id"]
-        protein_id = item.args["protein_id"]
-        mutation = item.args.get("mutations", "%")
-        if "_" in mutation:
-            mutation = mutation.split("_")[-1]
-        await cur.execute(SET_MUTATION_ERROR_SQL, (job_id, protein_id, mutation))
+async def check_mutations_calculated(item: js.Item) -> bool:
+    """Return `True` if ddG has been calculated for all mutations of `item`.
 
-    async with js.WDBConnection() as conn:
-        async with conn.cursor() as cur:
-            try:
-                if isinstance(error_queue, Queue):
-                    while not error_queue.empty():
-                        item = await error_queue.get()
-                        await helper(cur, item)
-                        logger.debug("set_db_errors for item %s", item)
-                else:
-                    for item in error_queue:
-                        await helper(cur, item)
-                        logger.debug("set_db_errors for item %s", item)
-                await conn.commit()
-            except Exception as e:
-                logger.error(
-                    "The following error occured while trying to send errors to the database: %s",
-                    e,
+    Mutations are "done" under the same conditions as in `finalize_mutations`.
+    """
+    keys = _get_mutation_keys([item])
+    mutations = " union all ".join(["select %s as protein_id, %s as mutation"] * len(keys))
+    try:
+        async with js.WDBConnection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    CHECK_MUTATIONS_CALCULATED_SQL.format(mutations=mutations),
+                    [value for key in keys for value in key],
                 )
+                (num_calculated,) = await cur.fetchone()
+    except Exception as e:
+        logger.error("Failed to check whether item %s was calculated with error: %s", item, e)
+        return False
+    return num_calculated == len(keys)
+
+
+def _get_mutation_keys(items: List[js.Item]) -> List[Tuple[str, str]]:
+    keys: List[Tuple[str, str]] = []
+    for item in items:
+        args = item.args
+        for mutation in args["mutations"].split(","):
+            # Local pipelines may have underscore in mutation
+            if "_" in mutation:
+                mutation = mutation.split("_")[-1]
+            keys.append((args["protein_id"], mutation))
+    return list(dict.fromkeys(keys))
+
+
+async def set_db_errors(error_queue):
+    if isinstance(error_queue, Queue):
+        items = [error_queue.get_nowait() for _ in range(error_queue.qsize())]
+    else:
+        items = list(error_queue)
+    if not items:
+        return
+
+    # Items are marked as failed even if their errors cannot be written to the database,
+    # so that they are not resumed from the journal
+    for item in items:
+        js.transition(item, js.journal.FAILED)
+
+    try:
+        async with js.WDBConnection() as conn:
+            async with conn.cursor() as cur:
+                for item in items:
+                    job_id = item.args["job_id"]
+                    protein_id = item.args["protein_id"]
+                    mutation = item.args.get("mutations", "%")
+                    if "_" in mutation:
+                        mutation = mutation.split("_")[-1]
+                    try:
+                        await cur.execute(SET_MUTATION_ERROR_SQL, (job_id, protein_id, mutation))
+                    except Exception as e:
+                        logger.error("Failed to set_db_errors for item %s with error: %s", item, e)
+                        continue
+                    logger.debug("set_db_errors for item %s", item)
+            await conn.commit()
+    except Exception as e:
+        logger.error(
+            "The following error occured while trying to send errors to the database: %s",
+            e,
+        )
 
 
 async def finalize_lingering_jobs(ds: js.DataStructures) -> None:
-    await js.set_db_errors(ds.pre_qsub_queue)
+    await js.locks.manager.release_all()
+    if js.journal.store is not None:
+        # Items are resumed from the journal on the next start (items whose scores could not be
+        # written to the database are still `EL2_RUNNING`, and their EL2 jobs have not been
+        # deleted, so their scores are collected again)
+        js.journal.store.close()
+        return
+
+    # Items which were released from `pre_qsub_queue` are also in one of the other queues
+    await js.set_db_errors(
+        [
+            item
+            for item in list(ds.pre_qsub_queue._queue)
+            if item.waiting_for_prereqs or item.waiting_for_lock
+        ]
+    )
     await js.set_db_errors(ds.qsub_queue)
     await js.set_db_errors(ds.validation_queue)
-    system_command = f'bash -c "rm -f "{config.DATA_DIR}/locks/*/*.lock""'
-    await asyncio.create_subprocess_exec(*shlex.split(system_command))
 
 
 FINALIZE_SUBMISSION_SQL = """\
@@ -118,42 +202,53 @@ AND muts.protein = %s
 AND muts.mut = %s
 """
 
-FINALIZE_MUTATION_SQL = """\
-LOCK TABLES muts AS web_muts WRITE,
-            elaspic_core_mutation AS ecm READ,
-            elaspic_core_mutation_local AS ecml READ,
-            elaspic_interface_mutation AS eim READ,
-            elaspic_interface_mutation_local eiml READ;
+CHECK_MUTATIONS_CALCULATED_SQL = """\
+SELECT COUNT(DISTINCT m.protein_id, m.mutation)
+FROM ({mutations}) m
+LEFT JOIN elaspic_core_mutation ecm ON (
+    m.protein_id = ecm.protein_id and m.mutation = ecm.mutation)
+LEFT JOIN elaspic_core_mutation_local ecml ON (
+    m.protein_id = ecml.protein_id and m.mutation = ecml.mutation)
+WHERE ecm.ddg IS NOT NULL OR ecml.ddg IS NOT NULL;
+"""
+
+#: Maximum number of mutations to finalize in a single statement
+FINALIZE_BATCH_SIZE = 500
 
+#: Statements which mark a batch of mutations as "done" or "error"
+#: (same logic as the `UPDATE_muts` procedure, without locking the `muts` table)
+FINALIZE_MUTATIONS_SQL = [
+    """\
 UPDATE muts web_muts
+JOIN ({mutations}) m ON (web_muts.protein = m.protein_id and web_muts.mut = m.mutation)
 LEFT JOIN elaspic_core_mutation ecm ON (
     web_muts.protein = ecm.protein_id and web_muts.mut = ecm.mutation)
 LEFT JOIN elaspic_core_mutation_local ecml ON (
     web_muts.protein = ecml.protein_id and web_muts.mut = ecml.mutation)
 SET web_muts.affectedType='CO', web_muts.status='error', web_muts.dateFinished = now(),
     web_muts.error='1: ddG not calculated'
-WHERE web_muts.protein = %(protein_id)s and web_muts.mut = %(mutation)s AND
-      ecm.ddg IS NULL AND ecml.ddg IS NULL;
-
+WHERE ecm.ddg IS NULL AND ecml.ddg IS NULL;
+""",
+    """\
 UPDATE muts web_muts
+JOIN ({mutations}) m ON (web_muts.protein = m.protein_id and web_muts.mut = m.mutation)
 LEFT JOIN elaspic_core_mutation ecm ON (
     web_muts.protein = ecm.protein_id and web_muts.mut = ecm.mutation)
 LEFT JOIN elaspic_core_mutation_local ecml ON (
     web_muts.protein = ecml.protein_id and web_muts.mut = ecml.mutation)
 SET web_muts.affectedType='CO', web_muts.status='done', web_muts.dateFinished = now(),
     web_muts.error=Null
-WHERE web_muts.protein = %(protein_id)s and web_muts.mut = %(mutation)s AND
-    (ecm.ddg IS NOT NULL OR ecml.ddg IS NOT NULL);
-
+WHERE ecm.ddg IS NOT NULL OR ecml.ddg IS NOT NULL;
+""",
+    """\
 UPDATE muts web_muts
+JOIN ({mutations}) m ON (web_muts.protein = m.protein_id and web_muts.mut = m.mutation)
 LEFT JOIN elaspic_interface_mutation eim ON (
     web_muts.protein = eim.protein_id and web_muts.mut = eim.mutation)
 LEFT JOIN elaspic_interface_mutation_local eiml ON (
     web_muts.protein = eiml.protein_id and web_muts.mut = eiml.mutation)
 SET web_muts.affectedType='IN', web_muts.status='done', web_muts.dateFinished = now(),
     web_muts.error=Null
-WHERE web_muts.protein = %(protein_id)s and web_muts.mut = %(mutation)s AND
-    (eim.ddg IS NOT NULL OR eiml.ddg IS NOT NULL);
-
-UNLOCK TABLES;
-"""
+WHERE eim.ddg IS NOT NULL OR eiml.ddg IS NOT NULL;
+""",
+]
@@ -0,0 +1,94 @@
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+from elaspic_rest_api import config
+from elaspic_rest_api import jobsubmitter as js
+
+#: ELASPIC2 states of mutation items (see `get_el2_state`)
+EL2_PENDING = "pending"
+EL2_RUNNING = "running"
+EL2_SCORED = "scored"
+
+
+def get_el2_state(item: "js.Item") -> Optional[str]:
+    """Return the state of the ELASPIC2 calculation for `item` (`None` if it has not started)."""
+    if item.el2_scored:
+        return EL2_SCORED
+    if item.state == js.journal.VALIDATED:
+        return EL2_PENDING
+    if item.state == js.journal.EL2_RUNNING:
+        return EL2_RUNNING
+    return None
+
+
+class JobIndex:
+    """Mutation items of each webserver job, indexed by `webserver_job_id` and `unique_id`.
+
+    The index holds the items that are being processed (see `attach_in_flight`), whose state
+    and stage are updated on every transition, so lookups always reflect the latest state
+    without scanning the queues. Jobs whose mutations have all finished are kept for
+    `JOB_INDEX_RETENTION` seconds.
+    """
+
+    def __init__(self) -> None:
+        self.jobs: Dict[str, Dict[str, "js.Item"]] = {}
+
+    def __contains__(self, job_id: object) -> bool:
+        return job_id in self.jobs
+
+    def __len__(self) -> int:
+        return len(self.jobs)
+
+    def add(self, job_id: str, item: "js.Item") -> None:
+        self.jobs.setdefault(job_id, {})[item.unique_id] = item
+
+    def get_job_status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the state of each mutation in job `job_id` (`None` if the job is not known)."""
+        items = self.jobs.get(job_id)
+        if items is None:
+            return None
+        mutations = [
+            {
+                **js.status.get_item_summary(item),
+                "protein_id": item.args["protein_id"],
+                "mutation": item.args["mutations"],
+                "el2_state": get_el2_state(item),
+                "el2_web_urls": sorted(
+                    {mi.el2_web_url for mi in item.el2_mutation_info_list if mi.el2_web_url}
+                ),
+            }
+            for item in items.values()
+        ]
+        counts: Dict[str, int] = {}
+        for mutation in mutations:
+            counts[str(mutation["state"])] = counts.get(str(mutation["state"]), 0) + 1
+        return {
+            "job_id": job_id,
+            "finished": self._is_finished(items),
+            "counts": counts,
+            "mutations": mutations,
+        }
+
+    def prune(self, retention: float) -> int:
+        """Remove jobs which finished more than `retention` seconds ago."""
+        cutoff = time.time() - retention
+        finished_jobs = [
+            job_id
+            for job_id, items in self.jobs.items()
+            if self._is_finished(items)
+            and max(item.stage_start_time for item in items.values()) < cutoff
+        ]
+        for job_id in finished_jobs:
+            del self.jobs[job_id]
+        return len(finished_jobs)
+
+    async def prune_loop(self) -> None:
+        while True:
+            self.prune(config.JOB_INDEX_RETENTION)
+            await asyncio.sleep(js.perf.SLEEP_FOR_INFO)
+
+    @staticmethod
+    def _is_finished(items: Dict[str, "js.Item"]) -> bool:
+        # Items move to their final stage (`None`) when they reach a terminal state
+        return all(item.state in js.journal.TERMINAL_STATES for item in items.values())
@@ -1,28 +1,44 @@
 import asyncio
 import logging
+import time
 from concurrent.futures import ThreadPoolExecutor
 from functools import partial
-from typing import Dict, List, Set, Tuple
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List, Optional, Set, Tuple
 
+from elaspic_rest_api import config
 from elaspic_rest_api import jobsubmitter as js
-from elaspic_rest_api.types import DataIn
+from elaspic_rest_api.types import DataIn, Mutations
 
 logger = logging.getLogger(__name__)
 executor = ThreadPoolExecutor()
 
+#: Added to the `monitored_jobs` entry of a job while its mutations are being streamed
+STREAM_PLACEHOLDER = "<streaming>"
+
 
 async def start_jobsubmitter(ds: js.DataStructures) -> Dict[str, asyncio.Task]:
+    await js.replay_journal(ds)
+
     task_fns = {
-        "update_precalculated": partial(js.update_precalculated, ds.precalculated),
+        "update_precalculated": partial(js.update_precalculated_loop, ds),
         "persist_precalculated": partial(
             js.persist_precalculated, ds.precalculated, ds.precalculated_cache
         ),
         "pre_qsub": partial(js.pre_qsub, ds),
-        "qsub": partial(js.qsub, ds),
+        **{
+            f"qsub_{i}": partial(js.qsub_array if config.QSUB_ARRAY_MAX_SIZE > 1 else js.qsub, ds)
+            for i in range(config.QSUB_CONCURRENCY)
+        },
         "qstat": js.qstat,
         "validation": partial(js.validation, ds),
         "el2_submit": partial(js.elaspic2_submit_loop, ds),
         "el2_collect": partial(js.elaspic2_collect_loop, ds),
+        "el2_flush": partial(js.elaspic2_flush_loop, ds),
+        "el2_cleanup": js.elaspic2client.client.cleanup_loop,
+        "lock_sweep": js.locks.manager.sweep_loop,
+        "journal_compact": js.compact_journal_loop,
+        "job_index_prune": ds.job_index.prune_loop,
+        "finalize_mutations": partial(js.finalize_mutations_loop, ds),
         "finalize_finished_submissions": partial(
             js.finalize_finished_submissions_loop, ds.monitored_jobs
         ),
@@ -39,7 +55,11 @@ async def start_jobsubmitter(ds: js.DataStructures) -> Dict[str, asyncio.Task]:
     except asyncio.CancelledError:
         for task in tasks.values():
             task.cancel()
-        await asyncio.gather(*list(tasks.values()))
+        await asyncio.gather(*list(tasks.values()), return_exceptions=True)
+        await js.flush_mutation_scores(ds)
+        await js.finalize_pending_mutations(ds)
+        await js.ssh.pool.close()
+        await js.elaspic2client.client.close()
 
 
 async def submit_job(data_in: DataIn, ds: js.DataStructures):
@@ -61,27 +81,41 @@ async def submit_job(data_in: DataIn, ds: js.DataStructures):
                 Comma-separated list of uniprot_domain_pair_id interfaces to analyse.
     """
     logger.debug("")
+    parse_start_time = time.time()
     items_list = parse_input_data(data_in)
+    parse_end_time = time.time()
     for items in items_list:
         s, m, muts = items
 
         have_prereqs = True
-        # Add sequence job
-        if not js.check_prereqs([s.unique_id], ds.precalculated, ds.precalculated_cache):
-            await ds.qsub_queue.put(s)
-            have_prereqs = False
-        # Add model job
-        if not js.check_prereqs([m.unique_id], ds.precalculated, ds.precalculated_cache):
-            await ds.qsub_queue.put(m)
-            have_prereqs = False
+        await js.lookup_precalculated([s.unique_id, m.unique_id], ds)
+        # Add sequence and model jobs
+        # (items which are already being calculated are not submitted again)
+        for prereq_item in [s, m]:
+            if not js.check_prereqs(
+                [prereq_item.unique_id], ds.precalculated, ds.precalculated_cache
+            ):
+                have_prereqs = False
+                if not js.attach_in_flight(prereq_item, ds):
+                    js.tracing.start_item_trace(prereq_item, parse_start_time, parse_end_time)
+                    ds.failed_prereqs.discard(prereq_item.unique_id)
+                    js.transition(prereq_item, js.journal.QUEUED)
+                    await ds.qsub_queue.put(prereq_item)
         # Add mutation jobs
         job_mutations = set()
         for mut in muts:
+            job_mutations.add(mut.unique_id)
+            attached = js.attach_in_flight(mut, ds)
+            if job_id := mut.args.get("webserver_job_id"):
+                ds.job_index.add(job_id, ds.in_flight[mut.unique_id])
+            if attached:
+                continue
+            js.tracing.start_item_trace(mut, parse_start_time, parse_end_time)
+            js.transition(mut, js.journal.QUEUED)
             if have_prereqs:
                 await ds.qsub_queue.put(mut)
             else:
-                await ds.pre_qsub_queue.put(mut)
-            job_mutations.add(mut.unique_id)
+                await js.wait_for_prereqs(mut, ds)
         # ELASPIC 2
         # TODO: WIP
         # Monitoring to send the final email
@@ -90,6 +124,107 @@ async def submit_job(data_in: DataIn, ds: js.DataStructures):
             ds.monitored_jobs.setdefault(job_key, set()).update(job_mutations)
 
 
+async def submit_job_stream(
+    chunks: AsyncIterable[bytes], data_in: DataIn, ds: js.DataStructures
+) -> Dict[str, Any]:
+    """Submit mutations read from an NDJSON stream, with one `Mutations` object per line.
+
+    Lines are validated and submitted in batches of `STREAM_BATCH_SIZE`, so that only one batch
+    is kept in memory. Lines that cannot be parsed are skipped and reported in the result.
+    Each batch is checked against the admission limits of `data_in.api_token`, and the stream
+    stops at the first batch which is rejected. In that case, the result contains the
+    `AdmissionRejected` error under `rejected` and the first line that was not submitted
+    under `resume_line`.
+
+    Parameters
+    ----------
+    chunks
+        Chunks of the NDJSON request body.
+    data_in
+        Job attributes (`job_id`, `job_type`, ...) shared by all mutations.
+    """
+    job_key = js.JobKey(data_in.job_id, data_in.job_email)
+    # Keep the job from being finalized while mutations are still being received
+    ds.monitored_jobs.setdefault(job_key, set()).add(STREAM_PLACEHOLDER)
+    num_mutations = 0
+    # Only the first `STREAM_MAX_ERRORS` errors are kept, so that memory use stays bounded
+    num_errors = 0
+    errors: List[Tuple[int, str]] = []
+    batch: List[Mutations] = []
+    batch_start_line = 0
+    rejected: Optional[js.AdmissionRejected] = None
+
+    def add_error(line_number: int, message: str) -> None:
+        nonlocal num_errors
+        num_errors += 1
+        if len(errors) < config.STREAM_MAX_ERRORS:
+            errors.append((line_number, message))
+
+    async def submit_batch() -> None:
+        nonlocal batch, num_mutations
+        batch_in = data_in.copy(update={"mutations": batch})
+        num_items = js.admission.controller.admit(data_in.api_token, batch_in, ds)
+        try:
+            await submit_job(batch_in, ds)
+        except Exception as e:
+            add_error(line_number, f"Failed to submit {len(batch)} lines: {e}")
+        else:
+            num_mutations += len(batch)
+        finally:
+            js.admission.controller.release(data_in.api_token, num_items)
+        batch = []
+
+    try:
+        line_number = 0
+        async for line in _iter_lines(chunks, config.STREAM_MAX_LINE_LENGTH):
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                mutations = Mutations.parse_raw(line)
+            except ValueError as e:
+                add_error(line_number, str(e))
+                continue
+            if not batch:
+                batch_start_line = line_number
+            batch.append(mutations)
+            if len(batch) >= config.STREAM_BATCH_SIZE:
+                await submit_batch()
+        if batch:
+            await submit_batch()
+    except js.AdmissionRejected as e:
+        rejected = e
+    except ValueError as e:
+        add_error(line_number + 1, str(e))
+    finally:
+        ds.monitored_jobs[job_key].discard(STREAM_PLACEHOLDER)
+        # Jobs without any mutations are not finalized (and no "job complete" email is sent)
+        if not num_mutations and not ds.monitored_jobs[job_key]:
+            del ds.monitored_jobs[job_key]
+
+    return {
+        "job_id": data_in.job_id,
+        "num_mutations": num_mutations,
+        "num_errors": num_errors,
+        "errors": errors,
+        "rejected": rejected,
+        "resume_line": batch_start_line if rejected is not None else None,
+    }
+
+
+async def _iter_lines(chunks: AsyncIterable[bytes], max_line_length: int) -> AsyncIterator[bytes]:
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+        if len(buffer) > max_line_length:
+            raise ValueError(f"Line is longer than {max_line_length} bytes.")
+    if buffer:
+        yield buffer
+
+
 def parse_input_data(data_in: DataIn) -> List[Tuple[js.Item, js.Item, Set[js.Item]]]:
     items_list = []
     for data in data_in.mutations:
@@ -0,0 +1,264 @@
+import asyncio
+import json
+import logging
+import os
+import os.path as op
+import sqlite3
+import time
+from typing import List, NamedTuple, Optional
+
+from elaspic_rest_api import config
+from elaspic_rest_api import jobsubmitter as js
+from elaspic_rest_api.jobsubmitter.elaspic2types import COI, MutationInfo
+
+logger = logging.getLogger(__name__)
+
+#: Item is waiting to be submitted to SLURM (possibly after its prereqs)
+QUEUED = "queued"
+#: Item has been submitted to SLURM and is waiting to be validated
+SUBMITTED = "submitted"
+#: Mutation item has finished running on SLURM and is waiting to be submitted to ELASPIC2
+VALIDATED = "validated"
+#: Mutation item is waiting for the results of its ELASPIC2 jobs
+EL2_RUNNING = "el2_running"
+DONE = "done"
+FAILED = "failed"
+
+TERMINAL_STATES = (DONE, FAILED)
+
+
+class JournalEntry(NamedTuple):
+    item: js.Item
+    state: str
+
+
+class Journal:
+    """Append-only record of item state transitions, stored in a local SQLite database.
+
+    Each call to `record` appends a row with the complete state of the item, so that items which
+    were still being processed when the jobsubmitter stopped can be restored by `replay_journal`.
+    The database uses WAL mode without syncing each commit, which keeps appends cheap enough
+    to be performed directly on the event loop.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def record(self, item: js.Item, state: str) -> None:
+        el2_mutation_info_list = [
+            {**mi._asdict(), "coi": mi.coi.value} for mi in item.el2_mutation_info_list
+        ]
+        self._get_conn().execute(
+            INSERT_TRANSITION_SQL,
+            (
+                time.time(),
+                item.item_id,
+                item.unique_id,
+                item.run_type,
+                state,
+                json.dumps(item.args),
+                item.job_id,
+                item.array_task_id,
+                item.qsub_tries,
+                json.dumps(el2_mutation_info_list),
+                json.dumps(sorted(item.job_keys, key=str)),
+            ),
+        )
+
+    def load(self) -> List[JournalEntry]:
+        """Return items whose most recent state is not terminal, in the order they were added."""
+        rows = self._get_conn().execute(SELECT_ACTIVE_SQL, TERMINAL_STATES).fetchall()
+        entries = []
+        for row in rows:
+            (
+                item_id,
+                run_type,
+                state,
+                args,
+                job_id,
+                array_task_id,
+                qsub_tries,
+                mi_list,
+                job_keys,
+            ) = row
+            item = js.Item(run_type, json.loads(args))
+            item.item_id = item_id
+            item.state = state
+            item.qsub_tries = qsub_tries
+            if job_id is not None:
+                item.set_job_id(job_id, array_task_id)
+            item.el2_mutation_info_list = [
+                MutationInfo(**{**mi, "coi": COI(mi["coi"])}) for mi in json.loads(mi_list)
+            ]
+            item.job_keys |= {js.JobKey(*job_key) for job_key in json.loads(job_keys)}
+            entries.append(JournalEntry(item, state))
+        return entries
+
+    def compact(self) -> None:
+        """Remove rows which have been superseded by a later transition or are terminal.
+
+        Compaction uses a separate connection, so that it can run in a worker thread
+        while transitions are being recorded on the event loop.
+        """
+        self._get_conn()
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        try:
+            conn.execute(COMPACT_SQL, TERMINAL_STATES)
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+        finally:
+            conn.close()
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(op.dirname(op.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL;")
+            self._conn.execute("PRAGMA synchronous=NORMAL;")
+            self._conn.execute(CREATE_TRANSITIONS_TABLE_SQL)
+            # Journals created before jobs could subscribe to items have no `job_keys` column
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(transitions);")}
+            if "job_keys" not in columns:
+                self._conn.execute(ADD_JOB_KEYS_COLUMN_SQL)
+            self._conn.execute(CREATE_TRANSITIONS_INDEX_SQL)
+        return self._conn
+
+
+def transition(item: js.Item, state: str) -> None:
+    """Set the state of `item`, recording the transition in the journal."""
+    item.state = state
+    if state in TERMINAL_STATES:
+        js.metrics.enter_stage(item, None)
+    if store is None:
+        return
+    try:
+        store.record(item, state)
+    except Exception as e:
+        logger.error("Failed to record transition of %s to '%s': %s", item.unique_id, state, e)
+
+
+async def compact_journal_loop() -> None:
+    """Compact the journal periodically, so that it does not grow while the jobsubmitter runs."""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(js.perf.SLEEP_FOR_JOURNAL_COMPACT)
+        if store is None:
+            continue
+        try:
+            await loop.run_in_executor(None, store.compact)
+        except Exception as e:
+            logger.error("Failed to compact the journal with error: %s.", e)
+
+
+async def replay_journal(ds: js.DataStructures) -> None:
+    """Restore items which were still being processed when the jobsubmitter last stopped.
+
+    Items which were submitted to SLURM are added back to `validation_queue`, which checks them
+    against `squeue` and the finished lock directories (falling back to the log files for jobs
+    which are no longer running), so that they are not calculated again.
+    """
+    if store is None:
+        return
+    loop = asyncio.get_running_loop()
+    entries = await loop.run_in_executor(None, store.load)
+    await loop.run_in_executor(None, store.compact)
+    if not entries:
+        return
+    logger.info("Replaying %s items from the journal.", len(entries))
+
+    # Prereqs come first, so that mutations can tell whether they are already being calculated
+    entries.sort(key=lambda entry: entry.item.run_type == "mutations")
+    active = {entry.item.unique_id for entry in entries if entry.item.run_type != "mutations"}
+    for item, state in entries:
+        js.add_in_flight(item, ds)
+        if state == QUEUED and item.run_type == "mutations":
+            await js.lookup_precalculated(item.prereqs, ds)
+            for prereq_item in [js.Item("sequence", item.args), js.Item("model", item.args)]:
+                if prereq_item.unique_id not in active and not js.check_prereqs(
+                    [prereq_item.unique_id], ds.precalculated, ds.precalculated_cache
+                ):
+                    active.add(prereq_item.unique_id)
+                    js.add_in_flight(prereq_item, ds)
+                    transition(prereq_item, QUEUED)
+                    await ds.qsub_queue.put(prereq_item)
+            await js.wait_for_prereqs(item, ds)
+        elif state == QUEUED:
+            await ds.qsub_queue.put(item)
+        elif state == SUBMITTED:
+            # Leases are released on shutdown, and leases left behind by a crash are taken over
+            if not await js.locks.manager.acquire(item.unique_id, item.item_id):
+                logger.warning("Lock for replayed item %s is held elsewhere.", item.unique_id)
+            await ds.validation_queue.put(item)
+            if item.run_type in ["sequence", "model"]:
+                ds.prereq_job_ids[item.unique_id] = item.slurm_job_id
+        elif state == VALIDATED:
+            await ds.elaspic2_pending_queue.put(item)
+        elif state == EL2_RUNNING:
+            js.elaspic2client.client.acquire(mi.el2_web_url for mi in item.el2_mutation_info_list)
+            await ds.elaspic2_running_queue.put(item)
+        else:
+            logger.error("Skipping item %s with unknown state '%s'.", item.unique_id, state)
+            continue
+
+        if item.run_type == "mutations":
+            for job_key in item.job_keys:
+                ds.monitored_jobs.setdefault(job_key, set()).add(item.unique_id)
+                ds.job_index.add(job_key.job_id, item)
+
+
+CREATE_TRANSITIONS_TABLE_SQL = """\
+CREATE TABLE IF NOT EXISTS transitions (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    time REAL NOT NULL,
+    item_id TEXT NOT NULL,
+    unique_id TEXT NOT NULL,
+    run_type TEXT NOT NULL,
+    state TEXT NOT NULL,
+    args TEXT NOT NULL,
+    job_id INTEGER,
+    array_task_id INTEGER,
+    qsub_tries INTEGER NOT NULL,
+    el2_mutation_info_list TEXT NOT NULL,
+    job_keys TEXT NOT NULL DEFAULT '[]'
+);
+"""
+
+CREATE_TRANSITIONS_INDEX_SQL = """\
+CREATE INDEX IF NOT EXISTS transitions_item_id ON transitions (item_id, seq);
+"""
+
+ADD_JOB_KEYS_COLUMN_SQL = """\
+ALTER TABLE transitions ADD COLUMN job_keys TEXT NOT NULL DEFAULT '[]';
+"""
+
+INSERT_TRANSITION_SQL = """\
+INSERT INTO transitions (
+    time, item_id, unique_id, run_type, state, args,
+    job_id, array_task_id, qsub_tries, el2_mutation_info_list, job_keys
+)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+"""
+
+SELECT_ACTIVE_SQL = """\
+SELECT
+    item_id, run_type, state, args,
+    job_id, array_task_id, qsub_tries, el2_mutation_info_list, job_keys
+FROM transitions
+WHERE seq IN (SELECT max(seq) FROM transitions GROUP BY item_id)
+AND state NOT IN (?, ?)
+ORDER BY seq;
+"""
+
+COMPACT_SQL = """\
+DELETE FROM transitions
+WHERE seq NOT IN (SELECT max(seq) FROM transitions GROUP BY item_id)
+OR state IN (?, ?);
+"""
+
+#: Journal shared by all tasks (`None` if the journal is disabled)
+store = Journal(config.JOURNAL_PATH) if config.JOURNAL_PATH else None
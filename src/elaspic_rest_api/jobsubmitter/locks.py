@@ -0,0 +1,247 @@
+import abc
+import asyncio
+import hashlib
+import logging
+import os
+import os.path as op
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from elaspic_rest_api import config
+from elaspic_rest_api.jobsubmitter import perf
+from elaspic_rest_api.jobsubmitter.db import WDBConnection
+
+logger = logging.getLogger(__name__)
+
+
+class LockManager(abc.ABC):
+    """Leases which make sure that each job is only submitted once.
+
+    Locks are keyed by the `unique_id` of each item and expire after `lease_timeout` seconds,
+    so that locks left behind by jobs which were lost (e.g. because the jobsubmitter crashed)
+    are eventually reclaimed by `sweep`.
+    """
+
+    def __init__(self, lease_timeout: float) -> None:
+        self.lease_timeout = lease_timeout
+        #: Locks held by this process, and the owner token of each lock
+        self.held: Dict[str, str] = {}
+
+    async def acquire(self, key: str, token: Optional[str] = None) -> bool:
+        """Acquire the lock for `key`, returning `False` if it is held by someone else.
+
+        A lock which is already held under `token` (e.g. by this item before the jobsubmitter
+        was restarted) is taken over and its lease is renewed.
+        """
+        token = token or uuid.uuid4().hex
+        if not await self._acquire(key, token):
+            return False
+        self.held[key] = token
+        return True
+
+    async def release(self, key: str) -> None:
+        await self.release_many([key])
+
+    async def release_many(self, keys: Iterable[str]) -> None:
+        """Release locks for `keys` (locks which are not held by this process are ignored)."""
+        locks = [(key, self.held.pop(key)) for key in set(keys) if key in self.held]
+        if locks:
+            await self._release(locks)
+
+    async def release_all(self) -> None:
+        await self.release_many(list(self.held))
+
+    @abc.abstractmethod
+    async def sweep(self) -> int:
+        """Remove expired locks, returning the number of locks that were removed."""
+
+    async def sweep_loop(self) -> None:
+        while True:
+            try:
+                num_expired = await self.sweep()
+                if num_expired:
+                    logger.warning("Removed %s expired locks.", num_expired)
+            except Exception as e:
+                logger.error("Failed to remove expired locks with error: %s.", e)
+            await asyncio.sleep(perf.SLEEP_FOR_LOCK_SWEEP)
+
+    @abc.abstractmethod
+    async def _acquire(self, key: str, token: str) -> bool:
+        """Create or take over the lock for `key`, returning `True` if it is owned by `token`."""
+
+    @abc.abstractmethod
+    async def _release(self, locks: List[Tuple[str, str]]) -> None:
+        """Remove locks given as `(key, token)` tuples, if they are still owned by `token`."""
+
+
+class FileLockManager(LockManager):
+    """Locks stored as files in a sharded directory tree.
+
+    Each lock file is placed in one of 65536 subdirectories, based on a hash of its key,
+    so that the number of files in each directory stays small.
+    """
+
+    def __init__(self, lock_dir: str, lease_timeout: float) -> None:
+        super().__init__(lease_timeout)
+        self.lock_dir = lock_dir
+
+    def get_lock_path(self, key: str) -> str:
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return op.join(self.lock_dir, digest[:2], digest[2:4], f"{key}.lock")
+
+    async def sweep(self) -> int:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._sweep)
+
+    async def _acquire(self, key: str, token: str) -> bool:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._acquire_sync, self.get_lock_path(key), token)
+
+    async def _release(self, locks: List[Tuple[str, str]]) -> None:
+        loop = asyncio.get_running_loop()
+        locks = [(self.get_lock_path(key), token) for key, token in locks]
+        await loop.run_in_executor(None, self._release_sync, locks)
+
+    def _acquire_sync(self, lock_path: str, token: str) -> bool:
+        os.makedirs(op.dirname(lock_path), exist_ok=True)
+        for _ in range(2):
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if self._read_owner(lock_path) == token:
+                    os.utime(lock_path)
+                    return True
+                if not self._is_expired(lock_path):
+                    return False
+                logger.warning("Reclaiming expired lock '%s'.", lock_path)
+                self._remove_files([lock_path])
+                continue
+            with os.fdopen(fd, "w") as fout:
+                fout.write(token)
+            return True
+        return False
+
+    def _release_sync(self, locks: List[Tuple[str, str]]) -> None:
+        # Locks which expired and were reclaimed by someone else are left alone
+        self._remove_files(
+            [lock_path for lock_path, token in locks if self._read_owner(lock_path) == token]
+        )
+
+    def _read_owner(self, lock_path: str) -> Optional[str]:
+        try:
+            with open(lock_path) as fin:
+                return fin.read()
+        except FileNotFoundError:
+            return None
+
+    def _is_expired(self, lock_path: str) -> bool:
+        try:
+            return os.stat(lock_path).st_mtime < time.time() - self.lease_timeout
+        except FileNotFoundError:
+            return True
+
+    def _remove_files(self, lock_paths: List[str]) -> None:
+        for lock_path in lock_paths:
+            try:
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+
+    def _sweep(self) -> int:
+        expired_lock_paths = []
+        for dirpath, _, filenames in os.walk(self.lock_dir):
+            for filename in filenames:
+                lock_path = op.join(dirpath, filename)
+                if filename.endswith(".lock") and self._is_expired(lock_path):
+                    expired_lock_paths.append(lock_path)
+        self._remove_files(expired_lock_paths)
+        return len(expired_lock_paths)
+
+
+class DBLockManager(LockManager):
+    """Locks stored as rows in the webserver database, with an expiry time for each lease."""
+
+    def __init__(self, lease_timeout: float) -> None:
+        super().__init__(lease_timeout)
+        self._table_created = False
+
+    async def sweep(self) -> int:
+        async with WDBConnection() as conn:
+            async with conn.cursor() as cur:
+                await self._create_table(cur)
+                await cur.execute(SWEEP_LOCKS_SQL)
+                num_expired = cur.rowcount
+            await conn.commit()
+        return num_expired
+
+    async def _acquire(self, key: str, token: str) -> bool:
+        async with WDBConnection() as conn:
+            async with conn.cursor() as cur:
+                await self._create_table(cur)
+                await cur.execute(
+                    ACQUIRE_LOCK_SQL,
+                    {"lock_key": key, "owner": token, "lease_timeout": int(self.lease_timeout)},
+                )
+                await cur.execute(GET_LOCK_OWNER_SQL, (key,))
+                row = await cur.fetchone()
+            await conn.commit()
+        return row is not None and row[0] == token
+
+    async def _release(self, locks: List[Tuple[str, str]]) -> None:
+        values = ", ".join(["(%s, %s)"] * len(locks))
+        params = [value for lock in locks for value in lock]
+        async with WDBConnection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(RELEASE_LOCKS_SQL.format(values=values), params)
+            await conn.commit()
+
+    async def _create_table(self, cur) -> None:
+        if not self._table_created:
+            await cur.execute(CREATE_LOCKS_TABLE_SQL)
+            self._table_created = True
+
+
+def create_lock_manager() -> LockManager:
+    if config.LOCK_BACKEND == "file":
+        return FileLockManager(config.LOCK_LEASE_DIR, config.LOCK_LEASE_TIMEOUT)
+    elif config.LOCK_BACKEND == "db":
+        return DBLockManager(config.LOCK_LEASE_TIMEOUT)
+    else:
+        raise ValueError(f"Unsupported lock backend: {config.LOCK_BACKEND}.")
+
+
+CREATE_LOCKS_TABLE_SQL = """\
+CREATE TABLE IF NOT EXISTS jobsubmitter_locks (
+    lock_key VARCHAR(255) NOT NULL,
+    owner CHAR(32) NOT NULL,
+    expires_at DATETIME NOT NULL,
+    PRIMARY KEY (lock_key),
+    KEY (expires_at)
+);
+"""
+
+# Expired leases are taken over by the new owner, and leases of the same owner are renewed
+# (`owner` is updated first, so the second condition holds once the lease has been taken over)
+ACQUIRE_LOCK_SQL = """\
+INSERT INTO jobsubmitter_locks (lock_key, owner, expires_at)
+VALUES (%(lock_key)s, %(owner)s, now() + INTERVAL %(lease_timeout)s SECOND)
+ON DUPLICATE KEY UPDATE
+    owner = IF(expires_at < now(), VALUES(owner), owner),
+    expires_at = IF(owner = VALUES(owner), VALUES(expires_at), expires_at);
+"""
+
+GET_LOCK_OWNER_SQL = """\
+SELECT owner FROM jobsubmitter_locks WHERE lock_key = %s;
+"""
+
+RELEASE_LOCKS_SQL = """\
+DELETE FROM jobsubmitter_locks WHERE (lock_key, owner) IN ({values});
+"""
+
+SWEEP_LOCKS_SQL = """\
+DELETE FROM jobsubmitter_locks WHERE expires_at < now();
+"""
+
+#: Locks for all jobs submitted by the jobsubmitter
+manager = create_lock_manager()
@@ -0,0 +1,310 @@
+import time
+from asyncio import Queue
+from bisect import bisect_left
+from collections import deque
+from itertools import islice
+from typing import Any, Deque, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from elaspic_rest_api import jobsubmitter as js
+
+#: Upper bounds (in seconds) of the buckets used for SSH, ELASPIC2 and database calls
+COMMAND_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+#: Upper bounds (in seconds) of the buckets used for the time that items spend in each stage
+STAGE_LATENCY_BUCKETS = (1, 10, 60, 5 * 60, 15 * 60, 60 * 60, 4 * 3600, 12 * 3600, 24 * 3600)
+
+#: Stages that an item goes through, in order
+PRE_QSUB = "pre_qsub"
+QSUB = "qsub"
+VALIDATION = "validation"
+EL2 = "el2"
+FINALIZE = "finalize"
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets, in the format used by Prometheus."""
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = tuple(buckets)
+        #: Number of observations in each bucket, with the last bucket for values > `buckets[-1]`
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self) -> List[Tuple[str, int]]:
+        """Return `(le, count)` pairs for each bucket, including the "+Inf" bucket."""
+        result = []
+        total = 0
+        for bound, count in zip([*self.buckets, "+Inf"], self.counts):
+            total += count
+            result.append((str(bound), total))
+        return result
+
+
+#: Time that items spent in each stage before moving on to the next stage
+stage_latency: Dict[str, Histogram] = {}
+#: Number of times that each jobsubmitter task was restarted after failing with an error
+task_restarts: Dict[str, int] = {}
+
+
+def enter_stage(item: "js.Item", stage: Optional[str]) -> None:
+    """Move `item` to `stage`, recording the time that it spent in its previous stage.
+
+    `stage` is `None` for items which have finished.
+    """
+    now = time.time()
+    if item.stage is not None:
+        histogram = stage_latency.setdefault(item.stage, Histogram(STAGE_LATENCY_BUCKETS))
+        histogram.observe(now - item.stage_start_time)
+    js.tracing.set_stage_span(item, stage, now)
+    item.stage = stage
+    item.stage_start_time = now
+
+
+class StageQueue(Queue):
+    """Queue which moves the items put into it to `stage` and keeps track of their age.
+
+    Each item put into the queue is assigned a sequence number (`num_put` at the time), which
+    can be used as a cursor that remains valid while items are removed from the queue.
+    """
+
+    def __init__(self, stage: str, maxsize: int = 0) -> None:
+        self.stage = stage
+        #: Total number of items put into and removed from the queue
+        self.num_put = 0
+        self.num_get = 0
+        super().__init__(maxsize)
+
+    @property
+    def oldest_put_time(self) -> Optional[float]:
+        """Time when the item at the front of the queue was put into the queue."""
+        return self._put_info[0][1] if self._put_info else None
+
+    @property
+    def oldest_age(self) -> float:
+        """Time since the item at the front of the queue was put into the queue."""
+        return time.time() - self._put_info[0][1] if self._put_info else 0.0
+
+    def get_page(self, cursor: int, limit: int) -> List[Tuple[int, Any]]:
+        """Return up to `limit` `(sequence number, item)` pairs for items put after `cursor`."""
+        # Sequence numbers are consecutive, so the position of `cursor` can be computed directly
+        start = 0
+        if self._put_info:
+            start = min(max(0, cursor - self._put_info[0][0] + 1), len(self._put_info))
+        return [
+            (put_info[0], item)
+            for put_info, item in zip(
+                islice(self._put_info, start, start + limit),
+                islice(self._queue, start, start + limit),  # type: ignore
+            )
+        ]
+
+    def _init(self, maxsize: int) -> None:
+        super()._init(maxsize)  # type: ignore
+        #: Sequence number and time when each item in the queue was added
+        self._put_info: Deque[Tuple[int, float]] = deque()
+
+    def _put(self, item) -> None:
+        if item.stage != self.stage:
+            enter_stage(item, self.stage)
+        self.num_put += 1
+        self._put_info.append((self.num_put, time.time()))
+        super()._put(item)  # type: ignore
+
+    def _get(self):
+        self.num_get += 1
+        self._put_info.popleft()
+        return super()._get()  # type: ignore
+
+
+def render_metrics(ds: "js.DataStructures") -> str:
+    """Return jobsubmitter metrics in the Prometheus text exposition format."""
+    lines: List[str] = []
+
+    def add_metric(
+        name: str,
+        metric_type: str,
+        description: str,
+        samples: Iterable[Tuple[Dict[str, str], float]],
+    ) -> None:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    def add_histogram(
+        name: str, description: str, histograms: Dict[Tuple[str, str], Histogram]
+    ) -> None:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} histogram")
+        for (label, value), histogram in sorted(histograms.items()):
+            for le, count in histogram.cumulative_counts():
+                lines.append(f"{name}_bucket{_format_labels({label: value, 'le': le})} {count}")
+            lines.append(f"{name}_sum{_format_labels({label: value})} {histogram.sum}")
+            lines.append(f"{name}_count{_format_labels({label: value})} {histogram.count}")
+
+    queues = js.status.get_queues(ds)
+    add_metric(
+        "elaspic_queue_size",
+        "gauge",
+        "Number of items in each queue.",
+        [({"queue": name}, queue.qsize()) for name, queue in queues.items()],
+    )
+    add_metric(
+        "elaspic_queue_oldest_age_seconds",
+        "gauge",
+        "Time since the item at the front of each queue was put into the queue.",
+        [({"queue": name}, queue.oldest_age) for name, queue in queues.items()],
+    )
+    add_metric(
+        "elaspic_items",
+        "gauge",
+        "Number of items in other data structures.",
+        [
+            ({"kind": "in_flight"}, len(ds.in_flight)),
+            ({"kind": "waiting_for_prereqs"}, ds.num_waiting_for_prereqs),
+            ({"kind": "el2_score_buffer"}, len(ds.elaspic2_score_buffer)),
+            ({"kind": "to_finalize"}, len(ds.mutations_to_finalize)),
+            ({"kind": "precalculated"}, len(ds.precalculated)),
+            ({"kind": "indexed_jobs"}, len(ds.job_index)),
+        ],
+    )
+    add_metric(
+        "elaspic_monitored_jobs",
+        "gauge",
+        "Number of monitored jobs.",
+        [({}, len(ds.monitored_jobs))],
+    )
+    add_metric(
+        "elaspic_slurm_jobs",
+        "gauge",
+        "Number of jobs in the output of the last squeue.",
+        [({}, len(js.monitor.running_jobs))],
+    )
+    add_histogram(
+        "elaspic_stage_latency_seconds",
+        "Time that items spent in each stage.",
+        {("stage", stage): histogram for stage, histogram in stage_latency.items()},
+    )
+
+    ssh_stats = js.ssh.pool.stats
+    add_histogram(
+        "elaspic_ssh_command_latency_seconds",
+        "Latency of commands run on the SLURM master node.",
+        {("command", name): stats.latency for name, stats in ssh_stats.items()},
+    )
+    add_metric(
+        "elaspic_ssh_command_failures_total",
+        "counter",
+        "Number of commands run on the SLURM master node that failed.",
+        [({"command": name}, stats.failures) for name, stats in sorted(ssh_stats.items())],
+    )
+
+    el2_client = js.elaspic2client.client
+    add_histogram(
+        "elaspic_el2_request_latency_seconds",
+        "Latency of requests to the ELASPIC2 server.",
+        {("method", method): stats.latency for method, stats in el2_client.stats.items()},
+    )
+    add_metric(
+        "elaspic_el2_request_failures_total",
+        "counter",
+        "Number of requests to the ELASPIC2 server that failed.",
+        [
+            ({"method": method}, stats.failures)
+            for method, stats in sorted(el2_client.stats.items())
+        ],
+    )
+    add_metric(
+        "elaspic_el2_jobs",
+        "gauge",
+        "Number of ELASPIC2 jobs tracked by the client.",
+        [
+            ({"kind": "active"}, len(el2_client.jobs)),
+            ({"kind": "pending_delete"}, el2_client.num_pending_deletes),
+        ],
+    )
+
+    db_stats = sorted(js.db.pool_stats.items())
+    add_metric(
+        "elaspic_db_pool_acquire_total",
+        "counter",
+        "Number of connections acquired from each database pool.",
+        [({"db": db_name}, stats.acquire_count) for db_name, stats in db_stats],
+    )
+    add_metric(
+        "elaspic_db_pool_acquire_seconds_total",
+        "counter",
+        "Total time spent waiting for connections from each database pool.",
+        [({"db": db_name}, stats.acquire_time) for db_name, stats in db_stats],
+    )
+    add_metric(
+        "elaspic_db_pool_in_use",
+        "gauge",
+        "Number of connections currently acquired from each database pool.",
+        [({"db": db_name}, stats.in_use) for db_name, stats in db_stats],
+    )
+    add_histogram(
+        "elaspic_db_query_latency_seconds",
+        "Latency of database statements.",
+        {("db", db_name): stats.queries.latency for db_name, stats in db_stats},
+    )
+    add_metric(
+        "elaspic_db_query_failures_total",
+        "counter",
+        "Number of database statements that failed.",
+        [({"db": db_name}, stats.queries.failures) for db_name, stats in db_stats],
+    )
+
+    admission = js.admission.controller
+    add_metric(
+        "elaspic_admission_limit",
+        "gauge",
+        "Admission limits (disabled if <= 0).",
+        [
+            ({"limit": "max_queued_items"}, admission.max_queued_items),
+            ({"limit": "token_max_items"}, admission.token_max_items),
+            ({"limit": "token_rate"}, admission.token_rate),
+            ({"limit": "token_burst"}, admission.token_burst),
+        ],
+    )
+    add_metric(
+        "elaspic_admission_queued_items",
+        "gauge",
+        "Items counted against the `max_queued_items` limit.",
+        [({}, admission.get_queued_items(ds))],
+    )
+    add_metric(
+        "elaspic_admission_drain_rate",
+        "gauge",
+        "Number of items finished per second, used to compute Retry-After delays.",
+        [({}, admission.drain_rate.rate)],
+    )
+    add_metric(
+        "elaspic_admission_rejected_total",
+        "counter",
+        "Number of submissions rejected by each admission limit.",
+        [({"reason": reason}, count) for reason, count in sorted(admission.num_rejected.items())],
+    )
+
+    add_metric(
+        "elaspic_task_restarts_total",
+        "counter",
+        "Number of times that each task was restarted after failing with an error.",
+        [({"task": name}, count) for name, count in sorted(task_restarts.items())],
+    )
+    return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    formatted = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels.items()
+    )
+    return "{" + formatted + "}"
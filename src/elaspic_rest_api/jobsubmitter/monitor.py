@@ -1,18 +1,25 @@
 import asyncio
 import logging
+import os
+import os.path as op
+import re
 import shlex
 import time
-from typing import Callable, Mapping, Set, Tuple
+from typing import Callable, Dict, Mapping, Optional, Set, Tuple
 
-import aiofiles
+import aiofiles.os
 
 from elaspic_rest_api import config
 from elaspic_rest_api import jobsubmitter as js
 
 logger = logging.getLogger(__name__)
 
-#: SLURM job ids of all running jobs
-running_jobs: Set = set()
+SQUEUE_JOB_ID_RE = re.compile(r"^(\d+)(?:_(\d+|\[[\d,\-%]+\]))?$")
+
+#: SLURM job ids of all running jobs (`<job_id>` or `<job_id>_<array_task_id>`)
+running_jobs: Set[str] = set()
+#: SLURM job ids of jobs which will never start because one of their dependencies failed
+never_satisfied_jobs: Set[str] = set()
 running_jobs_last_updated = 0.0
 validation_last_updated = 0.0
 
@@ -20,33 +27,32 @@ validation_last_updated = 0.0
 async def monitor_stats(
     ds: js.DataStructures, task_fns: Mapping[str, Callable], tasks: Mapping[str, asyncio.Task]
 ):
+    """Restart tasks which failed and log a short summary (see `render_metrics` for details)."""
     while True:
-        logger.info("*" * 50)
-        logger.info("{:40}{:10}".format("pre_qsub_queue:", ds.pre_qsub_queue.qsize()))
-        logger.info("{:40}{:10}".format("qsub_queue:", ds.qsub_queue.qsize()))
-        logger.info("{:40}{:10}".format("Submitted jobs:", len(running_jobs)))
-        logger.info("{:40}{:10}".format("validation_queue:", ds.validation_queue.qsize()))
-        logger.info("{:40}{:10}".format("el2_pending_queue:", ds.elaspic2_pending_queue.qsize()))
-        logger.info("{:40}{:10}".format("el2_running_queue:", ds.elaspic2_running_queue.qsize()))
-
-        # logger.debug('precalculated: {}'.format(precalculated))
-        logger.info("precalculated_cache: {}".format(ds.precalculated_cache))
         for task_name, task_fn in list(task_fns.items()):
             task = tasks[task_name]
-            is_done = task.done()
-            if is_done:
-                error = task.exception()
-                if error is not None:
-                    task.print_stack()
-                    logger.error("Task %s finished with an error: %s. Restarting", task_name, error)
-                    tasks[task_name] = asyncio.create_task(task_fn(), name=task_name)
-                    task_state = f"error ({type(error)}: {error})"
-                else:
-                    task_state = "done"
-            else:
-                task_state = "running"
-            logger.info("{:40}{:>10}".format(f"Task {task_name}:", task_state))
-        logger.info("*" * 50)
+            if task.done() and (error := task.exception()) is not None:
+                task.print_stack()
+                logger.error("Task %s finished with an error: %s. Restarting", task_name, error)
+                tasks[task_name] = asyncio.create_task(task_fn(), name=task_name)
+                js.metrics.task_restarts[task_name] = js.metrics.task_restarts.get(task_name, 0) + 1
+        num_running = sum(not task.done() for task in tasks.values())
+        logger.info(
+            "Queues (pre_qsub/qsub/validation/el2_pending/el2_running): %s/%s/%s/%s/%s; "
+            "in flight: %s; SLURM jobs: %s; monitored jobs: %s; tasks running: %s/%s; "
+            "task restarts: %s.",
+            ds.pre_qsub_queue.qsize(),
+            ds.qsub_queue.qsize(),
+            ds.validation_queue.qsize(),
+            ds.elaspic2_pending_queue.qsize(),
+            ds.elaspic2_running_queue.qsize(),
+            len(ds.in_flight),
+            len(running_jobs),
+            len(ds.monitored_jobs),
+            num_running,
+            len(tasks),
+            sum(js.metrics.task_restarts.values()),
+        )
         await asyncio.sleep(js.perf.SLEEP_FOR_INFO)
 
 
@@ -55,77 +61,149 @@ async def qstat():
     global running_jobs_last_updated
     while True:
         logger.debug("squeue")
-        system_command = (
-            f"ssh {config.SLURM_MASTER_USER}@{config.SLURM_MASTER_HOST} "
-            f"squeue -u '{config.SLURM_MASTER_USER}'"
-        )
-        proc = await asyncio.create_subprocess_exec(
-            *shlex.split(system_command),
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
-        result_bytes, error_message = await proc.communicate()
-        result = result_bytes.decode()
-        if error_message:
+        system_command = f"squeue -u '{config.SLURM_MASTER_USER}'"
+        result, error_message, returncode = await js.ssh.pool.run(system_command)
+        if returncode != 0 or error_message:
             logger.error("system command: '%s', error message: '%s'", system_command, error_message)
             await asyncio.sleep(js.perf.SLEEP_FOR_ERROR)
             continue
         running_jobs.clear()
-        running_jobs.update(
-            {
-                int(x.split(" ")[0])
-                for x in [v.strip() for v in result.split("\n")]
-                if x and x.split(" ")[0].isdigit()
-            }
-        )
+        running_jobs.update(parse_squeue_job_ids(result))
+        never_satisfied_jobs.clear()
+        never_satisfied_jobs.update(parse_squeue_job_ids(result, "DependencyNeverSatisfied"))
         logger.debug("running jobs: %s", running_jobs)
         running_jobs_last_updated = time.time()
         await asyncio.sleep(js.perf.SLEEP_FOR_QSTAT)
 
 
+def parse_squeue_job_ids(result: str, reason: Optional[str] = None) -> Set[str]:
+    """Parse job ids from the output of `squeue`.
+
+    Pending job array tasks (e.g. `1235_[0-3,5%2]`) are expanded into individual task ids.
+    If `reason` is provided, only jobs pending for that reason are returned.
+    """
+    job_ids = set()
+    for line in result.split("\n"):
+        if reason is not None and f"({reason})" not in line:
+            continue
+        job_id = line.strip().split(" ")[0]
+        match = SQUEUE_JOB_ID_RE.match(job_id)
+        if match is None:
+            continue
+        array_job_id, array_task_ids = match.groups()
+        if array_task_ids is None:
+            job_ids.add(array_job_id)
+            continue
+        array_task_ids = array_task_ids.strip("[]").split("%")[0]
+        for task_range in array_task_ids.split(","):
+            start, _, stop = task_range.partition("-")
+            for array_task_id in range(int(start), int(stop or start) + 1):
+                job_ids.add(f"{array_job_id}_{array_task_id}")
+    return job_ids
+
+
+def scan_finished_locks() -> Dict[str, bool]:
+    """Find jobs which have finished running by scanning the `finished` lock directories.
+
+    Job scripts create `lock_filename_finished` when they finish successfully
+    and `lock_filename_finished + ".failed"` when they finish with an error.
+
+    Returns:
+        Mapping from the finished lock path of each job to whether the job was successful.
+    """
+    finished_locks = {}
+    for lock_dir in [config.PROVEAN_LOCK_DIR, config.MODEL_LOCK_DIR, config.MUTATION_LOCK_DIR]:
+        try:
+            with os.scandir(op.join(lock_dir, "finished")) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".lock"):
+                        finished_locks[entry.path] = True
+                    elif entry.name.endswith(".lock.failed"):
+                        finished_locks[entry.path[: -len(".failed")]] = False
+        except FileNotFoundError:
+            continue
+    return finished_locks
+
+
 async def validation(ds: js.DataStructures):
     """Validate finished jobs."""
     global running_jobs
     global validation_last_updated
+    loop = asyncio.get_running_loop()
     while True:
         logger.debug("validation")
+        finished_locks_last_updated = time.time()
+        finished_locks = await loop.run_in_executor(None, scan_finished_locks)
         for _ in range(ds.validation_queue.qsize()):
             item = await ds.validation_queue.get()
-            if (item.start_time > running_jobs_last_updated) or (item.job_id in running_jobs):
-                # logger.debug("Job %s not ready for validation", item.job_id)
-                await ds.validation_queue.put(item)
-                await asyncio.sleep(js.perf.SLEEP_FOR_LOOP)
-                continue
-            #
-            validation_passphrase = "Finished successfully"
-            validated, system_command, result, error_message = await _validate_finished_item(
-                item, validation_passphrase
+            # Finished locks are cleared on submission, so only a scan performed after
+            # the item was submitted can tell us whether the item is finished
+            succeeded = (
+                finished_locks.get(item.finished_lock_path)
+                if item.start_time < finished_locks_last_updated
+                else None
             )
+            if succeeded is None:
+                if item.slurm_job_id in never_satisfied_jobs:
+                    system_command = f"scancel {item.slurm_job_id}"
+                    await js.ssh.pool.run(system_command)
+                    await js.restart_or_drop(
+                        item, ds, system_command, error_message="DependencyNeverSatisfied"
+                    )
+                    continue
+                if (item.start_time > running_jobs_last_updated) or (
+                    item.slurm_job_id in running_jobs
+                ):
+                    await ds.validation_queue.put(item)
+                    continue
+                # The job left the queue without creating its finished lock (e.g. it was killed),
+                # so we fall back to checking its log file
+                validation_passphrase = "Finished successfully"
+                validated, system_command, result, error_message = await _validate_finished_item(
+                    item, validation_passphrase
+                )
+            else:
+                validated, system_command, result, error_message = (
+                    succeeded,
+                    "unk",
+                    "unk",
+                    f"Job finished with an error (see '{item.stderr_path}').",
+                )
+                await _remove_finished_lock(item, succeeded)
+
             if not validated:
                 await js.restart_or_drop(item, ds, system_command, result, error_message)
                 continue
 
-            try:
-                await aiofiles.os.remove(item.lock_path)
-                logger.debug("Removed lock file for finished job %s", item.job_id)
-            except FileNotFoundError:
-                logger.debug(
-                    "Failed to remove lock file for finished job %s (lock file: %s)",
-                    item.job_id,
-                    item.lock_path,
-                )
+            await js.locks.manager.release(item.unique_id)
+            logger.debug("Released lock for finished job %s", item.job_id)
 
             if item.run_type in ["sequence", "model"]:
+                js.transition(item, js.journal.DONE)
+                await js.resolve_item(item, ds)
+                ds.prereq_job_ids.pop(item.unique_id, None)
                 ds.precalculated_cache[item.unique_id] = item.job_id
                 logger.debug("Added finished job %s to cache.", item.job_id)
+                await js.release_dependents(item.unique_id, ds)
             elif item.run_type in ["mutations"]:
+                js.transition(item, js.journal.VALIDATED)
                 await ds.elaspic2_pending_queue.put(item)
             else:
                 raise Exception(f"Invalid run type: {item.run_type}.")
             await asyncio.sleep(js.perf.SLEEP_FOR_LOOP)
+        await js.cleanup_array_task_files(ds)
         await asyncio.sleep(js.perf.SLEEP_FOR_QSTAT)
 
 
+async def _remove_finished_lock(item: js.Item, succeeded: bool) -> None:
+    """Remove the finished lock of `item` once it has been validated."""
+    finished_lock_path = item.finished_lock_path + ("" if succeeded else ".failed")
+    try:
+        await aiofiles.os.remove(finished_lock_path)
+    except FileNotFoundError:
+        pass
+
+
 async def _validate_finished_item(
     item: js.Item, validation_passphrase: str
 ) -> Tuple[bool, str, str, str]:
@@ -6,3 +6,11 @@ SLEEP_FOR_QSTAT = 30
 SLEEP_FOR_ERROR = 5
 SLEEP_FOR_QSUB = 0.01
 SLEEP_FOR_LOOP = 0.01
+SLEEP_FOR_FINALIZE = 5
+SLEEP_FOR_EL2_COLLECT = 30
+SLEEP_FOR_EL2_FLUSH = 1
+SLEEP_FOR_EL2_RETRY = 60
+SLEEP_FOR_EL2_CLEANUP = 60
+SLEEP_FOR_LOCK_SWEEP = 60 * 60
+SLEEP_FOR_JOURNAL_COMPACT = 10 * 60
+SLEEP_FOR_PRECALCULATED = 5 * 60
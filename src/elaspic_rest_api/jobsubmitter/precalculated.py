@@ -1,34 +1,213 @@
 import asyncio
 import logging
-from collections import deque
-from typing import Dict
+from typing import Container, Dict, Iterable
 
+from elaspic_rest_api import config
 from elaspic_rest_api import jobsubmitter as js
 
 logger = logging.getLogger(__name__)
 
 
-def check_prereqs(
-    prereqs, precalculated: Dict, precalculated_cache: Dict, lsd=deque(maxlen=512)
-) -> bool:
-    for prereq in prereqs:
-        if prereq in lsd:
-            continue
-        elif prereq in precalculated_cache or prereq in precalculated:
-            lsd.appendleft(prereq)
-            continue
-        else:
-            return False
-    return True
+def check_prereqs(prereqs, precalculated: Container, precalculated_cache: Dict) -> bool:
+    return all(prereq in precalculated_cache or prereq in precalculated for prereq in prereqs)
+
+
+def check_prereq_submitted(prereq: str, ds: js.DataStructures) -> bool:
+    """Return `True` if `prereq` is available to jobs which are submitted now.
+
+    When `config.QSUB_USE_DEPENDENCIES` is set, prereqs which have been submitted to SLURM
+    are available, since dependent jobs will wait for them to finish.
+    """
+    return check_prereqs([prereq], ds.precalculated, ds.precalculated_cache) or (
+        config.QSUB_USE_DEPENDENCIES and prereq in ds.prereq_job_ids
+    )
+
+
+async def wait_for_prereqs(item: js.Item, ds: js.DataStructures) -> None:
+    """Keep `item` in `pre_qsub_queue` until all of its prereqs have been calculated."""
+    missing_prereqs = [prereq for prereq in item.prereqs if not check_prereq_submitted(prereq, ds)]
+    if not missing_prereqs:
+        await ds.qsub_queue.put(item)
+        return
+
+    if not item.waiting_for_prereqs:
+        item.waiting_for_prereqs = True
+        ds.num_waiting_for_prereqs += 1
+    for prereq in missing_prereqs:
+        ds.prereq_dependents.setdefault(prereq, set()).add(item)
+    await ds.pre_qsub_queue.put(item)
+
+
+def stop_waiting_for_prereqs(item: js.Item, ds: js.DataStructures) -> None:
+    """Remove `item` from the prereq index.
+
+    The item itself is dropped from `pre_qsub_queue` the next time that `pre_qsub` runs.
+    """
+    if item.waiting_for_prereqs:
+        item.waiting_for_prereqs = False
+        ds.num_waiting_for_prereqs -= 1
+    for prereq in item.prereqs:
+        dependents = ds.prereq_dependents.get(prereq)
+        if dependents is not None:
+            dependents.discard(item)
+            if not dependents:
+                del ds.prereq_dependents[prereq]
+
+
+async def release_dependents(unique_id: str, ds: js.DataStructures) -> None:
+    """Submit items which were waiting for `unique_id` and have no other missing prereqs."""
+    for item in list(ds.prereq_dependents.pop(unique_id, [])):
+        if item.waiting_for_prereqs and all(
+            check_prereq_submitted(prereq, ds) for prereq in item.prereqs
+        ):
+            stop_waiting_for_prereqs(item, ds)
+            await ds.qsub_queue.put(item)
+
+
+async def fail_dependents(unique_id: str, ds: js.DataStructures) -> None:
+    """Fail items which were waiting for `unique_id`, which could not be calculated."""
+    ds.failed_prereqs.add(unique_id)
+    failed_items = []
+    for item in list(ds.prereq_dependents.pop(unique_id, [])):
+        if item.waiting_for_prereqs:
+            stop_waiting_for_prereqs(item, ds)
+            await js.resolve_item(item, ds)
+            failed_items.append(item)
+    if failed_items:
+        logger.info("Prereq '%s' failed; cancelling %s items.", unique_id, len(failed_items))
+        await js.set_db_errors(failed_items)
+
+
+async def update_precalculated_loop(ds: js.DataStructures) -> None:
+    """Load `jobsubmitter_cache` into `ds.precalculated` and keep it up to date.
+
+    Items can be submitted while the initial load is still running, in which case
+    `lookup_precalculated` queries the database directly.
+    """
+    if config.PRECALCULATED_REBUILD:
+        try:
+            await rebuild_precalculated()
+        except Exception as e:
+            logger.error("Failed to rebuild precalculated data with error: %s", e)
+
+    while not ds.precalculated_loaded:
+        try:
+            await add_precalculated_seq()
+            ds.precalculated_last_seq = await update_precalculated(ds.precalculated)
+            ds.precalculated_loaded = True
+        except Exception as e:
+            logger.error("Failed to load precalculated data with error: %s. Retrying...", e)
+            await asyncio.sleep(js.perf.SLEEP_FOR_ERROR)
+    logger.info("Loaded %s precalculated items.", len(ds.precalculated))
+
+    while True:
+        await asyncio.sleep(js.perf.SLEEP_FOR_PRECALCULATED)
+        try:
+            ds.precalculated_last_seq = await refresh_precalculated(
+                ds.precalculated, ds.precalculated_last_seq
+            )
+        except Exception as e:
+            logger.error("Failed to refresh precalculated data with error: %s", e)
+
+
+async def add_precalculated_seq() -> None:
+    """Add the `seq` column to `jobsubmitter_cache`, if it is missing.
+
+    `seq` grows in the order in which rows are inserted, which is not true of `job_id`
+    (jobs finish out of order, SLURM job ids wrap around, and rebuilt rows have `job_id` 0).
+    """
+    async with js.EDBConnection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(GET_PRECALCULATED_SEQ_COLUMN_SQL)
+            if not await cur.fetchall():
+                logger.info("Adding the seq column to jobsubmitter_cache...")
+                await cur.execute(ADD_PRECALCULATED_SEQ_COLUMN_SQL)
+        await conn.commit()
+
+
+async def update_precalculated(precalculated: Dict) -> int:
+    """Load all of `jobsubmitter_cache` into `precalculated`, one page at a time.
+
+    Returns:
+        The largest `seq` that was loaded.
+    """
+    return await refresh_precalculated(precalculated, 0)
+
+
+async def refresh_precalculated(precalculated: Dict, last_seq: int) -> int:
+    """Load rows added to `jobsubmitter_cache` after `last_seq` into `precalculated`.
 
+    This picks up precalculated data written by other instances of the jobsubmitter.
 
-async def update_precalculated(precalculated: Dict) -> None:
+    Returns:
+        The largest `seq` that was loaded.
+    """
+    num_loaded = 0
+    while True:
+        async with js.EDBConnection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    GET_PRECALCULATED_PAGE_SQL, (last_seq, config.PRECALCULATED_PAGE_SIZE)
+                )
+                values = await cur.fetchall()
+        precalculated.update({v[0]: v[1] for v in values})
+        num_loaded += len(values)
+        if values:
+            last_seq = values[-1][2]
+        if len(values) < config.PRECALCULATED_PAGE_SIZE:
+            break
+        # Give other tasks a chance to run between pages
+        await asyncio.sleep(0)
+    logger.debug("Loaded %s new precalculated items.", num_loaded)
+    return last_seq
+
+
+async def lookup_precalculated(
+    unique_ids: Iterable[str], ds: js.DataStructures, force: bool = False
+) -> None:
+    """Look up `unique_ids` in the database if `ds.precalculated` has not been loaded yet.
+
+    If `force` is set, the database is queried even if `ds.precalculated` has been loaded,
+    in order to find items added since the last `refresh_precalculated`.
+    """
+    if ds.precalculated_loaded and not force:
+        return
+    missing = [
+        unique_id
+        for unique_id in set(unique_ids)
+        if unique_id not in ds.precalculated and unique_id not in ds.precalculated_cache
+    ]
+    if not missing:
+        return
+    try:
+        async with js.EDBConnection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    LOOKUP_PRECALCULATED_SQL.format(ids=", ".join(["%s"] * len(missing))), missing
+                )
+                values = await cur.fetchall()
+    except Exception as e:
+        logger.error("Failed to look up precalculated items %s with error: %s", missing, e)
+        return
+    ds.precalculated.update({v[0]: v[1] for v in values})
+
+
+async def rebuild_precalculated() -> int:
+    """Add sequences and models which are in the local result tables to `jobsubmitter_cache`.
+
+    Returns:
+        Number of rows that were added.
+    """
+    num_added = 0
     async with js.EDBConnection() as conn:
         async with conn.cursor() as cur:
-            await cur.execute("SELECT id, job_id from jobsubmitter_cache;")
-            values = await cur.fetchall()
-            precalculated.clear()
-            precalculated.update({v[0]: v[1] for v in values})
+            for rebuild_precalculated_sql in REBUILD_PRECALCULATED_SQL:
+                num_added += await cur.execute(
+                    rebuild_precalculated_sql.format(db_name=config.DB_NAME_WEBSERVER)
+                )
+        await conn.commit()
+    logger.info("Added %s missing items to jobsubmitter_cache.", num_added)
+    return num_added
 
 
 async def persist_precalculated(precalculated: Dict, precalculated_cache: Dict) -> None:
@@ -58,3 +237,44 @@ async def persist_precalculated(precalculated: Dict, precalculated_cache: Dict)
             await asyncio.sleep(js.perf.SLEEP_FOR_ERROR)
             continue
         await asyncio.sleep(js.perf.SLEEP_FOR_DB)
+
+
+GET_PRECALCULATED_SEQ_COLUMN_SQL = """\
+SHOW COLUMNS FROM jobsubmitter_cache LIKE 'seq';
+"""
+
+#: `seq` is assigned by MySQL when a row is inserted and is never updated
+ADD_PRECALCULATED_SEQ_COLUMN_SQL = """\
+ALTER TABLE jobsubmitter_cache
+ADD COLUMN seq BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+ADD UNIQUE KEY jobsubmitter_cache_seq (seq);
+"""
+
+GET_PRECALCULATED_PAGE_SQL = """\
+SELECT id, job_id, seq
+FROM jobsubmitter_cache
+WHERE seq > %s
+ORDER BY seq
+LIMIT %s;
+"""
+
+LOOKUP_PRECALCULATED_SQL = """\
+SELECT id, job_id
+FROM jobsubmitter_cache
+WHERE id IN ({ids});
+"""
+
+REBUILD_PRECALCULATED_SQL = [
+    """\
+INSERT INTO jobsubmitter_cache (id, job_id)
+SELECT DISTINCT CONCAT('local.sequence.', protein_id), 0
+FROM {db_name}.elaspic_protein_sequence_local
+ON DUPLICATE KEY UPDATE job_id = jobsubmitter_cache.job_id;
+""",
+    """\
+INSERT INTO jobsubmitter_cache (id, job_id)
+SELECT DISTINCT CONCAT('local.model.', protein_id), 0
+FROM {db_name}.elaspic_core_model_local
+ON DUPLICATE KEY UPDATE job_id = jobsubmitter_cache.job_id;
+""",
+]
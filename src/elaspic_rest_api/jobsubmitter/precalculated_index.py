@@ -0,0 +1,188 @@
+import hashlib
+import time
+import tracemalloc
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from typing import Dict, Iterable, Optional, Set
+
+
+def get_digest(key: str) -> int:
+    """Return a 64-bit digest of `key`."""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, bits_per_key: int) -> None:
+        self.capacity = capacity
+        self.num_bits = max(64, capacity * bits_per_key)
+        self.num_hashes = max(1, round(bits_per_key * 0.69))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def add(self, digest: int) -> None:
+        for position in self._get_positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, digest: int) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._get_positions(digest)
+        )
+
+    def _get_positions(self, digest: int) -> Iterable[int]:
+        # Double hashing using the two halves of the digest
+        h1, h2 = digest & 0xFFFFFFFF, (digest >> 32) | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+
+class PrecalculatedIndex:
+    """Compact set of the `unique_id`s of precalculated sequences and models.
+
+    Keys are stored as 64-bit digests in a sorted array (8 bytes per key, instead of the key
+    strings and the hash table of a dict). New keys are collected in a small set and merged into
+    the array in bulk. Keys which were found recently are kept in an LRU cache, so that lookups
+    for the prereqs of popular proteins do not need to hash the key, and an optional Bloom filter
+    rejects most missing keys without searching the array.
+
+    Two different keys have the same digest with a probability of about `len(self) / 2**64`,
+    in which case a prereq would be wrongly reported as precalculated.
+    """
+
+    def __init__(
+        self,
+        keys: Iterable[str] = (),
+        lru_size: int = 4096,
+        merge_size: int = 65536,
+        bloom_bits_per_key: int = 0,
+    ) -> None:
+        self.lru_size = lru_size
+        self.merge_size = merge_size
+        self.bloom_bits_per_key = bloom_bits_per_key
+        self._digests = array("Q")
+        self._pending: Set[int] = set()
+        self._lru: "OrderedDict[str, None]" = OrderedDict()
+        self._bloom: Optional[BloomFilter] = None
+        self.update(keys)
+
+    def __contains__(self, key: object) -> bool:
+        if not isinstance(key, str):
+            return False
+        if key in self._lru:
+            self._lru.move_to_end(key)
+            return True
+        digest = get_digest(key)
+        if self._bloom is not None and digest not in self._bloom:
+            return False
+        if not self._contains_digest(digest):
+            return False
+        self._lru[key] = None
+        if len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+        return True
+
+    def __len__(self) -> int:
+        return len(self._digests) + len(self._pending)
+
+    def add(self, key: str) -> None:
+        digest = get_digest(key)
+        if self._contains_digest(digest):
+            return
+        self._pending.add(digest)
+        if self._bloom is not None:
+            self._bloom.add(digest)
+        if len(self._pending) >= self.merge_size:
+            self._merge()
+
+    def __setitem__(self, key: str, job_id: int) -> None:
+        """Add `key` to the index, for compatibility with dicts (`job_id` is not stored)."""
+        self.add(key)
+
+    def update(self, keys: Iterable[str]) -> None:
+        """Add `keys` to the index (mappings, such as `precalculated_cache`, add their keys)."""
+        for key in keys:
+            self.add(key)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory used by the digests and the Bloom filter."""
+        num_bytes = self._digests.itemsize * len(self._digests)
+        if self._bloom is not None:
+            num_bytes += len(self._bloom.bits)
+        return num_bytes
+
+    def _contains_digest(self, digest: int) -> bool:
+        if digest in self._pending:
+            return True
+        idx = bisect_left(self._digests, digest)
+        return idx < len(self._digests) and self._digests[idx] == digest
+
+    def _merge(self) -> None:
+        digests = self._digests
+        digests.extend(sorted(self._pending))
+        # Timsort merges the two sorted runs in linear time
+        self._digests = array("Q", sorted(digests))
+        self._pending = set()
+        if self.bloom_bits_per_key > 0 and (
+            self._bloom is None or len(self._digests) > self._bloom.capacity
+        ):
+            self._bloom = BloomFilter(2 * len(self._digests), self.bloom_bits_per_key)
+            for digest in self._digests:
+                self._bloom.add(digest)
+
+
+def _check_prereqs_legacy(prereqs, precalculated: Dict, lsd: deque) -> bool:
+    # `check_prereqs` before `PrecalculatedIndex` was introduced
+    for prereq in prereqs:
+        if prereq in lsd:
+            continue
+        elif prereq in precalculated:
+            lsd.appendleft(prereq)
+            continue
+        else:
+            return False
+    return True
+
+
+def benchmark(
+    num_entries: int = 1_000_000, num_lookups: int = 100_000, bloom_bits_per_key: int = 0
+) -> Dict[str, float]:
+    """Compare the memory use and lookup latency of `PrecalculatedIndex` and a dict.
+
+    Half of the lookups are for precalculated keys and half are for missing keys.
+
+    Returns:
+        Memory per million entries (MB) and mean lookup time (µs) of each data structure.
+    """
+
+    def get_key(i: int) -> str:
+        return f"database.{('sequence', 'model')[i % 2]}.{i:08x}"
+
+    results: Dict[str, float] = {}
+    lookup_keys = [
+        get_key((i * 2) % num_entries if i % 2 else num_entries + i) for i in range(num_lookups)
+    ]
+
+    tracemalloc.start()
+    precalculated = {get_key(i): i for i in range(num_entries)}
+    results["dict_mb_per_million"] = tracemalloc.get_traced_memory()[0] / num_entries
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    index = PrecalculatedIndex(
+        (get_key(i) for i in range(num_entries)), bloom_bits_per_key=bloom_bits_per_key
+    )
+    index._merge()
+    results["index_mb_per_million"] = tracemalloc.get_traced_memory()[0] / num_entries
+    tracemalloc.stop()
+
+    lsd: deque = deque(maxlen=512)
+    start_time = time.perf_counter()
+    for key in lookup_keys:
+        _check_prereqs_legacy([key], precalculated, lsd)
+    results["dict_lookup_us"] = (time.perf_counter() - start_time) / num_lookups * 1e6
+
+    start_time = time.perf_counter()
+    for key in lookup_keys:
+        key in index
+    results["index_lookup_us"] = (time.perf_counter() - start_time) / num_lookups * 1e6
+    return results
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import os
+import os.path as op
+import shlex
+import time
+from asyncio import Queue
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from elaspic_rest_api import config
+from elaspic_rest_api.jobsubmitter.metrics import COMMAND_LATENCY_BUCKETS, Histogram
+
+logger = logging.getLogger(__name__)
+
+#: Return code used by `ssh` when the connection itself (rather than the remote command) fails
+SSH_ERROR_RETURNCODE = 255
+
+
+@dataclass
+class CommandStats:
+    count: int = 0
+    failures: int = 0
+    total_time: float = 0.0
+    max_time: float = 0.0
+    latency: Histogram = field(default_factory=lambda: Histogram(COMMAND_LATENCY_BUCKETS))
+
+    @property
+    def mean_time(self) -> float:
+        return self.total_time / self.count if self.count else 0.0
+
+    def record(self, duration: float, success: bool) -> None:
+        self.count += 1
+        self.failures += not success
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        self.latency.observe(duration)
+
+
+class SSHPool:
+    """Pool of long-lived, multiplexed SSH sessions to a single host.
+
+    Each slot in the pool corresponds to an OpenSSH control master, which is started on first use
+    and kept alive for `control_persist` seconds after the last command. Commands running in
+    different slots proceed concurrently, while commands running in the same slot reuse
+    the existing connection instead of performing a new handshake.
+    """
+
+    def __init__(self, destination: str, size: int, control_dir: str, control_persist: int) -> None:
+        self.destination = destination
+        self.size = size
+        self.control_dir = control_dir
+        self.control_persist = control_persist
+        #: Latency and failure counts for each remote command (e.g. "sbatch", "squeue")
+        self.stats: Dict[str, CommandStats] = {}
+        self._slots: Optional[Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def get_ssh_command(self, slot: int) -> List[str]:
+        return [
+            "ssh",
+            "-o",
+            "ControlMaster=auto",
+            "-o",
+            f"ControlPath={op.join(self.control_dir, f'{slot}-%C')}",
+            "-o",
+            f"ControlPersist={self.control_persist}",
+            "-o",
+            "ServerAliveInterval=30",
+            self.destination,
+        ]
+
+    def format_command(self, remote_command: str) -> str:
+        """Return a standalone command that can be used to re-run `remote_command` manually."""
+        return f"ssh {self.destination} {remote_command}"
+
+    async def run(self, remote_command: str) -> Tuple[str, str, int]:
+        """Run `remote_command` on the remote host.
+
+        If the SSH connection fails, the control master of that slot is shut down and
+        the command is retried once on a new connection.
+
+        Returns:
+            Standard output, standard error, and the return code of the command.
+        """
+        slots = self._get_slots()
+        slot = await slots.get()
+        try:
+            for attempt in range(2):
+                start_time = time.perf_counter()
+                result, error_message, returncode = await self._exec(slot, remote_command)
+                self._record(remote_command, time.perf_counter() - start_time, returncode)
+                if returncode != SSH_ERROR_RETURNCODE:
+                    break
+                logger.warning(
+                    "SSH session %s to '%s' failed (attempt %s): %s. Reconnecting...",
+                    slot,
+                    self.destination,
+                    attempt,
+                    error_message,
+                )
+                await self._disconnect(slot)
+            return result, error_message, returncode
+        finally:
+            slots.put_nowait(slot)
+
+    async def close(self) -> None:
+        """Shut down all control masters."""
+        for slot in range(self.size):
+            await self._disconnect(slot)
+
+    def _get_slots(self) -> Queue:
+        # Queues are bound to an event loop, so we need a different one for each loop
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._loop is not loop:
+            os.makedirs(self.control_dir, mode=0o700, exist_ok=True)
+            self._slots = Queue()
+            for slot in range(self.size):
+                self._slots.put_nowait(slot)
+            self._loop = loop
+        return self._slots
+
+    async def _exec(self, slot: int, remote_command: str) -> Tuple[str, str, int]:
+        proc = await asyncio.create_subprocess_exec(
+            *self.get_ssh_command(slot),
+            remote_command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        result_bytes, error_message_bytes = await proc.communicate()
+        assert proc.returncode is not None
+        return result_bytes.decode(), error_message_bytes.decode(), proc.returncode
+
+    async def _disconnect(self, slot: int) -> None:
+        ssh_command = self.get_ssh_command(slot)
+        proc = await asyncio.create_subprocess_exec(
+            *ssh_command[:-1],
+            "-O",
+            "exit",
+            ssh_command[-1],
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        await proc.wait()
+
+    def _record(self, remote_command: str, duration: float, returncode: int) -> None:
+        command_name = get_command_name(remote_command)
+        logger.debug(
+            "Remote command '%s' finished in %.3f s (return code: %s).",
+            command_name,
+            duration,
+            returncode,
+        )
+        self.stats.setdefault(command_name, CommandStats()).record(duration, returncode == 0)
+
+
+def get_command_name(remote_command: str) -> str:
+    """Return the name of the program run by `remote_command`, skipping variable assignments."""
+    for token in shlex.split(remote_command):
+        if "=" not in token:
+            return op.basename(token)
+    return "unk"
+
+
+#: SSH sessions to the SLURM master node, shared by `qsub` and `qstat`
+pool = SSHPool(
+    f"{config.SLURM_MASTER_USER}@{config.SLURM_MASTER_HOST}",
+    size=config.SSH_POOL_SIZE,
+    control_dir=config.SSH_CONTROL_DIR,
+    control_persist=config.SSH_CONTROL_PERSIST,
+)
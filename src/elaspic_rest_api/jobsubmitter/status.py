@@ -0,0 +1,90 @@
+import hashlib
+import json
+from typing import Any, Dict, Optional, Tuple
+
+from elaspic_rest_api import jobsubmitter as js
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def get_queues(ds: js.DataStructures) -> Dict[str, js.metrics.StageQueue]:
+    return {
+        "pre_qsub": ds.pre_qsub_queue,
+        "qsub": ds.qsub_queue,
+        "validation": ds.validation_queue,
+        "el2_pending": ds.elaspic2_pending_queue,
+        "el2_running": ds.elaspic2_running_queue,
+    }
+
+
+def get_item_summary(item: js.Item) -> Dict[str, Any]:
+    return {
+        "unique_id": item.unique_id,
+        "item_id": item.item_id,
+        "state": item.state,
+        "stage": item.stage,
+        "stage_start_time": item.stage_start_time,
+        "slurm_job_id": item.slurm_job_id if item.job_id is not None else None,
+        "qsub_tries": item.qsub_tries,
+        "webserver_job_ids": sorted(job_key.job_id for job_key in item.job_keys),
+    }
+
+
+def get_status_summary(ds: js.DataStructures) -> Dict[str, Any]:
+    """Return the number of items in each data structure (takes constant time)."""
+    return {
+        "queues": {
+            name: {
+                "size": queue.qsize(),
+                "oldest_put_time": queue.oldest_put_time,
+                "num_put": queue.num_put,
+                "num_get": queue.num_get,
+            }
+            for name, queue in get_queues(ds).items()
+        },
+        "in_flight": len(ds.in_flight),
+        "monitored_jobs": len(ds.monitored_jobs),
+        "waiting_for_prereqs": ds.num_waiting_for_prereqs,
+        "el2_score_buffer": len(ds.elaspic2_score_buffer),
+        "mutations_to_finalize": len(ds.mutations_to_finalize),
+        "slurm_jobs": len(js.monitor.running_jobs),
+    }
+
+
+def get_queue_page(ds: js.DataStructures, queue_name: str, cursor: int, limit: int) -> Dict:
+    """Return up to `limit` items from the queue `queue_name`, starting after `cursor`.
+
+    Pass the returned `next_cursor` to get the next page (`None` if there are no more items).
+    """
+    queue = get_queues(ds)[queue_name]
+    page = queue.get_page(cursor, limit + 1)
+    next_cursor = page[limit - 1][0] if len(page) > limit else None
+    return {
+        "queue": queue_name,
+        "items": [get_item_summary(item) for _, item in page[:limit]],
+        "next_cursor": next_cursor,
+    }
+
+
+def dumps(data: Any) -> bytes:
+    """Serialize `data` to JSON, using `orjson` if it is available."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def dumps_with_etag(data: Any) -> Tuple[bytes, str]:
+    """Serialize `data` to JSON and return it together with an ETag computed from its content."""
+    body = dumps(data)
+    return body, '"{}"'.format(hashlib.blake2b(body, digest_size=16).hexdigest())
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Return `True` if the `If-None-Match` header matches `etag`."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
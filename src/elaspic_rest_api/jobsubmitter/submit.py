@@ -1,9 +1,13 @@
 import asyncio
 import logging
+import os
+import os.path as op
 import re
 import shlex
 import time
+import uuid
 from textwrap import dedent
+from typing import Dict, List, Optional, Set, Tuple
 
 from elaspic_rest_api import config
 from elaspic_rest_api import jobsubmitter as js
@@ -35,17 +39,16 @@ QSUB_OPTIONS = {
 
 
 def create_qsub_system_command(item: js.Item) -> str:
+    """Create a command submitting `item` to SLURM (to be executed on the SLURM master node)."""
     qsub_options = QSUB_OPTIONS[item.run_type]
     system_command = dedent(
         f"""\
-        ssh {config.SLURM_MASTER_USER}@{config.SLURM_MASTER_HOST}
         DB_NAME_ELASPIC="{config.DB_NAME_ELASPIC}"
         DB_NAME_WEBSERVER="{config.DB_NAME_WEBSERVER}"
         DB_HOST="{config.DB_HOST}"
         DB_PORT="{config.DB_PORT}"
         DB_USER="{config.DB_USER}"
         DB_PASSWORD="{config.DB_PASSWORD}"
-        lock_filename="{item.lock_path}"
         lock_filename_finished="{item.finished_lock_path}"
         protein_id="{item.args['protein_id']}"
         mutations="{item.args['mutations']}"
@@ -61,18 +64,108 @@ def create_qsub_system_command(item: js.Item) -> str:
         --nodes=1
         --ntasks-per-node={qsub_options["num_cores"]}
         --mem={qsub_options["mem"]}
+        {get_dependency_options(item)}
         "{config.SCRIPTS_DIR}/{item.args['job_type']}.sh"
         """
     ).replace("\n", " ")
     return system_command
 
 
+def get_dependency_options(item: js.Item) -> str:
+    """Return `sbatch` options which make `item` wait for its prereqs to finish successfully.
+
+    Jobs whose dependencies fail are removed from the queue instead of being held indefinitely.
+    """
+    if not item.dependency_job_ids:
+        return ""
+    return "--dependency=afterok:{} --kill-on-invalid-dep=yes".format(
+        ":".join(item.dependency_job_ids)
+    )
+
+
+def create_qsub_array_system_command(items: List[js.Item], task_file: str) -> str:
+    """Create a command submitting `items` as a single SLURM job array.
+
+    All `items` must share the same `job_type`, `run_type` and `dependency_job_ids`.
+    Variables that are specific to each item are defined in `task_file`
+    (see `create_array_task_file`).
+    """
+    item = items[0]
+    qsub_options = QSUB_OPTIONS[item.run_type]
+    array = f"0-{len(items) - 1}"
+    if config.QSUB_ARRAY_THROTTLE > 0:
+        array += f"%{config.QSUB_ARRAY_THROTTLE}"
+    system_command = dedent(
+        f"""\
+        DB_NAME_ELASPIC="{config.DB_NAME_ELASPIC}"
+        DB_NAME_WEBSERVER="{config.DB_NAME_WEBSERVER}"
+        DB_HOST="{config.DB_HOST}"
+        DB_PORT="{config.DB_PORT}"
+        DB_USER="{config.DB_USER}"
+        DB_PASSWORD="{config.DB_PASSWORD}"
+        task_file="{task_file}"
+        job_type="{item.args['job_type']}"
+        SCRIPTS_DIR="{config.SCRIPTS_DIR}"
+        ELASPIC_VERSION="{config.ELASPIC_VERSION}"
+        run_type={item.run_type}
+        elaspic_run_type={qsub_options["elaspic_run_type"]}
+        sbatch
+        --array={array}
+        --time={qsub_options["time"]}
+        --nodes=1
+        --ntasks-per-node={qsub_options["num_cores"]}
+        --mem={qsub_options["mem"]}
+        {get_dependency_options(item)}
+        "{config.SCRIPTS_DIR}/array.sh"
+        """
+    ).replace("\n", " ")
+    return system_command
+
+
+def create_array_task_file(items: List[js.Item]) -> str:
+    """Create a bash script exporting item-specific variables for each job array task."""
+    lines = ['case "${SLURM_ARRAY_TASK_ID}" in']
+    for array_task_id, item in enumerate(items):
+        variables = {
+            "lock_filename_finished": item.finished_lock_path,
+            "protein_id": item.args["protein_id"],
+            "mutations": item.args["mutations"],
+            "uniprot_domain_pair_ids": item.args["uniprot_domain_pair_ids"] or "",
+            "structure_file": item.args["structure_file"] or "",
+            "sequence_file": item.args["sequence_file"] or "",
+        }
+        lines.append(f"  {array_task_id})")
+        lines.extend(f"    export {key}={shlex.quote(value)}" for key, value in variables.items())
+        lines.append("    ;;")
+    lines.append("esac")
+    return "\n".join(lines) + "\n"
+
+
+def _write_array_task_file(task_file: str, items: List[js.Item]) -> None:
+    os.makedirs(op.dirname(task_file), exist_ok=True)
+    with open(task_file, "wt") as fout:
+        fout.write(create_array_task_file(items))
+
+
 async def pre_qsub(ds: js.DataStructures) -> None:
-    """Wait while the sequence and model prerequisites are being calculated."""
+    """Sweep items waiting for their sequence and model prerequisites.
+
+    Items are normally submitted as soon as their prereqs have been calculated
+    (see `release_dependents`). This loop catches prereqs which became available by other means
+    (e.g. were loaded from the database), cancels items which have been waiting for too long,
+    and removes items which have already been released from `pre_qsub_queue`.
+    Items whose lock is held by someone else (see `_claim_item`) are also retried from here.
+    """
     while True:
         logger.debug("pre_qsub")
         for _ in range(ds.pre_qsub_queue.qsize()):
-            item = await ds.pre_qsub_queue.get()
+            item = ds.pre_qsub_queue.get_nowait()
+            if item.waiting_for_lock:
+                item.waiting_for_lock = False
+                await ds.qsub_queue.put(item)
+                continue
+            if not item.waiting_for_prereqs:
+                continue
             have_prereqs = js.check_prereqs(item.prereqs, ds.precalculated, ds.precalculated_cache)
             if not have_prereqs:
                 restarting = abs(time.time() - item.init_time) < js.perf.JOB_TIMEOUT
@@ -81,11 +174,12 @@ async def pre_qsub(ds: js.DataStructures) -> None:
                     await ds.pre_qsub_queue.put(item)
                 else:
                     logger.debug("Waited for prereqs too long; cancelling: %s", item.prereqs)
-                    await js.remove_from_monitored(item, ds.monitored_jobs)
+                    js.stop_waiting_for_prereqs(item, ds)
+                    await js.resolve_item(item, ds)
                     await js.set_db_errors([item])
             else:
+                js.stop_waiting_for_prereqs(item, ds)
                 await ds.qsub_queue.put(item)
-            await asyncio.sleep(js.perf.SLEEP_FOR_LOOP)
         await asyncio.sleep(js.perf.SLEEP_FOR_QSTAT)
 
 
@@ -95,46 +189,229 @@ async def qsub(ds: js.DataStructures) -> None:
         item = await ds.qsub_queue.get()
         logger.debug("qsub")
 
-        if item.run_type in ["sequence", "model"] and (
-            item.unique_id in ds.precalculated_cache or item.unique_id in ds.precalculated
-        ):
-            logger.debug("Item '{}' already calculated. Skipping...".format(item.unique_id))
-            continue
-
-        try:
-            open(item.lock_path, "x").close()
-        except FileExistsError:
-            logger.debug("Item '%s' already being calculated. Skipping...", item.unique_id)
-            continue
-
         try:
-            system_command = create_qsub_system_command(item)
-            logger.debug("Running system command: %s", system_command)
-            proc = await asyncio.create_subprocess_exec(
-                *shlex.split(system_command),
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-            )
-            result_bytes, error_message_bytes = await proc.communicate()
-            result = result_bytes.decode()
-            error_message = error_message_bytes.decode()
-            job_ids = JOB_ID_RE.findall(result)
-            logger.debug("job_id: %s", job_ids)
-
-            if not job_ids:
-                await js.restart_or_drop(item, ds, system_command, result, error_message)
+            if not await _claim_item(item, ds):
                 continue
-
-            try:
-                job_id = int(job_ids[0])
-            except ValueError:
-                await js.restart_or_drop(item, ds, system_command, result, error_message)
-                continue
-
-            item.set_job_id(job_id)
-            await ds.validation_queue.put(item)
+            await _submit_item(item, ds)
         except Exception as e:
             await js.restart_or_drop(item, ds, error_message=str(e))
             await asyncio.sleep(js.perf.SLEEP_FOR_ERROR)
 
         await asyncio.sleep(js.perf.SLEEP_FOR_QSUB)
+
+
+async def qsub_array(ds: js.DataStructures) -> None:
+    """Submit jobs in batches, with each batch of similar jobs submitted as a SLURM job array.
+
+    Items are collected from `qsub_queue` for up to `config.QSUB_ARRAY_WINDOW` seconds
+    and grouped by `job_type` and `run_type` (which determine `QSUB_OPTIONS`)
+    and by `dependency_job_ids`.
+    """
+    while True:
+        items = await js.get_batch(
+            ds.qsub_queue, config.QSUB_ARRAY_MAX_SIZE, config.QSUB_ARRAY_WINDOW
+        )
+        logger.debug("qsub_array (%s items)", len(items))
+
+        groups: Dict[Tuple[str, str, Tuple[str, ...]], List[js.Item]] = {}
+        claim_failed = False
+        for item in items:
+            try:
+                if not await _claim_item(item, ds):
+                    continue
+            except Exception as e:
+                await js.restart_or_drop(item, ds, error_message=str(e))
+                claim_failed = True
+                continue
+            key = (item.args["job_type"], item.run_type, tuple(item.dependency_job_ids))
+            groups.setdefault(key, []).append(item)
+        if claim_failed:
+            await asyncio.sleep(js.perf.SLEEP_FOR_ERROR)
+
+        for group in groups.values():
+            try:
+                if len(group) == 1:
+                    await _submit_item(group[0], ds)
+                else:
+                    await _submit_array(group, ds)
+            except Exception as e:
+                for item in group:
+                    await js.restart_or_drop(item, ds, error_message=str(e))
+                await asyncio.sleep(js.perf.SLEEP_FOR_ERROR)
+
+            await asyncio.sleep(js.perf.SLEEP_FOR_QSUB)
+
+
+async def _claim_item(item: js.Item, ds: js.DataStructures) -> bool:
+    """Return `True` if `item` needs to be submitted, acquiring its lock."""
+    if item.run_type in ["sequence", "model"]:
+        await js.lookup_precalculated([item.unique_id], ds)
+    if item.run_type in ["sequence", "model"] and (
+        item.unique_id in ds.precalculated_cache or item.unique_id in ds.precalculated
+    ):
+        await _skip_calculated_item(item, ds)
+        return False
+
+    if config.QSUB_USE_DEPENDENCIES and item.run_type == "mutations":
+        if not all(js.check_prereq_submitted(prereq, ds) for prereq in item.prereqs):
+            logger.debug("Prereqs for item '%s' are no longer running.", item.unique_id)
+            await js.wait_for_prereqs(item, ds)
+            return False
+        item.dependency_job_ids = [
+            ds.prereq_job_ids[prereq] for prereq in item.prereqs if prereq in ds.prereq_job_ids
+        ]
+
+    # Leases are owned by the item, so that they are taken over after a restart
+    if not await js.locks.manager.acquire(item.unique_id, item.item_id):
+        # Identical items are coalesced by `attach_in_flight`, so the item is being calculated
+        # by another instance of the jobsubmitter (or its lease was left behind by a crash),
+        # and we retry until the lease is released or expires
+        logger.debug("Item '%s' is locked by someone else. Waiting...", item.unique_id)
+        item.waiting_for_lock = True
+        item.waited_for_lock = True
+        await ds.pre_qsub_queue.put(item)
+        return False
+
+    # The item may have been calculated since it was checked above
+    # (e.g. by the holder of the lock that we were waiting for)
+    if await _check_calculated(item, ds):
+        await js.locks.manager.release(item.unique_id)
+        await _skip_calculated_item(item, ds)
+        return False
+
+    # Clear finished locks left over from previous runs, so that they are not mistaken
+    # for the result of this run
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(
+        None, _remove_files, [item.finished_lock_path, item.finished_lock_path + ".failed"]
+    )
+
+    if item.run_type in ["sequence", "model"]:
+        ds.failed_prereqs.discard(item.unique_id)
+
+    return True
+
+
+async def _check_calculated(item: js.Item, ds: js.DataStructures) -> bool:
+    """Return `True` if `item` is found in the database of calculated items."""
+    if item.run_type in ["sequence", "model"]:
+        await js.lookup_precalculated([item.unique_id], ds, force=True)
+        return item.unique_id in ds.precalculated
+    # Mutations are looked up one at a time, so we only do it if someone else could have
+    # calculated the mutation while the item was waiting for its lock
+    return item.waited_for_lock and await js.check_mutations_calculated(item)
+
+
+async def _skip_calculated_item(item: js.Item, ds: js.DataStructures) -> None:
+    logger.debug("Item '%s' already calculated. Skipping...", item.unique_id)
+    if item.run_type in ["sequence", "model"]:
+        js.transition(item, js.journal.DONE)
+        await js.resolve_item(item, ds)
+        await js.release_dependents(item.unique_id, ds)
+    else:
+        js.schedule_finalize_mutation(item, ds)
+
+
+def _remove_files(paths: List[str]) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+async def _set_submitted(item: js.Item, ds: js.DataStructures) -> None:
+    js.transition(item, js.journal.SUBMITTED)
+    await ds.validation_queue.put(item)
+    if item.run_type in ["sequence", "model"]:
+        ds.prereq_job_ids[item.unique_id] = item.slurm_job_id
+        if config.QSUB_USE_DEPENDENCIES:
+            await js.release_dependents(item.unique_id, ds)
+
+
+async def _submit_item(item: js.Item, ds: js.DataStructures) -> None:
+    system_command = create_qsub_system_command(item)
+    logger.debug("Running system command: %s", system_command)
+    with js.tracing.item_span([item], "sbatch"):
+        job_id, result, error_message = await _run_sbatch(system_command)
+
+    if job_id is None:
+        await js.restart_or_drop(
+            item, ds, js.ssh.pool.format_command(system_command), result, error_message
+        )
+        return
+
+    item.set_job_id(job_id)
+    await _set_submitted(item, ds)
+
+
+async def _submit_array(items: List[js.Item], ds: js.DataStructures) -> None:
+    loop = asyncio.get_running_loop()
+    task_file = op.join(config.ARRAY_TASKS_DIR, f"{uuid.uuid4().hex}.sh")
+    await loop.run_in_executor(None, _write_array_task_file, task_file, items)
+
+    system_command = create_qsub_array_system_command(items, task_file)
+    logger.debug("Running system command: %s", system_command)
+    job_id = None
+    try:
+        with js.tracing.item_span(items, "sbatch"):
+            job_id, result, error_message = await _run_sbatch(system_command)
+    finally:
+        if job_id is None:
+            await loop.run_in_executor(None, _remove_files, [task_file])
+
+    if job_id is None:
+        for item in items:
+            await js.restart_or_drop(
+                item, ds, js.ssh.pool.format_command(system_command), result, error_message
+            )
+        return
+
+    for array_task_id, item in enumerate(items):
+        item.set_job_id(job_id, array_task_id)
+        await _set_submitted(item, ds)
+    ds.array_task_files[job_id] = task_file
+
+
+async def cleanup_array_task_files(ds: js.DataStructures) -> None:
+    """Remove task files of job arrays which no longer have any items waiting to be validated.
+
+    Items of a job array stay in `validation_queue` until their task has finished (or has been
+    cancelled), after which the task file is not needed anymore. Task files which are not
+    tracked in `ds.array_task_files` (e.g. because the jobsubmitter was restarted) are removed
+    once they are older than `JOB_TIMEOUT`.
+    """
+    active_job_ids = {item.job_id for item in list(ds.validation_queue._queue)}
+    task_files = [
+        ds.array_task_files.pop(job_id)
+        for job_id in list(ds.array_task_files)
+        if job_id not in active_job_ids
+    ]
+    loop = asyncio.get_running_loop()
+    task_files += await loop.run_in_executor(
+        None, _find_expired_task_files, set(ds.array_task_files.values())
+    )
+    if task_files:
+        logger.debug("Removing %s array task files.", len(task_files))
+        await loop.run_in_executor(None, _remove_files, task_files)
+
+
+def _find_expired_task_files(active_task_files: Set[str]) -> List[str]:
+    cutoff = time.time() - js.perf.JOB_TIMEOUT
+    try:
+        with os.scandir(config.ARRAY_TASKS_DIR) as entries:
+            return [
+                entry.path
+                for entry in entries
+                if entry.path not in active_task_files and entry.stat().st_mtime < cutoff
+            ]
+    except FileNotFoundError:
+        return []
+
+
+async def _run_sbatch(system_command: str) -> Tuple[Optional[int], str, str]:
+    result, error_message, _ = await js.ssh.pool.run(system_command)
+    job_ids = JOB_ID_RE.findall(result)
+    logger.debug("job_id: %s", job_ids)
+    job_id = int(job_ids[0]) if job_ids else None
+    return job_id, result, error_message
@@ -0,0 +1,157 @@
+import logging
+import os
+import os.path as op
+from contextlib import contextmanager
+from typing import Any, Iterable, Iterator, Optional
+
+from elaspic_rest_api import config
+from elaspic_rest_api import jobsubmitter as js
+
+try:
+    from opentelemetry import trace
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+except ImportError:
+    trace = None
+else:
+
+    class FileSpanExporter(ConsoleSpanExporter):
+        """Append spans to `path` as JSON lines, closing the file on `shutdown`."""
+
+        def __init__(self, path: str) -> None:
+            super().__init__(
+                out=open(path, "at"), formatter=lambda span: span.to_json(indent=None) + "\n"
+            )
+
+        def shutdown(self) -> None:
+            super().shutdown()
+            self.out.close()
+
+
+logger = logging.getLogger(__name__)
+
+#: Tracer used to create item spans (`None` if tracing is disabled)
+tracer: Optional[Any] = None
+_provider: Optional[Any] = None
+
+
+def setup_tracing(exporter: Optional[str] = None, sample_rate: Optional[float] = None) -> None:
+    """Start exporting the spans of a sample of items.
+
+    Args:
+        exporter: Where to send spans ("otlp", "file" or "" to disable tracing).
+            Defaults to `config.TRACES_EXPORTER`.
+        sample_rate: Fraction of items that are traced. Defaults to `config.TRACES_SAMPLE_RATE`.
+    """
+    global tracer, _provider
+
+    exporter = config.TRACES_EXPORTER if exporter is None else exporter
+    sample_rate = config.TRACES_SAMPLE_RATE if sample_rate is None else sample_rate
+    if not exporter or sample_rate <= 0:
+        return
+    if trace is None:
+        logger.error("Tracing requires the 'opentelemetry-sdk' package.")
+        return
+
+    if exporter == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            logger.error("Exporter 'otlp' requires the 'opentelemetry-exporter-otlp' package.")
+            return
+        # Endpoint and headers are configured using the standard `OTEL_EXPORTER_OTLP_*` variables
+        span_exporter = OTLPSpanExporter()
+    elif exporter == "file":
+        os.makedirs(op.dirname(op.abspath(config.TRACES_FILE)), exist_ok=True)
+        span_exporter = FileSpanExporter(config.TRACES_FILE)
+    else:
+        logger.error("Unknown traces exporter '%s'.", exporter)
+        return
+
+    _provider = TracerProvider(sampler=ParentBased(TraceIdRatioBased(sample_rate)))
+    _provider.add_span_processor(BatchSpanProcessor(span_exporter))
+    tracer = _provider.get_tracer(__name__)
+
+
+def shutdown_tracing() -> None:
+    """Export the remaining spans and stop tracing."""
+    global tracer, _provider
+
+    if _provider is not None:
+        _provider.shutdown()
+    tracer = None
+    _provider = None
+
+
+def start_item_trace(item: js.Item, parse_start_time: float, parse_end_time: float) -> None:
+    """Start the root span of `item` if the item is sampled, starting with the "parse" span."""
+    if tracer is None:
+        return
+    span = tracer.start_span(
+        item.run_type,
+        start_time=_to_ns(parse_start_time),
+        attributes={
+            "elaspic.unique_id": item.unique_id,
+            "elaspic.item_id": item.item_id,
+            "elaspic.webserver_job_id": str(item.args.get("webserver_job_id") or ""),
+        },
+    )
+    if span.is_recording():
+        item.trace_span = span
+        add_item_span(item, "parse", parse_start_time, parse_end_time)
+
+
+def set_stage_span(item: js.Item, stage: Optional[str], time: float) -> None:
+    """End the span of the current stage of `item` and start a span for `stage`.
+
+    The trace of `item` is finished if `stage` is `None`.
+    """
+    if item.trace_span is None:
+        return
+    if item.stage_span is not None:
+        item.stage_span.end(end_time=_to_ns(time))
+        item.stage_span = None
+    if stage is None:
+        item.trace_span.set_attribute("elaspic.state", str(item.state))
+        item.trace_span.end(end_time=_to_ns(time))
+        item.trace_span = None
+    else:
+        item.stage_span = _start_child_span(item, stage, time)
+
+
+def add_item_span(item: js.Item, name: str, start_time: float, end_time: float) -> None:
+    """Add a span covering an operation that has already finished."""
+    if item.trace_span is not None:
+        _start_child_span(item, name, start_time).end(end_time=_to_ns(end_time))
+
+
+@contextmanager
+def item_span(items: Iterable[js.Item], name: str) -> Iterator[None]:
+    """Add a span for the operation performed inside the context to each sampled item."""
+    spans = [_start_child_span(item, name) for item in items if item.trace_span is not None]
+    try:
+        yield
+    except Exception as e:
+        for span in spans:
+            span.record_exception(e)
+        raise
+    finally:
+        for span in spans:
+            span.end()
+
+
+def _start_child_span(item: js.Item, name: str, start_time: Optional[float] = None):
+    if tracer is None:
+        # Tracing was stopped while the item was being traced
+        return trace.INVALID_SPAN
+    parent = item.stage_span if item.stage_span is not None else item.trace_span
+    return tracer.start_span(
+        name,
+        context=trace.set_span_in_context(parent),
+        start_time=None if start_time is None else _to_ns(start_time),
+    )
+
+
+def _to_ns(time: float) -> int:
+    return int(time * 1e9)
@@ -1,11 +1,16 @@
 import os.path as op
 import time
-from asyncio import Queue
+import uuid
 from dataclasses import dataclass, field
-from typing import Dict, List, NamedTuple, Optional, Set, TypedDict
+from functools import partial
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple, TypedDict
 
 from elaspic_rest_api import config
+from elaspic_rest_api.jobsubmitter import metrics
 from elaspic_rest_api.jobsubmitter.elaspic2types import MutationInfo
+from elaspic_rest_api.jobsubmitter.job_index import JobIndex
+from elaspic_rest_api.jobsubmitter.metrics import StageQueue
+from elaspic_rest_api.jobsubmitter.precalculated_index import PrecalculatedIndex
 
 
 class JobKey(NamedTuple):
@@ -16,27 +21,76 @@ class JobKey(NamedTuple):
 @dataclass
 class DataStructures:
     # Data structures
-    pre_qsub_queue: Queue = field(default_factory=Queue)
-    qsub_queue: Queue = field(default_factory=Queue)
-    validation_queue: Queue = field(default_factory=Queue)
-    elaspic2_pending_queue: Queue = field(default_factory=Queue)
-    elaspic2_running_queue: Queue = field(default_factory=Queue)
+    # (items put into each queue move to the corresponding stage in `metrics.stage_latency`)
+    pre_qsub_queue: StageQueue = field(default_factory=partial(StageQueue, metrics.PRE_QSUB))
+    qsub_queue: StageQueue = field(default_factory=partial(StageQueue, metrics.QSUB))
+    validation_queue: StageQueue = field(default_factory=partial(StageQueue, metrics.VALIDATION))
+    elaspic2_pending_queue: StageQueue = field(default_factory=partial(StageQueue, metrics.EL2))
+    elaspic2_running_queue: StageQueue = field(default_factory=partial(StageQueue, metrics.EL2))
+
+    #: Items which are being calculated, indexed by `unique_id`
+    #: (identical items submitted later subscribe to these items instead of being calculated again)
+    in_flight: Dict[str, "Item"] = field(default_factory=dict)
+    #: Number of mutation items in `in_flight` (see `add_in_flight`)
+    num_in_flight_mutations: int = 0
 
     #: Mutation jobs that are being monitored for completion
     #: {(job_id, job_email): {unique_id_1, unique_id_2, ...}}
     #: Example: {JobKey(job_id=7, job_email=None): {"database.mutations.P0A921.A243R", ...}}
     monitored_jobs: Dict[JobKey, Set] = field(default_factory=dict)
 
+    #: Mutation items of each webserver job, used to answer `/jobs` requests
+    job_index: JobIndex = field(default_factory=JobIndex)
+
     #: Persisted precalculated data
-    #: Mapping from `unique_id` to `job_id`
-    #: Example: {'database.model.68b8fe': 3880076, 'local.model.7a2dd6': 7625616, ...}
-    precalculated: Dict[str, int] = field(default_factory=dict)
+    #: Set of `unique_id`s (job ids are only kept in `precalculated_cache`)
+    #: Example: {'database.model.68b8fe', 'local.model.7a2dd6', ...}
+    precalculated: PrecalculatedIndex = field(
+        default_factory=lambda: PrecalculatedIndex(
+            lru_size=config.PRECALCULATED_LRU_SIZE,
+            bloom_bits_per_key=config.PRECALCULATED_BLOOM_BITS_PER_KEY,
+        )
+    )
 
     #: In-memory precalculated data (has not been persisted yet)
     #: Mapping from `unique_id` to `job_id`
     #: Example: {'database.model.68b8fe': 3880076, 'local.model.7a2dd6': 7625616, ...}
     precalculated_cache: Dict[str, int] = field(default_factory=dict)
 
+    #: Whether `precalculated` has been fully loaded from the database
+    precalculated_loaded: bool = False
+
+    #: Largest `seq` loaded into `precalculated` (used to load new rows only)
+    precalculated_last_seq: int = 0
+
+    #: Items waiting in `pre_qsub_queue`, indexed by the `unique_id` of each prereq
+    #: that has not been calculated yet
+    #: Example: {'database.model.P21397': {<Item database.mutations.P21397.G49V>, ...}, ...}
+    prereq_dependents: Dict[str, Set["Item"]] = field(default_factory=dict)
+
+    #: Number of items waiting for their prereqs (items can be in several `prereq_dependents` sets)
+    num_waiting_for_prereqs: int = 0
+
+    #: SLURM job ids of sequence and model jobs which have been submitted but not validated yet
+    #: Example: {'database.model.P21397': '3880076', 'database.sequence.P21397': '3880080_2', ...}
+    prereq_job_ids: Dict[str, str] = field(default_factory=dict)
+
+    #: Task files of job arrays whose items are still being validated, indexed by SLURM job id
+    #: (see `cleanup_array_task_files`)
+    array_task_files: Dict[int, str] = field(default_factory=dict)
+
+    #: Prereqs which could not be calculated (cleared when they are resubmitted)
+    failed_prereqs: Set[str] = field(default_factory=set)
+
+    #: Mutation items which will be finalized by the next run of `finalize_mutations_loop`
+    mutations_to_finalize: List["Item"] = field(default_factory=list)
+
+    #: Items with ELASPIC2 scores that have not been written to the database yet,
+    #: together with their scores and the time when they were added
+    elaspic2_score_buffer: List[Tuple["Item", List[MutationInfo], float]] = field(
+        default_factory=list
+    )
+
 
 class Args(TypedDict):
     job_id: int
@@ -53,8 +107,21 @@ class Args(TypedDict):
 
 
 class Item:
+    #: Identifier of this item in the journal
+    item_id: str
+    #: Most recent state recorded using `js.transition` (e.g. "queued", "submitted", ...)
+    state: Optional[str]
     #: SLURM job id of the currently-running job
     job_id: Optional[int]
+    #: Index of the task within the SLURM job array (if submitted as part of a job array)
+    array_task_id: Optional[int]
+
+    #: Stage that the item is currently in (see `metrics.enter_stage`)
+    stage: Optional[str]
+    stage_start_time: float
+    #: Root span of the item and span of its current stage (`None` if the item is not traced)
+    trace_span: Optional[Any]
+    stage_span: Optional[Any]
 
     init_time: float
     start_time: Optional[float]
@@ -64,10 +131,24 @@ class Item:
         self.run_type = run_type
         self.args = args
         self.init_time = time.time()
+        self.item_id = uuid.uuid4().hex
+        self.state = None
+        self.stage = None
+        self.stage_start_time = self.init_time
+        self.trace_span = None
+        self.stage_span = None
         #
         self.qsub_tries = 0
+        self.waiting_for_prereqs = False
+        #: Whether the item is waiting for its lock to be released by someone else
+        self.waiting_for_lock = False
+        #: Whether the item has ever had to wait for its lock
+        self.waited_for_lock = False
         self.unique_id = get_unique_id(run_type, args)
-        self.lock_path = get_lock_path(run_type, args, finished=False)
+        #: Webserver jobs which are waiting for this item
+        self.job_keys: Set[JobKey] = set()
+        if args.get("webserver_job_id"):
+            self.job_keys.add(JobKey(args["webserver_job_id"], args.get("webserver_job_email")))
         self.finished_lock_path = get_lock_path(run_type, args, finished=True)
         self.prereqs = []
         if run_type == "mutations":
@@ -75,23 +156,40 @@ class Item:
                 "{job_type}.sequence.{protein_id}".format(**args),
                 "{job_type}.model.{protein_id}".format(**args),
             ]
+        #: SLURM job ids of prereqs that must finish successfully before this job can start
+        self.dependency_job_ids: List[str] = []
         #
         self.job_id = None
+        self.array_task_id = None
         self.start_time = None
         self.stdout_path = None  # need_job_id
         self.stderr_path = None  # need job_id
         # ELASPIC2
         self.el2_mutation_info_list: List[MutationInfo] = []
-
-    def set_job_id(self, job_id: int) -> None:
+        #: Number of times submitting ELASPIC2 jobs for this item failed with a transient error
+        self.el2_tries = 0
+        #: Number of consecutive times collecting ELASPIC2 results for this item failed
+        self.el2_collect_failures = 0
+        #: Whether ELASPIC2 scores have been collected for this item
+        self.el2_scored = False
+
+    def set_job_id(self, job_id: int, array_task_id: Optional[int] = None) -> None:
         self.job_id = job_id
+        self.array_task_id = array_task_id
         self.start_time = time.time()
         self.stdout_path, self.stderr_path = get_log_paths(
-            self.args["job_type"], self.job_id, self.args["protein_id"]
+            self.args["job_type"], self.slurm_job_id, self.args["protein_id"]
         )
 
+    @property
+    def slurm_job_id(self) -> str:
+        """Job id as reported by `squeue` (`<job_id>_<array_task_id>` for job array tasks)."""
+        if self.array_task_id is None:
+            return str(self.job_id)
+        return f"{self.job_id}_{self.array_task_id}"
+
     def __str__(self) -> str:
-        return f"{self.job_id} {self.unique_id} {self.qsub_tries}"
+        return f"{self.slurm_job_id} {self.unique_id} {self.qsub_tries}"
 
 
 def get_unique_id(run_type: str, args: Args) -> str:
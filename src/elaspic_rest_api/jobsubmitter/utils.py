@@ -1,8 +1,8 @@
+import asyncio
 import logging
 import time
-from typing import Dict
-
-import aiofiles
+from asyncio import Queue
+from typing import Dict, List
 
 from elaspic_rest_api import jobsubmitter as js
 
@@ -16,6 +16,16 @@ async def restart_or_drop(
     result="unk",
     error_message="unk",
 ) -> None:
+    if item.run_type in ["sequence", "model"]:
+        ds.prereq_job_ids.pop(item.unique_id, None)
+
+    if item.dependency_job_ids and not js.check_prereqs(
+        item.prereqs, ds.precalculated, ds.precalculated_cache
+    ):
+        # The job did not run because one of its prereqs failed
+        await _reset_after_failed_dependency(item, ds, error_message)
+        return
+
     restarting = item.qsub_tries < 5 and (
         item.start_time is None or abs(time.time() - item.start_time) < js.perf.JOB_TIMEOUT
     )
@@ -34,22 +44,80 @@ async def restart_or_drop(
     if not restarting:
         js.email.send_admin_email(item, system_command, restarting)
 
-    try:
-        await aiofiles.os.remove(item.lock_path)
-    except FileNotFoundError:
-        pass
+    await js.locks.manager.release(item.unique_id)
 
     if restarting:
         item.qsub_tries += 1
+        js.transition(item, js.journal.QUEUED)
         await ds.qsub_queue.put(item)
     else:
-        await remove_from_monitored(item, ds.monitored_jobs)
+        await resolve_item(item, ds)
         await js.set_db_errors([item])
+        if item.run_type in ["sequence", "model"]:
+            await js.fail_dependents(item.unique_id, ds)
+
+
+async def _reset_after_failed_dependency(
+    item: js.Item, ds: js.DataStructures, error_message: str
+) -> None:
+    """Wait for prereqs to be recalculated, or fail `item` if they could not be calculated."""
+    item.dependency_job_ids = []
+
+    await js.locks.manager.release(item.unique_id)
+
+    if any(prereq in ds.failed_prereqs for prereq in item.prereqs):
+        logger.error(
+            "Prereqs for job '%s' could not be calculated; cancelling (error message: %s).",
+            item.unique_id,
+            error_message,
+        )
+        await resolve_item(item, ds)
+        await js.set_db_errors([item])
+    else:
+        logger.info("Prereqs for job '%s' are being restarted; waiting...", item.unique_id)
+        js.transition(item, js.journal.QUEUED)
+        await js.wait_for_prereqs(item, ds)
+
+
+def attach_in_flight(item: js.Item, ds: js.DataStructures) -> bool:
+    """Register `item` as being calculated, unless an identical item is already being calculated.
+
+    Returns:
+        `True` if the webserver jobs of `item` were subscribed to an identical item instead,
+        in which case `item` itself should not be processed any further.
+    """
+    in_flight_item = ds.in_flight.get(item.unique_id)
+    if in_flight_item is None or in_flight_item is item:
+        add_in_flight(item, ds)
+        return False
+    logger.debug("Item '%s' is already being calculated; subscribing.", item.unique_id)
+    if not item.job_keys <= in_flight_item.job_keys:
+        in_flight_item.job_keys |= item.job_keys
+        if in_flight_item.state is not None:
+            # Record the new subscribers in the journal
+            js.transition(in_flight_item, in_flight_item.state)
+    return True
+
+
+def add_in_flight(item: js.Item, ds: js.DataStructures) -> None:
+    """Add `item` to `ds.in_flight`, replacing any identical item."""
+    if item.unique_id not in ds.in_flight and item.run_type == "mutations":
+        ds.num_in_flight_mutations += 1
+    ds.in_flight[item.unique_id] = item
+
+
+async def resolve_item(item: js.Item, ds: js.DataStructures) -> None:
+    """Stop tracking `item`, completing it for every webserver job subscribed to it."""
+    if ds.in_flight.get(item.unique_id) is item:
+        del ds.in_flight[item.unique_id]
+        if item.run_type == "mutations":
+            ds.num_in_flight_mutations -= 1
+        js.admission.controller.drain_rate.record()
+    await remove_from_monitored(item, ds.monitored_jobs)
 
 
 async def remove_from_monitored(item: js.Item, monitored_jobs: Dict):
-    if item.args.get("webserver_job_id"):
-        job_key = (item.args.get("webserver_job_id"), item.args.get("webserver_job_email"))
+    for job_key in item.job_keys:
         logger.debug(
             "Removing unique_id '%s' from monitored_jobs with key '%s...", item.unique_id, job_key
         )
@@ -58,3 +126,22 @@ async def remove_from_monitored(item: js.Item, monitored_jobs: Dict):
             logger.debug("Removed!")
         except KeyError:
             logger.debug("Key does not exist!")
+
+
+async def get_batch(queue: Queue, max_size: int, window: float) -> List[js.Item]:
+    """Wait for the first item in `queue` and collect more items for up to `window` seconds."""
+    loop = asyncio.get_running_loop()
+    items = [await queue.get()]
+    deadline = loop.time() + window
+    while len(items) < max_size:
+        if not queue.empty():
+            items.append(queue.get_nowait())
+            continue
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+            break
+        try:
+            items.append(await asyncio.wait_for(queue.get(), timeout))
+        except asyncio.TimeoutError:
+            break
+    return items
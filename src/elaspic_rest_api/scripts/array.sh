@@ -0,0 +1,17 @@
+#!/bin/bash
+# #SBATCH --time=24:00:00
+# #SBATCH --nodes=1
+# #SBATCH --ntasks-per-node=1
+# #SBATCH --mem=0
+#SBATCH --partition kimprod
+#SBATCH --job-name=elaspic-array
+#SBATCH --export=ALL
+#SBATCH --output=/home/kimlab1/jobsubmitter/pbs-output/elaspic-array-%N-%A_%a.out
+#SBATCH --error=/home/kimlab1/jobsubmitter/pbs-output/elaspic-array-%N-%A_%a.err
+set -e
+
+# Load variables specific to this array task (`lock_filename_finished`, `protein_id`, `mutations`, ...)
+source "${task_file}"
+
+export log_id="${SLURM_ARRAY_JOB_ID}_${SLURM_ARRAY_TASK_ID}"
+exec bash "${SCRIPTS_DIR}/${job_type}.sh"
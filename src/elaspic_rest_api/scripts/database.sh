@@ -13,14 +13,19 @@
 set -ex
 
 function finish {
-  echo "Moving lock file to the finished folder..."
-  mv -f "${lock_filename}" "${lock_filename_finished}"
+  exit_code=$?
+  echo "Creating lock file in the finished folder..."
+  if [[ ${exit_code} -eq 0 ]]; then
+    touch "${lock_filename_finished}"
+  else
+    touch "${lock_filename_finished}.failed"
+  fi
 }
 trap finish INT TERM EXIT
 
 cd "/home/kimlab1/database_data/elaspic"
 mkdir -p "./pbs-output"
-exec >"./pbs-output/${SLURM_JOB_ID}.out" 2>"./pbs-output/${SLURM_JOB_ID}.err"
+exec >"./pbs-output/${log_id:-${SLURM_JOB_ID}}.out" 2>"./pbs-output/${log_id:-${SLURM_JOB_ID}}.err"
 
 echo `hostname`
 # source activate elaspic
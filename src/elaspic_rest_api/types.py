@@ -11,6 +11,11 @@ class Mutations(BaseModel):
     uniprot_domain_pair_ids: Optional[str]
 
 
+class JobsIn(BaseModel):
+    api_token: str
+    job_ids: List[str]
+
+
 class DataIn(BaseModel):
     api_token: str
     job_id: str
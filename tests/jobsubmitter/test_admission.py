@@ -0,0 +1,130 @@
+from unittest.mock import patch
+
+import pytest
+
+from elaspic_rest_api import jobsubmitter as js
+from elaspic_rest_api.jobsubmitter.admission import (
+    AdmissionController,
+    AdmissionRejected,
+    DrainRate,
+    get_num_mutations,
+)
+
+
+def _make_controller(**kwargs) -> AdmissionController:
+    return AdmissionController(
+        **{
+            "max_queued_items": 0,
+            "token_max_items": 0,
+            "token_rate": 0,
+            "token_burst": 0,
+            "max_retry_after": 3600,
+            **kwargs,
+        }
+    )
+
+
+def test_drain_rate():
+    with patch("elaspic_rest_api.jobsubmitter.admission.time.time", return_value=1000.0):
+        drain_rate = DrainRate(window=60)
+        drain_rate.record(30)
+    with patch("elaspic_rest_api.jobsubmitter.admission.time.time", return_value=1010.0):
+        assert drain_rate.rate == 3
+    with patch("elaspic_rest_api.jobsubmitter.admission.time.time", return_value=1100.0):
+        assert drain_rate.rate == 0
+
+
+@pytest.mark.asyncio
+async def test_admission_max_queued_items(data_in):
+    num_items = get_num_mutations(data_in)
+    controller = _make_controller(max_queued_items=2 * num_items - 1)
+    ds = js.DataStructures()
+
+    with patch("elaspic_rest_api.jobsubmitter.admission.controller", controller):
+        assert controller.admit("token", data_in, ds) == num_items
+        # Capacity is reserved until the job has been queued
+        with pytest.raises(AdmissionRejected) as exc_info:
+            controller.admit("token", data_in, ds)
+        assert exc_info.value.reason == "max_queued_items"
+        assert exc_info.value.retry_after == 3600
+        await js.submit_admitted_job(data_in, ds, "token", num_items)
+
+    assert controller.pending_items == 0
+    # Sequence and model items are not counted, since submissions are counted in mutations
+    num_mutations = sum(item.run_type == "mutations" for item in ds.in_flight.values())
+    assert controller.get_queued_items(ds) == ds.num_in_flight_mutations == num_mutations
+    controller.drain_rate.record(len(ds.in_flight))
+    with pytest.raises(AdmissionRejected) as exc_info:
+        controller.admit("token", data_in, ds)
+    assert 1 <= exc_info.value.retry_after < 3600
+    assert controller.num_rejected == {"max_queued_items": 2}
+
+    # Submissions which can never be accepted
+    large_data_in = data_in.copy(
+        update={"mutations": [data_in.mutations[0].copy(update={"mutations": "G1A,G2A"})]}
+    )
+    with pytest.raises(AdmissionRejected) as exc_info:
+        _make_controller(max_queued_items=1).admit("token", large_data_in, ds)
+    assert exc_info.value.retry_after == 0
+
+
+@pytest.mark.asyncio
+async def test_admission_token_max_items(data_in):
+    num_items = get_num_mutations(data_in)
+    controller = _make_controller(token_max_items=num_items)
+    ds = js.DataStructures()
+
+    with patch("elaspic_rest_api.jobsubmitter.admission.controller", controller):
+        await js.submit_admitted_job(data_in, ds, "token", controller.admit("token", data_in, ds))
+    with pytest.raises(AdmissionRejected) as exc_info:
+        controller.admit("token", data_in, ds)
+    assert exc_info.value.reason == "token_max_items"
+    # Other tokens have their own quota
+    controller.admit("other_token", data_in, ds)
+
+    # Quotas are freed as mutations finish
+    for item in list(ds.in_flight.values()):
+        await js.resolve_item(item, ds)
+    controller.admit("token", data_in, ds)
+
+
+def test_admission_token_rate(data_in):
+    num_items = get_num_mutations(data_in)
+    controller = _make_controller(token_rate=1, token_burst=num_items)
+    ds = js.DataStructures()
+
+    with patch("elaspic_rest_api.jobsubmitter.admission.time.time", return_value=1000.0):
+        controller.admit("token", data_in, ds)
+        with pytest.raises(AdmissionRejected) as exc_info:
+            controller.admit("token", data_in, ds)
+        assert exc_info.value.reason == "token_rate"
+        assert exc_info.value.retry_after == num_items
+    with patch(
+        "elaspic_rest_api.jobsubmitter.admission.time.time", return_value=1000.0 + num_items
+    ):
+        controller.admit("token", data_in, ds)
+
+
+@pytest.mark.asyncio
+async def test_admission_stream(data_in):
+    controller = _make_controller(token_max_items=2)
+    ds = js.DataStructures()
+
+    async def iter_chunks():
+        for i in range(3):
+            mutations = data_in.mutations[0].copy(update={"mutations": f"G{i + 1}A"})
+            yield mutations.json().encode() + b"\n"
+
+    with patch("elaspic_rest_api.jobsubmitter.admission.controller", controller), patch(
+        "elaspic_rest_api.config.STREAM_BATCH_SIZE", 1
+    ):
+        result = await js.submit_job_stream(
+            iter_chunks(), data_in.copy(update={"mutations": []}), ds
+        )
+
+    # The stream is stopped at the first batch which exceeds the limits
+    assert result["rejected"].reason == "token_max_items"
+    assert result["resume_line"] == 3
+    assert result["num_mutations"] == 2
+    assert controller.pending_items == 0
+    assert controller.get_token_items(data_in.api_token, ds) == 2
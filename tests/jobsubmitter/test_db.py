@@ -1,3 +1,6 @@
+import asyncio
+from unittest.mock import patch
+
 import pytest
 
 from elaspic_rest_api.jobsubmitter import db
@@ -11,3 +14,45 @@ async def test_db(DBConnection):
             await cur.execute("SELECT 42;")
             (r,) = await cur.fetchone()
             assert r == 42
+
+
+class MockPool:
+    def __init__(self):
+        self.closed = False
+
+    async def acquire(self):
+        return "conn"
+
+    def release(self, conn):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_db_pool_stats_and_close():
+    pool = MockPool()
+
+    async def create_pool(**kwargs):
+        assert kwargs["cursorclass"] is db.TimedCursor
+        return pool
+
+    with patch("elaspic_rest_api.jobsubmitter.db.aiomysql.create_pool", create_pool):
+        stats = db.pool_stats.setdefault(db.WDBConnection.db_name, db.PoolStats())
+        acquire_count = stats.acquire_count
+        async with db.WDBConnection() as conn:
+            assert conn == "conn"
+            assert stats.in_use == 1
+        async with db.WDBConnection():
+            pass
+
+    assert stats.acquire_count == acquire_count + 2
+    assert stats.in_use == 0
+
+    await db.close_pools()
+    assert pool.closed
+    assert not any(key[1] is asyncio.get_running_loop() for key in db._DBConnection.pools)
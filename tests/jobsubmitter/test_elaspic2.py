@@ -1,3 +1,4 @@
+import asyncio
 from unittest.mock import patch
 from urllib.parse import urljoin
 
@@ -10,10 +11,9 @@ from elaspic_rest_api.utils import mock_await, return_on_call
 
 
 @pytest.mark.asyncio
-@patch("elaspic_rest_api.jobsubmitter.elaspic2.aiohttp.ClientSession.delete", mock_await)
 @patch("elaspic_rest_api.jobsubmitter.elaspic2.js.remove_from_monitored", mock_await)
 @patch("elaspic_rest_api.jobsubmitter.elaspic2.js.finalize_mutation", mock_await)
-@patch("elaspic_rest_api.jobsubmitter.elaspic2.update_mutation_scores")
+@patch("elaspic_rest_api.jobsubmitter.elaspic2.update_mutation_scores", side_effect=mock_await)
 async def test_elaspic2_collect_loop(mock_update_mutation_scores):
     el2_web_url = urljoin(config.ELASPIC2_URL, "jobs/229764931")
 
@@ -68,6 +68,327 @@ async def test_elaspic2_collect_loop(mock_update_mutation_scores):
     with return_on_call("elaspic_rest_api.jobsubmitter.elaspic2.asyncio.sleep"):
         await js.elaspic2_collect_loop(ds)
 
+    assert len(ds.elaspic2_score_buffer) == 1
+    await js.flush_mutation_scores(ds)
+    assert not ds.elaspic2_score_buffer
     mock_update_mutation_scores.assert_called_once_with(
         item.args["job_type"], mutation_info_wscores_list
     )
+
+
+@pytest.mark.asyncio
+async def test_el2_collect_mutation_scores():
+    from elaspic_rest_api.jobsubmitter.elaspic2 import _el2_collect_mutation_scores
+
+    mutation_info_list = [
+        MutationInfo(
+            1,
+            structure_file="1MFG.pdb",
+            chain_id="A",
+            mutation=f"G{i}A",
+            protein_id="1mfg-local",
+            coi=COI.CORE,
+            el2_web_url=f"http://el2/jobs/{i // 2}",
+        )
+        for i in range(1, 7)
+    ]
+    item = js.Item(
+        run_type="mutations",
+        args={"job_id": "unk", "job_type": "database", "protein_id": "XXX", "mutations": "G1A"},
+    )
+    item.el2_mutation_info_list.extend(mutation_info_list)
+    requested_urls = []
+
+    async def mock_get_status(web_url):
+        requested_urls.append(web_url)
+        await asyncio.sleep(0.01)
+        return {"status": "success", "web_url": web_url + "/result"}
+
+    async def mock_get_result(web_url):
+        requested_urls.append(web_url)
+        job_id = int(web_url.split("/")[-2])
+        return [{"protbert_core": job_id, "proteinsolver_core": job_id, "el2core": job_id}]
+
+    with patch("elaspic_rest_api.jobsubmitter.elaspic2._el2_get_status", mock_get_status), patch(
+        "elaspic_rest_api.jobsubmitter.elaspic2._el2_get_result", mock_get_result
+    ):
+        mutation_scores = await _el2_collect_mutation_scores(item, asyncio.Semaphore(2), {})
+
+    assert [ms.mutation for ms in mutation_scores] == [mi.mutation for mi in mutation_info_list]
+    assert [ms.el2_score for ms in mutation_scores] == [0, 1, 1, 2, 2, 3]
+    # Each EL2 job is only polled once
+    assert len(requested_urls) == len(set(requested_urls)) == 8
+
+
+@pytest.mark.asyncio
+async def test_el2_collect_item_gives_up():
+    from elaspic_rest_api.jobsubmitter.elaspic2 import _el2_collect_item
+
+    item = js.Item(
+        run_type="mutations",
+        args={"job_id": "unk", "job_type": "database", "protein_id": "XXX", "mutations": "G1A"},
+    )
+    item.el2_mutation_info_list.append(
+        MutationInfo(
+            1,
+            structure_file="1MFG.pdb",
+            chain_id="A",
+            mutation="G1A",
+            protein_id="1mfg-local",
+            coi=COI.CORE,
+            el2_web_url="http://el2/jobs/1",
+        )
+    )
+    ds = js.DataStructures()
+    released_urls = []
+
+    async def mock_get_status(web_url):
+        return None
+
+    with patch("elaspic_rest_api.jobsubmitter.elaspic2._el2_get_status", mock_get_status), patch(
+        "elaspic_rest_api.jobsubmitter.elaspic2.config.EL2_COLLECT_MAX_FAILURES", 2
+    ), patch(
+        "elaspic_rest_api.jobsubmitter.elaspic2client.client.release",
+        lambda web_urls: released_urls.extend(web_urls),
+    ):
+        await _el2_collect_item(item, ds, asyncio.Semaphore(1), {})
+        assert ds.elaspic2_running_queue.get_nowait() is item
+        assert not ds.mutations_to_finalize
+
+        # The item is finalized without EL2 scores once it has failed too many times
+        await _el2_collect_item(item, ds, asyncio.Semaphore(1), {})
+        assert ds.elaspic2_running_queue.empty()
+        assert ds.mutations_to_finalize == [item]
+        assert released_urls == ["http://el2/jobs/1"]
+
+
+@pytest.mark.asyncio
+async def test_el2_submit_mutations():
+    from elaspic_rest_api.jobsubmitter.elaspic2 import _el2_submit_mutations
+
+    items = [
+        js.Item(
+            run_type="mutations",
+            args={"job_id": "unk", "job_type": "local", "protein_id": "XXX", "mutations": m},
+        )
+        for m in ["G1A", "G1C", "K2A"]
+    ]
+    mutations = []
+    for item in items:
+        item.el2_mutation_info_list = [
+            MutationInfo(
+                1,
+                structure_file="1MFG.pdb",
+                chain_id="A",
+                mutation=item.args["mutations"],
+                protein_id="XXX",
+                coi=coi,
+            )
+            for coi in COI
+        ]
+        for idx, coi in enumerate(COI):
+            protein_info = {
+                "protein_structure_url": "http://elaspic/1MFG.pdb",
+                "protein_sequence": "GK",
+                "mutations": item.args["mutations"],
+                **({"ligand_sequence": "AAA"} if coi == COI.INTERFACE else {}),
+            }
+            mutations.append((item, idx, protein_info))
+
+    protein_info_list = []
+
+    async def mock_create_job(protein_info):
+        protein_info_list.append(protein_info)
+        return {"web_url": f"http://el2/jobs/{len(protein_info_list)}"}
+
+    with patch("elaspic_rest_api.jobsubmitter.elaspic2.config.EL2_SUBMIT_MAX_MUTATIONS", 2), patch(
+        "elaspic_rest_api.jobsubmitter.elaspic2client.client.create_job", mock_create_job
+    ):
+        failed_items = await _el2_submit_mutations(mutations)
+
+    assert not failed_items
+    assert [pi["mutations"] for pi in protein_info_list] == ["G1A,G1C", "K2A", "G1A,G1C", "K2A"]
+    assert [mi.el2_web_url for mi in items[0].el2_mutation_info_list] == [
+        "http://el2/jobs/1",
+        "http://el2/jobs/3",
+    ]
+    assert [mi.el2_mutation for mi in items[2].el2_mutation_info_list] == ["K2A", "K2A"]
+
+
+def test_find_mutation_result():
+    from elaspic_rest_api.jobsubmitter.elaspic2 import _find_mutation_result
+
+    mutation_info = MutationInfo(
+        1, structure_file="1MFG.pdb", chain_id="A", mutation="G1C", protein_id="X", coi=COI.CORE
+    )
+    job_result = [{"mutation": "G1A", "el2core": 1}, {"mutation": "G1C", "el2core": 2}]
+    assert _find_mutation_result(mutation_info, job_result) is None
+    assert _find_mutation_result(mutation_info._replace(el2_mutation="G1C"), job_result) == {
+        "mutation": "G1C",
+        "el2core": 2,
+    }
+    assert _find_mutation_result(mutation_info, [{"el2core": 3}]) == {"el2core": 3}
+    assert _find_mutation_result(mutation_info, []) is None
+
+
+@pytest.mark.asyncio
+async def test_el2_extract_protein_info():
+    from concurrent.futures import ThreadPoolExecutor
+
+    from elaspic_rest_api.jobsubmitter.elaspic2 import _el2_extract_protein_info
+
+    items = [
+        js.Item(
+            run_type="mutations",
+            args={"job_id": "unk", "job_type": "local", "protein_id": "XXX", "mutations": m},
+        )
+        for m in ["G1A", "G1C", "K2A"]
+    ]
+    for item in items:
+        item.el2_mutation_info_list = [
+            MutationInfo(
+                1,
+                structure_file=structure_file,
+                chain_id="A",
+                mutation=item.args["mutations"],
+                protein_id="XXX",
+                coi=COI.CORE,
+            )
+            for structure_file in ["1MFG.pdb", "2MFG.pdb"]
+        ]
+    structure_files = []
+
+    def mock_extract_protein_info(mutation_info):
+        structure_files.append(mutation_info.structure_file)
+        if mutation_info.mutation == "K2A":
+            raise ValueError("Mutation does not match")
+        return {"mutations": mutation_info.mutation}
+
+    with patch(
+        "elaspic_rest_api.jobsubmitter.elaspic2.extract_protein_info", mock_extract_protein_info
+    ), ThreadPoolExecutor(2) as executor:
+        mutations, failed_items = await _el2_extract_protein_info(items, executor)
+
+    assert [(item.args["mutations"], idx) for item, idx, _ in mutations] == [
+        ("G1A", 0),
+        ("G1C", 0),
+        ("G1A", 1),
+        ("G1C", 1),
+    ]
+    assert list(failed_items) == [items[2]]
+    assert "ValueError" in str(failed_items[items[2]])
+    assert len(structure_files) == 6
+
+
+@pytest.mark.asyncio
+async def test_flush_mutation_scores():
+    ds = js.DataStructures()
+    items = [
+        js.Item(
+            run_type="mutations",
+            args={"job_id": "unk", "job_type": job_type, "protein_id": "XXX", "mutations": "G1A"},
+        )
+        for job_type in ["local", "database", "local"]
+    ]
+    mutation_info = MutationInfo(
+        1, structure_file="1MFG.pdb", chain_id="A", mutation="G1A", protein_id="X", coi=COI.CORE
+    )
+    for i, item in enumerate(items):
+        item.el2_mutation_info_list = [mutation_info._replace(el2_web_url=f"http://el2/jobs/{i}")]
+        ds.elaspic2_score_buffer.append((item, [mutation_info], 0.0))
+    released_urls = []
+
+    async def mock_update_mutation_scores(job_type, mutation_scores):
+        if job_type == "database":
+            raise Exception("Lost connection to MySQL server")
+        assert len(mutation_scores) == 2
+
+    with patch(
+        "elaspic_rest_api.jobsubmitter.elaspic2.update_mutation_scores", mock_update_mutation_scores
+    ), patch(
+        "elaspic_rest_api.jobsubmitter.elaspic2client.client.release",
+        lambda web_urls: released_urls.extend(web_urls),
+    ):
+        await js.flush_mutation_scores(ds)
+
+    # Scores which could not be written are kept for the next flush, together with their EL2 jobs
+    assert [entry[0] for entry in ds.elaspic2_score_buffer] == [items[1]]
+    assert ds.mutations_to_finalize == [items[0], items[2]]
+    assert released_urls == ["http://el2/jobs/0", "http://el2/jobs/2"]
+
+
+@pytest.mark.asyncio
+async def test_elaspic2_submit_loop_retries_transient_errors():
+    from concurrent.futures import ThreadPoolExecutor
+
+    import aiohttp
+
+    from elaspic_rest_api.jobsubmitter.elaspic2types import EL2Error
+
+    items = [
+        js.Item(
+            run_type="mutations",
+            args={"job_id": "unk", "job_type": "local", "protein_id": "XXX", "mutations": m},
+        )
+        for m in ["G1A", "K2A"]
+    ]
+    ds = js.DataStructures()
+
+    async def mock_get_mutation_info_batch(items):
+        if fail_db:
+            raise Exception("Lost connection to MySQL server")
+        return [
+            [
+                MutationInfo(
+                    1,
+                    structure_file="1MFG.pdb",
+                    chain_id="A",
+                    mutation=item.args["mutations"],
+                    protein_id="XXX",
+                    coi=COI.CORE,
+                )
+            ]
+            for item in items
+        ]
+
+    async def mock_create_job(protein_info):
+        if protein_info["mutations"] == "G1A":
+            raise aiohttp.ClientResponseError(None, (), status=400)
+        raise EL2Error("HTTP 503")
+
+    async def run_submit_loop():
+        for item in items:
+            await ds.elaspic2_pending_queue.put(item)
+        with return_on_call("elaspic_rest_api.jobsubmitter.elaspic2.asyncio.sleep"):
+            await js.elaspic2_submit_loop(ds)
+
+    with patch(
+        "elaspic_rest_api.jobsubmitter.elaspic2.create_parse_executor",
+        lambda: ThreadPoolExecutor(1),
+    ), patch("elaspic_rest_api.jobsubmitter.elaspic2.config.EL2_SUBMIT_WINDOW", 0), patch(
+        "elaspic_rest_api.jobsubmitter.elaspic2.config.EL2_SUBMIT_MAX_TRIES", 1
+    ), patch(
+        "elaspic_rest_api.jobsubmitter.elaspic2.get_mutation_info_batch",
+        mock_get_mutation_info_batch,
+    ), patch(
+        "elaspic_rest_api.jobsubmitter.elaspic2.extract_protein_info",
+        lambda mutation_info: {
+            "protein_structure_url": "http://elaspic/1MFG.pdb",
+            "protein_sequence": "GK",
+            "mutations": mutation_info.mutation,
+        },
+    ), patch(
+        "elaspic_rest_api.jobsubmitter.elaspic2client.client.create_job", mock_create_job
+    ):
+        # Database errors are retried for all items
+        fail_db = True
+        await run_submit_loop()
+        assert [ds.elaspic2_pending_queue.get_nowait() for _ in items] == items
+        assert [item.el2_tries for item in items] == [1, 1]
+        assert not ds.mutations_to_finalize
+
+        # Items rejected by ELASPIC2 are skipped, and items are skipped after too many retries
+        fail_db = False
+        await run_submit_loop()
+        assert ds.elaspic2_pending_queue.empty()
+        assert ds.mutations_to_finalize == items
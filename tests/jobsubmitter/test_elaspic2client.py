@@ -0,0 +1,138 @@
+import asyncio
+import time
+from unittest.mock import patch
+
+import aiohttp
+import pytest
+
+from elaspic_rest_api.jobsubmitter.elaspic2client import EL2Client, EL2Job
+from elaspic_rest_api.jobsubmitter.elaspic2types import EL2Error
+from elaspic_rest_api.utils import mock_await
+
+
+def _make_client(**kwargs) -> EL2Client:
+    params = dict(
+        connection_limit=2,
+        connect_timeout=1,
+        request_timeout=1,
+        max_retries=2,
+        retry_backoff=0,
+        delete_concurrency=2,
+        orphan_timeout=60,
+    )
+    params.update(kwargs)
+    return EL2Client("http://el2/", **params)
+
+
+class MockResponse:
+    def __init__(self, status, data=None):
+        self.status = status
+        self.data = data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise aiohttp.ClientResponseError(None, (), status=self.status)
+
+    async def json(self):
+        return self.data
+
+
+class MockSession:
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@pytest.mark.asyncio
+async def test_el2_client_retries():
+    client = _make_client()
+    session = MockSession([MockResponse(503), MockResponse(200, {"web_url": "http://el2/jobs/1"})])
+
+    with patch.object(client, "_get_session", return_value=session), patch(
+        "elaspic_rest_api.jobsubmitter.elaspic2client.asyncio.sleep", mock_await
+    ):
+        job_request = await client.create_job({"mutations": "G1A"})
+
+    assert job_request == {"web_url": "http://el2/jobs/1"}
+    assert session.requests == [("POST", "http://el2/jobs/"), ("POST", "http://el2/jobs/")]
+    assert client.stats["POST"].count == 2
+    assert client.stats["POST"].failures == 1
+    assert "http://el2/jobs/1" in client.jobs
+
+
+@pytest.mark.asyncio
+async def test_el2_client_gives_up():
+    client = _make_client()
+    session = MockSession([MockResponse(503) for _ in range(3)])
+
+    with patch.object(client, "_get_session", return_value=session), patch(
+        "elaspic_rest_api.jobsubmitter.elaspic2client.asyncio.sleep", mock_await
+    ):
+        with pytest.raises(EL2Error):
+            await client.create_job({"mutations": "G1A"})
+        assert await client.get_json("http://el2/jobs/1") is None
+
+
+@pytest.mark.asyncio
+async def test_el2_client_does_not_repeat_post():
+    client = _make_client()
+    session = MockSession(
+        [
+            aiohttp.ConnectionTimeoutError(),
+            MockResponse(429),
+            asyncio.TimeoutError(),
+            MockResponse(502),
+            MockResponse(502),
+            MockResponse(200, {"web_url": "http://el2/jobs/1"}),
+        ]
+    )
+
+    with patch.object(client, "_get_session", return_value=session), patch(
+        "elaspic_rest_api.jobsubmitter.elaspic2client.asyncio.sleep", mock_await
+    ):
+        # The job may have been created if the request timed out or failed with a server error
+        with pytest.raises(EL2Error):
+            await client.create_job({"mutations": "G1A"})
+        assert len(session.requests) == 3
+        with pytest.raises(aiohttp.ClientResponseError):
+            await client.create_job({"mutations": "G1A"})
+        assert len(session.requests) == 4
+
+        # GET requests are retried after server errors
+        assert await client.get_json("http://el2/jobs/1") == {"web_url": "http://el2/jobs/1"}
+        assert len(session.requests) == 6
+
+
+@pytest.mark.asyncio
+async def test_el2_client_release_and_sweep():
+    client = _make_client()
+    client.acquire(["http://el2/jobs/1", "http://el2/jobs/1", "http://el2/jobs/2"])
+    client.acquire(["http://el2/jobs/2"])
+
+    client.release(["http://el2/jobs/1"])
+    client.release(["http://el2/jobs/2"])
+    assert set(client.jobs) == {"http://el2/jobs/2"}
+    assert client.num_pending_deletes == 1
+
+    client.release(["http://el2/jobs/2"])
+    assert not client.jobs
+    assert client.num_pending_deletes == 2
+
+    client.jobs["http://el2/jobs/3"] = EL2Job(time.time() - 120)
+    client.jobs["http://el2/jobs/4"] = EL2Job(time.time())
+    client.jobs["http://el2/jobs/5"] = EL2Job(time.time() - 120, refcount=1)
+    assert client.sweep_orphans() == 1
+    assert set(client.jobs) == {"http://el2/jobs/4", "http://el2/jobs/5"}
@@ -8,7 +8,11 @@ import pytest
 
 from elaspic_rest_api import config
 from elaspic_rest_api import jobsubmitter as js
-from elaspic_rest_api.jobsubmitter.elaspic2 import extract_protein_info, resolve_mutation_info
+from elaspic_rest_api.jobsubmitter.elaspic2 import (
+    _load_structure_info,
+    extract_protein_info,
+    resolve_mutation_info,
+)
 from elaspic_rest_api.jobsubmitter.elaspic2db import get_mutation_info, update_mutation_scores
 from elaspic_rest_api.jobsubmitter.elaspic2types import COI, MutationInfo
 
@@ -36,6 +40,35 @@ def test_extract_protein_info(data_dir: Path, coi: COI):
     _validate_protein_info(protein_info, mutation_info)
 
 
+def test_extract_protein_info_cached(data_dir: Path):
+    structure_file = data_dir.joinpath("structures", "1MFG.pdb").resolve(strict=True)
+    mutation_info_list = [
+        MutationInfo(
+            domain_or_interface_id=1,
+            structure_file=structure_file.as_posix(),
+            chain_id="B",
+            mutation=mutation,
+            protein_id="test-local",
+            coi=COI.CORE,
+        )
+        for mutation in ["E216A", "E216C", "E216D"]
+    ]
+
+    class mock_config:
+        SITE_URL = "http://elaspic.kimlab.org"
+        DATA_DIR = data_dir.as_posix()
+        SITE_DATA_DIR = DATA_DIR
+
+    _load_structure_info.cache_clear()
+    with patch("elaspic_rest_api.jobsubmitter.elaspic2.config", mock_config):
+        protein_info_list = [extract_protein_info(mi) for mi in mutation_info_list]
+
+    assert _load_structure_info.cache_info().misses == 1
+    assert _load_structure_info.cache_info().hits == 2
+    for protein_info, mutation_info in zip(protein_info_list, mutation_info_list):
+        _validate_protein_info(protein_info, mutation_info)
+
+
 def _validate_protein_info(protein_info: Dict, mutation_info: MutationInfo):
     assert (
         protein_info["protein_sequence"][int(protein_info["mutations"][1:-1]) - 1]
@@ -95,6 +128,110 @@ async def test_get_mutation_info_database():
         _validate_protein_info(protein_info, mutation_info)
 
 
+class MockCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        pass
+
+    async def execute(self, sql, params):
+        self.queries.append((sql, params))
+        self.last_sql = sql
+
+    async def fetchall(self):
+        return self.rows["interface" if "interface_mutation" in self.last_sql else "core"]
+
+
+class MockConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def cursor(self):
+        return self._cursor
+
+    async def commit(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_get_mutation_info_batch():
+    items = [
+        js.Item(
+            run_type="mutations",
+            args={"job_id": 1, "job_type": "local", "protein_id": pid, "mutations": mutation},
+        )
+        for (pid, mutation) in [("d822d7", "P37A"), ("D822D7", "P37A"), ("d822d7", "A1_Q38A")]
+    ]
+    cursor = MockCursor(
+        {
+            "core": [("d822d7", "P37A", 1, "core.pdb", "A", "P1A")],
+            "interface": [
+                ("d822d7", "Q38A", 2, "interface.pdb", "A", "Q2A"),
+                ("d822d7", "Q38A", 3, "interface2.pdb", "A", "Q2A"),
+            ],
+        }
+    )
+
+    with patch("elaspic_rest_api.jobsubmitter.WDBConnection", lambda: MockConnection(cursor)):
+        mutation_info_lists = await js.get_mutation_info_batch(items)
+
+    # One query per table, with duplicates removed
+    assert len(cursor.queries) == 2
+    assert cursor.queries[0][1] == ["d822d7", "P37A", "D822D7", "P37A", "d822d7", "Q38A"]
+    assert [[mi.domain_or_interface_id for mi in mil] for mil in mutation_info_lists] == [
+        [1],
+        [1],
+        [2, 3],
+    ]
+    assert mutation_info_lists[1][0].protein_id == "D822D7"
+    assert [mi.coi for mi in mutation_info_lists[2]] == [COI.INTERFACE, COI.INTERFACE]
+
+
+@pytest.mark.asyncio
+async def test_update_mutation_scores_bulk():
+    mutation_info = MutationInfo(
+        domain_or_interface_id=11750,
+        structure_file="unused.pdb",
+        chain_id="A",
+        mutation="G33A",
+        protein_id="mdm2-peptide",
+        coi=COI.CORE,
+    )
+    mutation_scores = [
+        mutation_info._replace(el2_score=0.0),
+        mutation_info._replace(mutation="G34A", el2_score=0.1),
+        mutation_info._replace(el2_score=0.2),
+    ]
+    cursor = MockCursor({"core": [(11750, "mdm2-peptide", "G33A", 1)], "interface": []})
+
+    with patch(
+        "elaspic_rest_api.jobsubmitter.WDBConnection", lambda: MockConnection(cursor)
+    ), patch("elaspic_rest_api.jobsubmitter.elaspic2db.logger.error") as mock_error:
+        await update_mutation_scores("local", mutation_scores)
+
+    # One row count query and one update for the core table
+    assert len(cursor.queries) == 2
+    sql, params = cursor.queries[1]
+    assert sql.startswith("update elaspic_webserver.elaspic_core_mutation_local")
+    assert len(params) == 2 * 7
+    # The last score for each mutation is kept
+    assert params[5] == 0.2
+    # G34A does not match any rows
+    mock_error.assert_called_once()
+    assert mock_error.call_args[0][1] == 0
+
+
 def log_to_exception(*args) -> None:
     raise Exception(args[0] % args[1:])
 
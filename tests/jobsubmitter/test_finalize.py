@@ -1,3 +1,5 @@
+from unittest.mock import patch
+
 import pytest
 
 from elaspic_rest_api import jobsubmitter as js
@@ -25,3 +27,88 @@ async def test_finalize_mutation(data_in):
         s, m, muts = items
         for item in muts:
             await js.finalize_mutation(item)
+
+
+@pytest.mark.asyncio
+async def test_finalize_pending_mutations(data_in):
+    ds = js.DataStructures()
+    items_list = js.parse_input_data(data_in)
+    muts = [mut for (_, _, item_muts) in items_list for mut in item_muts]
+    job_key = js.JobKey(muts[0].args["webserver_job_id"], muts[0].args["webserver_job_email"])
+    ds.monitored_jobs[job_key] = {mut.unique_id for mut in muts}
+    for mut in muts:
+        js.schedule_finalize_mutation(mut, ds)
+
+    async def mock_finalize_mutations(items):
+        raise Exception("Deadlock found when trying to get lock")
+
+    with patch("elaspic_rest_api.jobsubmitter.finalize_mutations", mock_finalize_mutations):
+        await js.finalize_pending_mutations(ds)
+    assert ds.mutations_to_finalize == muts
+    assert ds.monitored_jobs[job_key]
+
+    finalized_items = []
+
+    async def mock_finalize_mutations(items):
+        finalized_items.extend(items)
+
+    with patch("elaspic_rest_api.jobsubmitter.finalize_mutations", mock_finalize_mutations):
+        await js.finalize_pending_mutations(ds)
+    assert finalized_items == muts
+    assert not ds.mutations_to_finalize
+    assert not ds.monitored_jobs[job_key]
+
+
+class MockErrorCursor:
+    """Cursor which fails to set the error status of the first mutation."""
+
+    def __init__(self):
+        self.params = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        pass
+
+    async def execute(self, sql, params):
+        if not self.params:
+            self.params.append(None)
+            raise Exception("Lock wait timeout exceeded")
+        self.params.append(params)
+
+
+class MockErrorConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.committed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def cursor(self):
+        return self._cursor
+
+    async def commit(self):
+        self.committed = True
+
+
+@pytest.mark.asyncio
+async def test_set_db_errors(data_in):
+    muts = [mut for (_, _, item_muts) in js.parse_input_data(data_in) for mut in item_muts][:3]
+    ds = js.DataStructures()
+    for mut in muts:
+        await ds.qsub_queue.put(mut)
+    conn = MockErrorConnection(MockErrorCursor())
+
+    with patch("elaspic_rest_api.jobsubmitter.WDBConnection", lambda: conn):
+        await js.set_db_errors(ds.qsub_queue)
+
+    # Items after the one that could not be updated are still updated
+    assert ds.qsub_queue.empty()
+    assert all(mut.state == js.journal.FAILED for mut in muts)
+    assert len(conn.cursor().params) == len(muts)
+    assert conn.committed
@@ -0,0 +1,63 @@
+from unittest.mock import patch
+
+import pytest
+
+from elaspic_rest_api import jobsubmitter as js
+
+
+@pytest.mark.asyncio
+async def test_job_index(data_in):
+    other_data_in = data_in.copy(update={"job_id": "other_job_id"})
+    mutations = {
+        (mutation.protein_id, mut)
+        for mutation in data_in.mutations
+        for mut in mutation.mutations.split(",")
+    }
+
+    ds = js.DataStructures()
+    await js.submit_job(data_in, ds)
+    await js.submit_job(other_data_in, ds)
+
+    job_status = ds.job_index.get_job_status(data_in.job_id)
+    assert {(m["protein_id"], m["mutation"]) for m in job_status["mutations"]} == mutations
+    assert job_status["counts"] == {js.journal.QUEUED: len(job_status["mutations"])}
+    assert not job_status["finished"]
+    assert ds.job_index.get_job_status("missing_job_id") is None
+
+    # Both jobs see transitions of the shared items
+    item = ds.in_flight[job_status["mutations"][0]["unique_id"]]
+    item.set_job_id(1234)
+    js.transition(item, js.journal.SUBMITTED)
+    for job_id in [data_in.job_id, other_data_in.job_id]:
+        mutation = next(
+            m
+            for m in ds.job_index.get_job_status(job_id)["mutations"]
+            if m["unique_id"] == item.unique_id
+        )
+        assert mutation["state"] == js.journal.SUBMITTED
+        assert mutation["slurm_job_id"] == "1234"
+        assert mutation["el2_state"] is None
+
+    # Mutations report the progress of their ELASPIC2 calculation
+    for state, el2_state in [
+        (js.journal.VALIDATED, js.job_index.EL2_PENDING),
+        (js.journal.EL2_RUNNING, js.job_index.EL2_RUNNING),
+    ]:
+        js.transition(item, state)
+        mutation = next(
+            m
+            for m in ds.job_index.get_job_status(data_in.job_id)["mutations"]
+            if m["unique_id"] == item.unique_id
+        )
+        assert mutation["el2_state"] == el2_state
+    item.el2_scored = True
+    assert js.job_index.get_el2_state(item) == js.job_index.EL2_SCORED
+
+    for item in list(ds.in_flight.values()):
+        js.transition(item, js.journal.DONE)
+    assert ds.job_index.get_job_status(data_in.job_id)["finished"]
+
+    assert ds.job_index.prune(retention=60) == 0
+    with patch("elaspic_rest_api.jobsubmitter.job_index.time.time", return_value=2e10):
+        assert ds.job_index.prune(retention=60) == 2
+    assert data_in.job_id not in ds.job_index
@@ -0,0 +1,123 @@
+import sqlite3
+from unittest.mock import patch
+
+import pytest
+
+from elaspic_rest_api import jobsubmitter as js
+from elaspic_rest_api.jobsubmitter.elaspic2types import COI, MutationInfo
+from elaspic_rest_api.jobsubmitter.journal import Journal
+from elaspic_rest_api.jobsubmitter.locks import FileLockManager
+from elaspic_rest_api.utils import mock_await
+
+
+def _make_mutation_items(data_in, mutations):
+    s, _, _ = js.parse_input_data(data_in)[0]
+    return [js.Item("mutations", {**s.args, "mutations": mutation}) for mutation in mutations]
+
+
+def test_journal_record_load(tmp_path, data_in):
+    journal = Journal(tmp_path.joinpath("journal.sqlite").as_posix())
+    done_item, submitted_item, el2_item = _make_mutation_items(data_in, ["G1A", "G2A", "G3A"])
+
+    for item in [done_item, submitted_item, el2_item]:
+        journal.record(item, js.journal.QUEUED)
+    journal.record(done_item, js.journal.DONE)
+    submitted_item.set_job_id(1234, 5)
+    journal.record(submitted_item, js.journal.SUBMITTED)
+    el2_item.el2_mutation_info_list = [
+        MutationInfo(1, "structure.pdb", "A", "G49V", "P21397", COI.CORE, "http://el2/jobs/1")
+    ]
+    journal.record(el2_item, js.journal.EL2_RUNNING)
+
+    journal.close()
+    journal.compact()
+    entries = journal.load()
+    journal.close()
+
+    assert [(entry.item.item_id, entry.state) for entry in entries] == [
+        (submitted_item.item_id, js.journal.SUBMITTED),
+        (el2_item.item_id, js.journal.EL2_RUNNING),
+    ]
+    assert entries[0].item.slurm_job_id == "1234_5"
+    assert entries[0].item.args == submitted_item.args
+    assert entries[0].item.job_keys == submitted_item.job_keys != set()
+    assert entries[1].item.el2_mutation_info_list == el2_item.el2_mutation_info_list
+
+
+@pytest.mark.asyncio
+async def test_replay_journal(tmp_path, data_in):
+    journal = Journal(tmp_path.joinpath("journal.sqlite").as_posix())
+    lock_manager = FileLockManager(tmp_path.joinpath("locks").as_posix(), lease_timeout=60)
+    s, m, _ = js.parse_input_data(data_in)[0]
+    queued_mut, validated_mut = _make_mutation_items(data_in, ["G1A", "G2A"])
+
+    with patch("elaspic_rest_api.jobsubmitter.journal.store", journal):
+        s.set_job_id(1234)
+        js.transition(s, js.journal.SUBMITTED)
+        js.transition(queued_mut, js.journal.QUEUED)
+        js.transition(validated_mut, js.journal.VALIDATED)
+        journal.close()
+
+        ds = js.DataStructures()
+        with patch("elaspic_rest_api.jobsubmitter.locks.manager", lock_manager), patch(
+            "elaspic_rest_api.jobsubmitter.lookup_precalculated", mock_await
+        ):
+            await js.replay_journal(ds)
+
+    assert [item.unique_id for item in ds.validation_queue._queue] == [s.unique_id]
+    assert ds.prereq_job_ids == {s.unique_id: "1234"}
+    assert s.unique_id in lock_manager.held
+    # The model prereq was not in the journal, so it is queued again
+    assert [item.unique_id for item in ds.qsub_queue._queue] == [m.unique_id]
+    assert [item.unique_id for item in ds.pre_qsub_queue._queue] == [queued_mut.unique_id]
+    assert set(ds.prereq_dependents) == {s.unique_id, m.unique_id}
+    assert [item.unique_id for item in ds.elaspic2_pending_queue._queue] == [
+        validated_mut.unique_id
+    ]
+    assert ds.monitored_jobs == {
+        js.JobKey(s.args["webserver_job_id"], s.args["webserver_job_email"]): {
+            queued_mut.unique_id,
+            validated_mut.unique_id,
+        }
+    }
+
+
+def test_journal_adds_job_keys_column(tmp_path, data_in):
+    path = tmp_path.joinpath("journal.sqlite").as_posix()
+    conn = sqlite3.connect(path)
+    conn.execute(
+        js.journal.CREATE_TRANSITIONS_TABLE_SQL.replace(
+            ",\n    job_keys TEXT NOT NULL DEFAULT '[]'", ""
+        )
+    )
+    conn.close()
+    (item,) = _make_mutation_items(data_in, ["G1A"])
+
+    journal = Journal(path)
+    journal.record(item, js.journal.QUEUED)
+    entries = journal.load()
+    journal.close()
+
+    assert entries[0].item.job_keys == item.job_keys
+
+
+def test_journal_compact_while_recording(tmp_path, data_in):
+    journal = Journal(tmp_path.joinpath("journal.sqlite").as_posix())
+    items = _make_mutation_items(data_in, ["G1A", "G2A"])
+
+    for state in [js.journal.QUEUED, js.journal.SUBMITTED, js.journal.VALIDATED]:
+        for item in items:
+            journal.record(item, state)
+    journal.record(items[0], js.journal.DONE)
+
+    # Transitions can be recorded on the same journal before and after compaction
+    journal.compact()
+    journal.record(items[1], js.journal.EL2_RUNNING)
+    num_rows = journal._get_conn().execute("SELECT count(*) FROM transitions;").fetchone()[0]
+    entries = journal.load()
+    journal.close()
+
+    assert num_rows == 2
+    assert [(entry.item.item_id, entry.state) for entry in entries] == [
+        (items[1].item_id, js.journal.EL2_RUNNING)
+    ]
@@ -0,0 +1,80 @@
+import os
+import time
+
+import pytest
+
+from elaspic_rest_api.jobsubmitter.locks import FileLockManager
+
+
+@pytest.mark.asyncio
+async def test_file_lock_manager_acquire_release(tmp_path):
+    manager = FileLockManager(tmp_path.as_posix(), lease_timeout=60)
+    key = "local.mutations.P21397.G49V"
+
+    assert await manager.acquire(key)
+    assert os.path.isfile(manager.get_lock_path(key))
+    assert not await manager.acquire(key)
+
+    await manager.release(key)
+    assert not os.path.isfile(manager.get_lock_path(key))
+    assert await manager.acquire(key)
+
+
+@pytest.mark.asyncio
+async def test_file_lock_manager_release_many(tmp_path):
+    manager = FileLockManager(tmp_path.as_posix(), lease_timeout=60)
+    keys = [f"local.mutations.P21397.G{i}V" for i in range(10)]
+
+    for key in keys:
+        assert await manager.acquire(key)
+    # Lock files are spread over multiple shards
+    assert len({os.path.dirname(manager.get_lock_path(key)) for key in keys}) > 1
+
+    await manager.release_many(keys[:5])
+    assert set(manager.held) == set(keys[5:])
+    assert not any(os.path.isfile(manager.get_lock_path(key)) for key in keys[:5])
+
+    await manager.release_all()
+    assert not manager.held
+    assert not any(os.path.isfile(manager.get_lock_path(key)) for key in keys)
+
+
+@pytest.mark.asyncio
+async def test_file_lock_manager_expired(tmp_path):
+    manager = FileLockManager(tmp_path.as_posix(), lease_timeout=60)
+    other_manager = FileLockManager(tmp_path.as_posix(), lease_timeout=60)
+    expired_key, active_key = "local.sequence.P21397", "local.model.P21397"
+
+    assert await manager.acquire(expired_key)
+    assert await manager.acquire(active_key)
+    expired_time = time.time() - 120
+    os.utime(manager.get_lock_path(expired_key), (expired_time, expired_time))
+
+    assert not await other_manager.acquire(active_key)
+    assert await other_manager.acquire(expired_key)
+
+    os.utime(manager.get_lock_path(expired_key), (expired_time, expired_time))
+    assert await manager.sweep() == 1
+    assert not os.path.isfile(manager.get_lock_path(expired_key))
+    assert os.path.isfile(manager.get_lock_path(active_key))
+
+
+@pytest.mark.asyncio
+async def test_file_lock_manager_owner(tmp_path):
+    manager = FileLockManager(tmp_path.as_posix(), lease_timeout=60)
+    other_manager = FileLockManager(tmp_path.as_posix(), lease_timeout=60)
+    key = "local.mutations.P21397.G49V"
+
+    # Leases held under the same token are taken over (e.g. after a restart)
+    assert await manager.acquire(key, "item_id")
+    assert await other_manager.acquire(key, "item_id")
+    assert not await other_manager.acquire(key, "other_item_id")
+
+    # Expired locks reclaimed by someone else are not removed by the previous owner
+    expired_time = time.time() - 120
+    os.utime(manager.get_lock_path(key), (expired_time, expired_time))
+    assert await other_manager.acquire(key, "other_item_id")
+    await manager.release(key)
+    assert os.path.isfile(manager.get_lock_path(key))
+    await other_manager.release(key)
+    assert not os.path.isfile(manager.get_lock_path(key))
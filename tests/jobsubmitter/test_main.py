@@ -1,3 +1,5 @@
+from unittest.mock import patch
+
 import pytest
 
 from elaspic_rest_api import jobsubmitter as js
@@ -5,16 +7,105 @@ from elaspic_rest_api import jobsubmitter as js
 
 @pytest.mark.asyncio
 async def test_main(data_in):
-    # TODO: We should look for unique (protein_id, uniprot_domain_pair_ids) pairs when calculating
-    # num_protens, but this is not implemented.
-    num_proteins = len(data_in.mutations)
-    num_mutations = sum(len(d.mutations.split(",")) for d in data_in.mutations)
+    # Identical items are only submitted once
+    s_m_items = {item.unique_id for s, m, _ in js.parse_input_data(data_in) for item in [s, m]}
+    mut_items = {mut.unique_id for _, _, muts in js.parse_input_data(data_in) for mut in muts}
 
     ds = js.DataStructures()
     await js.submit_job(data_in, ds)
-    assert ds.pre_qsub_queue.qsize() == num_mutations
-    assert ds.qsub_queue.qsize() == num_proteins * 2
+    assert ds.pre_qsub_queue.qsize() == len(mut_items)
+    assert ds.qsub_queue.qsize() == len(s_m_items)
     assert ds.validation_queue.empty()
     assert len(ds.monitored_jobs) == 1
     job_key = js.JobKey(data_in.job_id, data_in.job_email)
     assert len(ds.monitored_jobs[job_key])
+
+
+@pytest.mark.asyncio
+async def test_submit_job_coalesces_in_flight_items(data_in):
+    other_data_in = data_in.copy(update={"job_id": "other_job_id"})
+    job_key = js.JobKey(data_in.job_id, data_in.job_email)
+    other_job_key = js.JobKey(other_data_in.job_id, other_data_in.job_email)
+
+    ds = js.DataStructures()
+    await js.submit_job(data_in, ds)
+    num_submitted = ds.pre_qsub_queue.qsize() + ds.qsub_queue.qsize()
+    # Resubmitting the same job, or submitting the same mutations in another job, adds no items
+    await js.submit_job(data_in, ds)
+    await js.submit_job(other_data_in, ds)
+    assert ds.pre_qsub_queue.qsize() + ds.qsub_queue.qsize() == num_submitted
+    assert ds.monitored_jobs[job_key] == ds.monitored_jobs[other_job_key]
+
+    # Finishing an item completes it for every subscribed job
+    for item in list(ds.in_flight.values()):
+        assert item.job_keys == {job_key, other_job_key}
+        await js.resolve_item(item, ds)
+    assert not ds.in_flight
+    assert ds.monitored_jobs == {job_key: set(), other_job_key: set()}
+
+
+@pytest.mark.asyncio
+async def test_submit_job_stream(data_in):
+    lines = [mutation.json().encode() for mutation in data_in.mutations]
+    lines.insert(1, b'{"protein_id": "P21397"}')
+    body = b"\n".join(lines) + b"\n"
+    # Lines are split across chunks
+    chunks = [body[i : i + 7] for i in range(0, len(body), 7)]
+
+    async def iter_chunks():
+        for chunk in chunks:
+            yield chunk
+
+    expected_ds = js.DataStructures()
+    await js.submit_job(data_in, expected_ds)
+
+    ds = js.DataStructures()
+    with patch("elaspic_rest_api.config.STREAM_BATCH_SIZE", 2):
+        result = await js.submit_job_stream(
+            iter_chunks(), data_in.copy(update={"mutations": []}), ds
+        )
+
+    assert result["num_mutations"] == len(data_in.mutations)
+    assert [line_number for line_number, _ in result["errors"]] == [2]
+    assert ds.pre_qsub_queue.qsize() == expected_ds.pre_qsub_queue.qsize()
+    assert ds.qsub_queue.qsize() == expected_ds.qsub_queue.qsize()
+    assert ds.monitored_jobs == expected_ds.monitored_jobs
+
+
+@pytest.mark.asyncio
+async def test_submit_job_stream_limits_errors(data_in):
+    async def iter_chunks():
+        for _ in range(100):
+            yield b'{"protein_id": "P21397"}\n'
+
+    ds = js.DataStructures()
+    with patch("elaspic_rest_api.config.STREAM_MAX_ERRORS", 3):
+        result = await js.submit_job_stream(
+            iter_chunks(), data_in.copy(update={"mutations": []}), ds
+        )
+
+    assert result["num_errors"] == 100
+    assert [line_number for line_number, _ in result["errors"]] == [1, 2, 3]
+    # Jobs without any mutations are not monitored
+    assert not ds.monitored_jobs
+
+
+@pytest.mark.asyncio
+async def test_submit_job_stream_failed_batches(data_in):
+    async def iter_chunks():
+        for mutation in data_in.mutations:
+            yield mutation.json().encode() + b"\n"
+
+    async def mock_submit_job(data_in, ds):
+        raise Exception("Lost connection to MySQL server")
+
+    ds = js.DataStructures()
+    with patch("elaspic_rest_api.jobsubmitter.jobsubmitter.submit_job", mock_submit_job):
+        result = await js.submit_job_stream(
+            iter_chunks(), data_in.copy(update={"mutations": []}), ds
+        )
+
+    # Mutations in batches which could not be submitted are not counted
+    assert result["num_mutations"] == 0
+    assert result["num_errors"] == 1
+    assert not ds.monitored_jobs
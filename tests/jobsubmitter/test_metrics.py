@@ -0,0 +1,82 @@
+from unittest.mock import patch
+
+import pytest
+
+from elaspic_rest_api import jobsubmitter as js
+from elaspic_rest_api.jobsubmitter.metrics import Histogram
+
+
+def test_histogram():
+    histogram = Histogram([1, 10])
+    for value in [0.5, 1, 5, 100]:
+        histogram.observe(value)
+    assert histogram.cumulative_counts() == [("1", 2), ("10", 3), ("+Inf", 4)]
+    assert histogram.count == 4
+    assert histogram.sum == 106.5
+
+
+@pytest.mark.asyncio
+async def test_stage_queue_records_stage_latency(data_in):
+    s, _, _ = js.parse_input_data(data_in)[0]
+    ds = js.DataStructures()
+
+    with patch("elaspic_rest_api.jobsubmitter.metrics.stage_latency", {}) as stage_latency, patch(
+        "elaspic_rest_api.jobsubmitter.metrics.time.time", return_value=100.0
+    ):
+        await ds.qsub_queue.put(s)
+        assert s.stage == js.metrics.QSUB
+        assert ds.qsub_queue.oldest_age == 0
+
+    with patch("elaspic_rest_api.jobsubmitter.metrics.stage_latency", stage_latency), patch(
+        "elaspic_rest_api.jobsubmitter.metrics.time.time", return_value=130.0
+    ):
+        assert ds.qsub_queue.oldest_age == 30
+        item = await ds.qsub_queue.get()
+        await ds.validation_queue.put(item)
+        # Putting an item back into the queue of its current stage does not end the stage
+        item = await ds.validation_queue.get()
+        await ds.validation_queue.put(item)
+        js.transition(item, js.journal.DONE)
+
+    assert s.stage is None
+    assert ds.qsub_queue.oldest_age == 0
+    assert set(stage_latency) == {js.metrics.QSUB, js.metrics.VALIDATION}
+    assert stage_latency[js.metrics.QSUB].sum == 30
+    assert stage_latency[js.metrics.VALIDATION].count == 1
+
+
+@pytest.mark.asyncio
+async def test_render_metrics(data_in):
+    s, _, _ = js.parse_input_data(data_in)[0]
+    ds = js.DataStructures()
+    await ds.qsub_queue.put(s)
+    sbatch_stats = js.ssh.CommandStats()
+    sbatch_stats.record(0.2, False)
+
+    with patch.object(js.ssh.pool, "stats", {"sbatch": sbatch_stats}), patch(
+        "elaspic_rest_api.jobsubmitter.metrics.task_restarts", {"qstat": 2}
+    ):
+        text = js.render_metrics(ds)
+
+    lines = text.splitlines()
+    assert 'elaspic_queue_size{queue="qsub"} 1' in lines
+    assert 'elaspic_ssh_command_latency_seconds_bucket{command="sbatch",le="0.25"} 1' in lines
+    assert 'elaspic_task_restarts_total{task="qstat"} 2' in lines
+    assert 'elaspic_ssh_command_failures_total{command="sbatch"} 1' in lines
+    assert "# TYPE elaspic_stage_latency_seconds histogram" in lines
+
+
+@pytest.mark.asyncio
+async def test_render_metrics_waiting_for_prereqs(data_in):
+    ds = js.DataStructures()
+    await js.submit_job(data_in, ds)
+    # Each mutation waits for both its sequence and its model
+    num_waiting = ds.pre_qsub_queue.qsize()
+
+    lines = js.render_metrics(ds).splitlines()
+    assert f'elaspic_items{{kind="waiting_for_prereqs"}} {num_waiting}' in lines
+
+    item = ds.pre_qsub_queue.get_nowait()
+    js.stop_waiting_for_prereqs(item, ds)
+    js.stop_waiting_for_prereqs(item, ds)
+    assert ds.num_waiting_for_prereqs == num_waiting - 1
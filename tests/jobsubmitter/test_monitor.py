@@ -0,0 +1,41 @@
+from unittest.mock import patch
+
+from elaspic_rest_api.jobsubmitter.monitor import parse_squeue_job_ids, scan_finished_locks
+
+SQUEUE_OUTPUT = """\
+             JOBID PARTITION     NAME     USER ST       TIME  NODES NODELIST(REASON)
+    1234_[5-7,9%2]   kimprod elaspic- kimlab1 PD       0:00      1 (JobArrayTaskLimit)
+            1234_4   kimprod elaspic- kimlab1  R       1:02      1 node01
+              1230   kimprod elaspic- kimlab1  R      10:02      1 node02
+              1240   kimprod elaspic- kimlab1 PD       0:00      1 (DependencyNeverSatisfied)
+"""
+
+
+def test_parse_squeue_job_ids():
+    job_ids = parse_squeue_job_ids(SQUEUE_OUTPUT)
+    assert job_ids == {"1230", "1234_4", "1234_5", "1234_6", "1234_7", "1234_9", "1240"}
+
+
+def test_parse_squeue_job_ids_with_reason():
+    job_ids = parse_squeue_job_ids(SQUEUE_OUTPUT, "DependencyNeverSatisfied")
+    assert job_ids == {"1240"}
+
+
+def test_scan_finished_locks(tmp_path):
+    class mock_config:
+        PROVEAN_LOCK_DIR = tmp_path.joinpath("sequence").as_posix()
+        MODEL_LOCK_DIR = tmp_path.joinpath("model").as_posix()
+        MUTATION_LOCK_DIR = tmp_path.joinpath("mutation").as_posix()
+
+    finished_dir = tmp_path.joinpath("mutation", "finished")
+    finished_dir.mkdir(parents=True)
+    finished_dir.joinpath("P21397.G49V.lock").touch()
+    finished_dir.joinpath("P21397.G49A.lock.failed").touch()
+
+    with patch("elaspic_rest_api.jobsubmitter.monitor.config", mock_config):
+        finished_locks = scan_finished_locks()
+
+    assert finished_locks == {
+        finished_dir.joinpath("P21397.G49V.lock").as_posix(): True,
+        finished_dir.joinpath("P21397.G49A.lock").as_posix(): False,
+    }
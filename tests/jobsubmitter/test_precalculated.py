@@ -1,7 +1,10 @@
+from unittest.mock import patch
+
 import pytest
 
 from elaspic_rest_api import jobsubmitter as js
-from elaspic_rest_api.utils import return_on_call
+from elaspic_rest_api.jobsubmitter.precalculated_index import PrecalculatedIndex
+from elaspic_rest_api.utils import mock_await, return_on_call
 
 
 @pytest.mark.asyncio
@@ -24,6 +27,43 @@ async def test_check_prereqs_false():
     assert not is_precalculated
 
 
+def _make_mutation_item(protein_id: str, mutation: str) -> js.Item:
+    args = {"job_id": "1", "job_type": "database", "protein_id": protein_id, "mutations": mutation}
+    return js.Item(run_type="mutations", args=args)  # type: ignore
+
+
+@pytest.mark.asyncio
+async def test_release_dependents():
+    ds = js.DataStructures()
+    ds.precalculated["database.sequence.P21397"] = 1
+    items = [_make_mutation_item("P21397", "G49V"), _make_mutation_item("P21397", "G49A")]
+    for item in items:
+        await js.wait_for_prereqs(item, ds)
+    assert ds.pre_qsub_queue.qsize() == 2
+    assert list(ds.prereq_dependents) == ["database.model.P21397"]
+
+    ds.precalculated_cache["database.model.P21397"] = 2
+    await js.release_dependents("database.model.P21397", ds)
+    assert ds.qsub_queue.qsize() == 2
+    assert not ds.prereq_dependents
+    assert not any(item.waiting_for_prereqs for item in items)
+
+
+@pytest.mark.asyncio
+@patch("elaspic_rest_api.jobsubmitter.set_db_errors")
+async def test_fail_dependents(mock_set_db_errors):
+    mock_set_db_errors.side_effect = mock_await
+    ds = js.DataStructures()
+    items = [_make_mutation_item("O00522", "L526C"), _make_mutation_item("O00522", "L526A")]
+    for item in items:
+        await js.wait_for_prereqs(item, ds)
+
+    await js.fail_dependents("database.sequence.O00522", ds)
+    assert ds.qsub_queue.empty()
+    assert not ds.prereq_dependents
+    assert set(mock_set_db_errors.call_args[0][0]) == set(items)
+
+
 @pytest.mark.asyncio
 async def test_update_precalculated():
     precalculated = {}
@@ -44,3 +84,102 @@ async def test_persist_precalculated():
 
     assert precalculated == {**precalculated_ref, **precalculated_cache_ref}
     assert not precalculated_cache
+
+
+class MockCacheCursor:
+    """Cursor which runs `jobsubmitter_cache` queries against a list of `(id, job_id, seq)` rows."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.num_queries = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        pass
+
+    async def execute(self, sql, params):
+        self.num_queries += 1
+        if sql == js.precalculated.GET_PRECALCULATED_PAGE_SQL:
+            last_seq, limit = params
+            self.result = sorted(
+                (row for row in self.rows if row[2] > last_seq), key=lambda row: row[2]
+            )[:limit]
+        else:
+            self.result = [row for row in self.rows if row[0] in params]
+
+    async def fetchall(self):
+        return self.result
+
+
+class MockCacheConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def cursor(self):
+        return self._cursor
+
+
+@pytest.mark.asyncio
+async def test_update_precalculated_paged():
+    rows = [(f"database.model.{i:06d}", 1000 + i, i + 1) for i in range(25)]
+    cursor = MockCacheCursor(rows)
+    ds = js.DataStructures()
+
+    with patch("elaspic_rest_api.jobsubmitter.EDBConnection", lambda: MockCacheConnection(cursor)):
+        await js.lookup_precalculated(["database.model.000003", "database.model.999999"], ds)
+        assert "database.model.000003" in ds.precalculated
+        assert len(ds.precalculated) == 1
+
+        with patch("elaspic_rest_api.config.PRECALCULATED_PAGE_SIZE", 10):
+            last_seq = await js.update_precalculated(ds.precalculated)
+            assert cursor.num_queries == 1 + 3
+            assert all(row[0] in ds.precalculated for row in rows)
+            assert last_seq == 25
+
+            # New rows are found even if their job ids are smaller than the ones already loaded
+            new_rows = [("database.model.a", 999, 30), ("local.sequence.b", 0, 31)]
+            cursor.rows.extend(new_rows)
+            last_seq = await js.refresh_precalculated(ds.precalculated, last_seq)
+            assert all(row[0] in ds.precalculated for row in new_rows)
+            assert len(ds.precalculated) == 27
+            assert last_seq == 31
+
+    # No lookups are needed once everything has been loaded
+    ds.precalculated_loaded = True
+    await js.lookup_precalculated(["database.model.999999"], ds)
+
+
+@pytest.mark.parametrize("bloom_bits_per_key", [0, 10])
+def test_precalculated_index(bloom_bits_per_key):
+    keys = [f"database.model.{i:06x}" for i in range(1000)]
+    index = PrecalculatedIndex(
+        keys[:500], lru_size=8, merge_size=64, bloom_bits_per_key=bloom_bits_per_key
+    )
+    index.update({key: 1 for key in keys[500:]})
+    index.add(keys[0])
+    assert len(index) == len(keys)
+
+    assert all(key in index for key in keys)
+    assert not any(f"database.sequence.{i:06x}" in index for i in range(1000))
+    assert None not in index
+    # Only the most recently found keys are kept in the LRU cache
+    assert list(index._lru) == keys[-8:]
+    assert keys[-8] in index
+    assert list(index._lru)[-1] == keys[-8]
+
+
+def test_check_prereqs_index():
+    precalculated = PrecalculatedIndex(["database.model.956a8e"])
+    precalculated_cache = {"database.sequence.956a8e": 3880076}
+    assert js.check_prereqs(
+        ["database.sequence.956a8e", "database.model.956a8e"], precalculated, precalculated_cache
+    )
+    assert not js.check_prereqs(["database.model.68b8fe"], precalculated, precalculated_cache)
@@ -0,0 +1,30 @@
+from unittest.mock import patch
+
+import pytest
+
+from elaspic_rest_api.jobsubmitter.ssh import SSHPool, get_command_name
+from elaspic_rest_api.utils import mock_await
+
+
+def test_get_command_name():
+    assert get_command_name('DB_HOST="localhost" run_type=model sbatch --nodes=1 db.sh') == "sbatch"
+    assert get_command_name("squeue -u 'kimlab1'") == "squeue"
+
+
+@pytest.mark.asyncio
+async def test_ssh_pool_reconnects(tmp_path):
+    pool = SSHPool("user@host", size=2, control_dir=tmp_path.as_posix(), control_persist=60)
+    results = [("", "Connection reset", 255), ("Submitted batch job 1", "", 0)]
+
+    async def mock_exec(slot, remote_command):
+        return results.pop(0)
+
+    with patch.object(pool, "_exec", mock_exec), patch.object(
+        pool, "_disconnect", side_effect=mock_await
+    ) as mock_disconnect:
+        result, error_message, returncode = await pool.run("sbatch database.sh")
+
+    assert (result, error_message, returncode) == ("Submitted batch job 1", "", 0)
+    mock_disconnect.assert_called_once()
+    assert pool.stats["sbatch"].count == 2
+    assert pool.stats["sbatch"].failures == 1
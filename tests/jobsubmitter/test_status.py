@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from elaspic_rest_api import jobsubmitter as js
+
+
+@pytest.mark.asyncio
+async def test_get_status_summary(data_in):
+    ds = js.DataStructures()
+    await js.submit_job(data_in, ds)
+    await ds.qsub_queue.get()
+
+    summary = js.status.get_status_summary(ds)
+
+    assert summary["queues"]["qsub"]["size"] == ds.qsub_queue.qsize()
+    assert summary["queues"]["qsub"]["num_get"] == 1
+    assert summary["queues"]["qsub"]["num_put"] == ds.qsub_queue.qsize() + 1
+    assert summary["queues"]["validation"] == {
+        "size": 0,
+        "oldest_put_time": None,
+        "num_put": 0,
+        "num_get": 0,
+    }
+    assert summary["monitored_jobs"] == len(ds.monitored_jobs)
+    assert summary["waiting_for_prereqs"] == ds.pre_qsub_queue.qsize()
+
+
+@pytest.mark.asyncio
+async def test_get_queue_page(data_in):
+    ds = js.DataStructures()
+    await js.submit_job(data_in, ds)
+    # Items removed from the queue do not invalidate cursors
+    await ds.pre_qsub_queue.get()
+    unique_ids = [item.unique_id for item in ds.pre_qsub_queue._queue]
+
+    pages = []
+    cursor = 0
+    while cursor is not None:
+        page = js.status.get_queue_page(ds, "pre_qsub", cursor, 2)
+        pages.append(page)
+        cursor = page["next_cursor"]
+        if len(pages) == 1 and cursor is not None:
+            await ds.pre_qsub_queue.put(await ds.pre_qsub_queue.get())
+            unique_ids.append(unique_ids[0])
+
+    assert [item["unique_id"] for page in pages for item in page["items"]] == unique_ids
+    assert all(len(page["items"]) <= 2 for page in pages)
+    assert all(item["stage"] == js.metrics.PRE_QSUB for page in pages for item in page["items"])
+
+
+def test_dumps_with_etag():
+    body, etag = js.status.dumps_with_etag({"a": [1, 2]})
+    assert json.loads(body) == {"a": [1, 2]}
+    assert js.status.dumps_with_etag({"a": [1, 2]})[1] == etag
+    assert js.status.dumps_with_etag({"a": [1, 3]})[1] != etag
+    assert js.status.etag_matches(f'"other", {etag}', etag)
+    assert js.status.etag_matches(f"W/{etag}", etag)
+    assert not js.status.etag_matches(None, etag)
@@ -1,5 +1,23 @@
+import asyncio
+import os
+import time
+from unittest.mock import patch
+
+import pytest
+
+from elaspic_rest_api import jobsubmitter as js
 from elaspic_rest_api.jobsubmitter.jobsubmitter import parse_input_data
-from elaspic_rest_api.jobsubmitter.submit import create_qsub_system_command
+from elaspic_rest_api.jobsubmitter.locks import FileLockManager
+from elaspic_rest_api.jobsubmitter.submit import (
+    _claim_item,
+    _submit_array,
+    cleanup_array_task_files,
+    create_array_task_file,
+    create_qsub_array_system_command,
+    create_qsub_system_command,
+    get_dependency_options,
+    qsub,
+)
 
 
 def test_create_qsub_system_command(data_in):
@@ -9,3 +27,152 @@ def test_create_qsub_system_command(data_in):
         for item in [s, m] + list(muts):
             system_command = create_qsub_system_command(item)
             print(system_command)
+
+
+def test_create_qsub_array_system_command(data_in):
+    items_list = parse_input_data(data_in)
+    for items in items_list:
+        s, m, muts = items
+        muts = sorted(muts, key=lambda item: item.unique_id)
+        system_command = create_qsub_array_system_command(muts, "/tmp/task_file.sh")
+        assert f"--array=0-{len(muts) - 1}" in system_command
+        assert system_command.endswith('/array.sh" ')
+
+        task_file = create_array_task_file(muts)
+        for array_task_id, item in enumerate(muts):
+            assert f"  {array_task_id})\n" in task_file
+            assert f"export mutations={item.args['mutations']}\n" in task_file
+
+
+def test_get_dependency_options(data_in):
+    items_list = parse_input_data(data_in)
+    _, _, muts = items_list[0]
+    item = next(iter(muts))
+    assert get_dependency_options(item) == ""
+    assert "--dependency" not in create_qsub_system_command(item)
+
+    item.dependency_job_ids = ["1234", "1235_2"]
+    assert get_dependency_options(item) == (
+        "--dependency=afterok:1234:1235_2 --kill-on-invalid-dep=yes"
+    )
+    assert "--dependency=afterok:1234:1235_2" in create_qsub_system_command(item)
+
+
+@pytest.mark.asyncio
+async def test_claim_item_waits_for_lock(tmp_path, data_in):
+    manager = FileLockManager(tmp_path.as_posix(), lease_timeout=60)
+    ds = js.DataStructures()
+    await js.submit_job(data_in, ds)
+    item = next(item for item in ds.in_flight.values() if item.run_type == "mutations")
+
+    async def check_mutations_calculated(item):
+        return False
+
+    with patch("elaspic_rest_api.jobsubmitter.locks.manager", manager), patch(
+        "elaspic_rest_api.jobsubmitter.check_mutations_calculated", check_mutations_calculated
+    ):
+        assert await manager.acquire(item.unique_id, "other_item_id")
+        num_waiting = ds.pre_qsub_queue.qsize()
+        assert not await _claim_item(item, ds)
+        # The item keeps waiting instead of being resolved
+        assert item.waiting_for_lock
+        assert ds.pre_qsub_queue.qsize() == num_waiting + 1
+        assert ds.in_flight[item.unique_id] is item
+        assert any(item.unique_id in unique_ids for unique_ids in ds.monitored_jobs.values())
+
+        # Leases held by the item itself are taken over
+        await manager.release(item.unique_id)
+        assert await manager.acquire(item.unique_id, item.item_id)
+        manager.held.clear()
+        item.waiting_for_lock = False
+        assert await _claim_item(item, ds)
+        assert manager.held == {item.unique_id: item.item_id}
+
+
+@pytest.mark.asyncio
+async def test_claim_item_skips_items_calculated_by_lock_holder(tmp_path, data_in):
+    manager = FileLockManager(tmp_path.as_posix(), lease_timeout=60)
+    ds = js.DataStructures()
+    await js.submit_job(data_in, ds)
+    item = next(item for item in ds.in_flight.values() if item.run_type == "mutations")
+    calculated = []
+
+    async def check_mutations_calculated(item):
+        return item.unique_id in calculated
+
+    with patch("elaspic_rest_api.jobsubmitter.locks.manager", manager), patch(
+        "elaspic_rest_api.jobsubmitter.check_mutations_calculated", check_mutations_calculated
+    ):
+        assert await manager.acquire(item.unique_id, "other_item_id")
+        assert not await _claim_item(item, ds)
+
+        # The lock holder calculates the mutation and releases its lock
+        calculated.append(item.unique_id)
+        manager.held.clear()
+        os.remove(manager.get_lock_path(item.unique_id))
+        item.waiting_for_lock = False
+        assert not await _claim_item(item, ds)
+        assert ds.mutations_to_finalize == [item]
+        assert not manager.held
+        assert not os.path.exists(manager.get_lock_path(item.unique_id))
+
+
+@pytest.mark.asyncio
+async def test_qsub_restarts_items_which_cannot_be_claimed(data_in):
+    ds = js.DataStructures()
+    item = next(item for _, _, muts in parse_input_data(data_in) for item in muts)
+    await ds.qsub_queue.put(item)
+
+    async def acquire(key, token=None):
+        raise OSError("Stale file handle")
+
+    with patch("elaspic_rest_api.jobsubmitter.locks.manager.acquire", acquire), patch(
+        "elaspic_rest_api.jobsubmitter.perf.SLEEP_FOR_ERROR", 0
+    ):
+        task = asyncio.create_task(qsub(ds))
+        while not item.qsub_tries:
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+    assert item.state == js.journal.QUEUED
+    assert ds.qsub_queue.qsize() == 1
+
+
+@pytest.mark.asyncio
+async def test_array_task_files_are_removed(tmp_path, data_in):
+    ds = js.DataStructures()
+    items = [item for _, _, muts in parse_input_data(data_in) for item in muts]
+
+    async def run_sbatch(system_command):
+        return job_id, "", ""
+
+    with patch("elaspic_rest_api.config.ARRAY_TASKS_DIR", tmp_path.as_posix()), patch(
+        "elaspic_rest_api.jobsubmitter.submit._run_sbatch", run_sbatch
+    ):
+        # Task files of failed submissions are removed right away
+        job_id = None
+        await _submit_array(items, ds)
+        assert not os.listdir(tmp_path)
+
+        job_id = 1234
+        await _submit_array(items, ds)
+        (task_file,) = os.listdir(tmp_path)
+        assert ds.array_task_files == {job_id: tmp_path.joinpath(task_file).as_posix()}
+
+        # Task files are kept while any of the array items are waiting to be validated
+        await cleanup_array_task_files(ds)
+        assert os.listdir(tmp_path) == [task_file]
+        while not ds.validation_queue.empty():
+            ds.validation_queue.get_nowait()
+        await cleanup_array_task_files(ds)
+        assert not os.listdir(tmp_path)
+        assert not ds.array_task_files
+
+        # Untracked task files are removed once they expire
+        expired_task_file = tmp_path.joinpath("expired.sh")
+        expired_task_file.write_text("")
+        expired_time = time.time() - js.perf.JOB_TIMEOUT - 60
+        os.utime(expired_task_file, (expired_time, expired_time))
+        tmp_path.joinpath("active.sh").write_text("")
+        await cleanup_array_task_files(ds)
+        assert os.listdir(tmp_path) == ["active.sh"]
@@ -0,0 +1,57 @@
+import json
+from unittest.mock import patch
+
+import pytest
+
+from elaspic_rest_api import jobsubmitter as js
+
+pytest.importorskip("opentelemetry.sdk")
+
+
+@pytest.mark.asyncio
+async def test_item_spans(tmp_path, data_in):
+    traces_file = tmp_path.joinpath("traces.jsonl")
+
+    with patch("elaspic_rest_api.config.TRACES_FILE", traces_file.as_posix()):
+        js.setup_tracing("file", 1.0)
+    try:
+        ds = js.DataStructures()
+        await js.submit_job(data_in, ds)
+        item = await ds.qsub_queue.get()
+        with js.tracing.item_span([item], "sbatch"):
+            pass
+        await ds.validation_queue.put(item)
+        trace_id = "0x" + format(item.trace_span.get_span_context().trace_id, "032x")
+        js.transition(item, js.journal.DONE)
+    finally:
+        js.shutdown_tracing()
+
+    spans = [json.loads(line) for line in traces_file.read_text().splitlines()]
+    spans = [span for span in spans if span["context"]["trace_id"] == trace_id]
+    spans_by_name = {span["name"]: span for span in spans}
+    assert set(spans_by_name) == {item.run_type, "parse", "qsub", "sbatch", "validation"}
+    root_span_id = spans_by_name[item.run_type]["context"]["span_id"]
+    assert spans_by_name[item.run_type]["parent_id"] is None
+    assert spans_by_name[item.run_type]["attributes"]["elaspic.unique_id"] == item.unique_id
+    assert spans_by_name["parse"]["parent_id"] == root_span_id
+    assert spans_by_name["qsub"]["parent_id"] == root_span_id
+    assert spans_by_name["sbatch"]["parent_id"] == spans_by_name["qsub"]["context"]["span_id"]
+    assert item.trace_span is None and item.stage_span is None
+
+
+@pytest.mark.asyncio
+async def test_item_spans_not_sampled(data_in):
+    js.setup_tracing("file", 0.0)
+    assert js.tracing.tracer is None
+
+    ds = js.DataStructures()
+    await js.submit_job(data_in, ds)
+    item = await ds.qsub_queue.get()
+    assert item.trace_span is None
+
+
+def test_file_span_exporter(tmp_path):
+    span_exporter = js.tracing.FileSpanExporter(tmp_path.joinpath("traces.jsonl").as_posix())
+    assert not span_exporter.out.closed
+    span_exporter.shutdown()
+    assert span_exporter.out.closed
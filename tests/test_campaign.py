@@ -0,0 +1,108 @@
+import json
+from pathlib import Path
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from elaspic_rest_api.campaign import read_campaign_mutations, submit_campaign
+
+DATA_DIR = Path(__file__).parent.joinpath("data").resolve(strict=True)
+
+
+def test_read_campaign_mutations(tmp_path):
+    tsv_file = tmp_path.joinpath("mutations.tsv")
+    tsv_file.write_text(
+        "A8MTB9.S184Y\nA8MTB9.S184Y\nA8MTB9.R218C\nP21397\tG49V\nQ9.A1G\nQ9.A2G\nQ9.A3G\n"
+    )
+
+    records = list(read_campaign_mutations(tsv_file.as_posix(), max_mutations=2))
+
+    assert [(record["protein_id"], record["mutations"]) for record in records] == [
+        ("A8MTB9", "S184Y,R218C"),
+        ("P21397", "G49V"),
+        ("Q9", "A1G,A2G"),
+        ("Q9", "A3G"),
+    ]
+
+
+def test_read_campaign_mutations_cosmic():
+    records = read_campaign_mutations(DATA_DIR.joinpath("cosmic_missing.tsv").as_posix())
+    record = next(records)
+    assert record["protein_id"] == "A8MTB9"
+    assert record["mutations"].startswith("S184Y,R218C")
+
+
+@pytest.mark.asyncio
+async def test_submit_campaign(tmp_path):
+    tsv_file = tmp_path.joinpath("mutations.tsv")
+    tsv_file.write_text("".join(f"P{i // 3}.A{i}G\n" for i in range(10)))
+    received = []
+
+    async def stream(request):
+        async for line in request.content:
+            received.append(json.loads(line))
+        return web.json_response({"status": "submitted", "job_id": request.query["job_id"]})
+
+    app = web.Application()
+    app.router.add_post("/stream", stream)
+    async with TestServer(app) as server:
+        result = await submit_campaign(
+            tsv_file.as_posix(), "campaign", str(server.make_url("/")), "token"
+        )
+
+    assert result == {"status": "submitted", "job_id": "campaign"}
+    assert [record["protein_id"] for record in received] == ["P0", "P1", "P2", "P3"]
+    assert received[0]["mutations"] == "A0G,A1G,A2G"
+
+
+@pytest.mark.asyncio
+async def test_submit_campaign_resumes_after_rejection(tmp_path):
+    tsv_file = tmp_path.joinpath("mutations.tsv")
+    tsv_file.write_text("".join(f"P{i}.A1G\n" for i in range(5)))
+    requests = []
+
+    async def stream(request):
+        received = []
+        requests.append(received)
+        async for line in request.content:
+            received.append(json.loads(line))
+            if len(requests) == 1 and len(received) == 3:
+                # The third record exceeds the admission limits
+                return web.json_response(
+                    {
+                        "status": "rejected",
+                        "reason": "token_max_items",
+                        "retry_after": 0,
+                        "job_id": request.query["job_id"],
+                        "num_mutations": 2,
+                        "num_errors": 1,
+                        "errors": [[1, "Invalid record"]],
+                        "resume_line": 3,
+                    },
+                    status=429,
+                    headers={"Retry-After": "0"},
+                )
+        return web.json_response(
+            {
+                "status": "submitted",
+                "job_id": request.query["job_id"],
+                "num_mutations": len(received),
+                "num_errors": 1,
+                "errors": [[2, "Invalid record"]],
+                "resume_line": None,
+            }
+        )
+
+    app = web.Application()
+    app.router.add_post("/stream", stream)
+    async with TestServer(app) as server:
+        result = await submit_campaign(
+            tsv_file.as_posix(), "campaign", str(server.make_url("/")), "token"
+        )
+
+    assert [record["protein_id"] for record in requests[1]] == ["P2", "P3", "P4"]
+    assert result["status"] == "submitted"
+    assert result["num_mutations"] == 5
+    assert result["num_errors"] == 2
+    assert result["errors"] == [[1, "Invalid record"], [4, "Invalid record"]]